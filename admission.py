@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Admission control for the detection path
+A concurrency limit in front of the detector that adapts to observed latency
+(AIMD): while admitted requests finish within the target latency the limit
+grows by about one per limit's worth of requests; when one is slower, or is
+dropped, the limit is cut by a constant factor. Requests over the limit wait
+in a bounded queue; once it is full they are rejected right away with a
+retry-after hint. Under overload the admitted requests keep a predictable
+latency instead of every request slowing down until clients time out.
+
+Works with threads (acquire) and asyncio (acquire_async):
+
+    ticket = controller.acquire(timeout=10)   # raises Overloaded
+    try:
+        result = detector.detect(image)
+    finally:
+        controller.release(ticket)
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+# Factor the limit is multiplied by after a slow or dropped request
+BACKOFF = 0.75
+
+# Weight of the newest latency sample in the running average
+LATENCY_SMOOTHING = 0.2
+
+
+class Overloaded(RuntimeError):
+    """Request rejected by admission control; retry after ``retry_after`` seconds"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """One request's place in line: queued until ``started`` is set"""
+
+    __slots__ = ("on_grant", "queued", "started", "dropped")
+
+    def __init__(self, on_grant: Optional[Callable[[], None]]):
+        self.on_grant = on_grant
+        self.queued = time.monotonic()
+        self.started: Optional[float] = None
+        self.dropped = False  # Set when the caller gave up; counts as overload
+
+    @property
+    def granted(self) -> bool:
+        return self.started is not None
+
+
+class AdmissionController:
+    """AIMD concurrency limit with a bounded wait queue, safe to share between threads"""
+
+    def __init__(
+        self,
+        target_latency_ms: float = 4000,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        max_queue: int = 16,
+        queue_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            target_latency_ms: Admitted requests slower than this shrink the limit
+            initial_limit: Concurrent requests admitted at start
+            min_limit: The limit never drops below this
+            max_limit: The limit never grows above this
+            max_queue: Requests waiting for admission; more are rejected at once
+            queue_timeout: Default seconds a request waits in the queue
+        """
+        self.target_latency = target_latency_ms / 1000
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self.latency: Optional[float] = None  # Smoothed seconds per admitted request
+        self.admitted = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+        self.decreases = 0
+
+    @classmethod
+    def from_settings(cls, settings: Dict, **overrides) -> "AdmissionController":
+        """Controller from Config.get_admission_settings(), with optional overrides"""
+        settings = dict(settings, **overrides)
+        return cls(
+            target_latency_ms=settings["target_latency_ms"],
+            initial_limit=settings["initial_limit"],
+            min_limit=settings["min_limit"],
+            max_limit=settings["max_limit"],
+            max_queue=settings["max_queue"],
+            queue_timeout=settings["queue_timeout"],
+        )
+
+    def _retry_after(self) -> int:
+        """Seconds until the queue ahead has likely drained (call with the lock held)"""
+        latency = self.latency or self.target_latency
+        return max(1, math.ceil(latency * (len(self._queue) + 1) / int(self.limit)))
+
+    def _grant_queued(self) -> List[Ticket]:
+        """Start queued tickets that fit under the limit (call with the lock held)"""
+        granted = []
+        now = time.monotonic()
+        while self._queue and self._in_flight < int(self.limit):
+            ticket = self._queue.popleft()
+            ticket.started = now
+            self._in_flight += 1
+            self.admitted += 1
+            granted.append(ticket)
+        return granted
+
+    def enter(self, on_grant: Optional[Callable[[], None]] = None) -> Ticket:
+        """
+        Admit a request now, or queue it
+
+        Args:
+            on_grant: Called (from the releasing thread) when a queued ticket
+                is admitted; not called for tickets admitted right away
+
+        Returns:
+            The ticket; check ``granted`` to see whether it has to wait
+
+        Raises:
+            Overloaded: The queue is full
+        """
+        ticket = Ticket(on_grant)
+        with self._lock:
+            if self._in_flight < int(self.limit) and not self._queue:
+                ticket.started = ticket.queued
+                self._in_flight += 1
+                self.admitted += 1
+            elif len(self._queue) < self.max_queue:
+                self._queue.append(ticket)
+            else:
+                self.rejected += 1
+                raise Overloaded(
+                    f"Too many requests ({self._in_flight} running, "
+                    f"{len(self._queue)} waiting)",
+                    self._retry_after(),
+                )
+        return ticket
+
+    def cancel(self, ticket: Ticket) -> bool:
+        """
+        Take a queued ticket out of line
+
+        Returns:
+            True if it was still queued; False if it was admitted meanwhile
+            (the caller then owns it and must release it)
+        """
+        with self._lock:
+            try:
+                self._queue.remove(ticket)
+            except ValueError:
+                return False
+            self.queue_timeouts += 1
+            return True
+
+    def _queue_timeout_error(self) -> Overloaded:
+        with self._lock:
+            retry_after = self._retry_after()
+        return Overloaded("Waited too long for admission", retry_after)
+
+    def acquire(self, timeout: Optional[float] = None) -> Ticket:
+        """
+        Wait for admission in a thread
+
+        Args:
+            timeout: Seconds to wait in the queue (default: queue_timeout)
+
+        Raises:
+            Overloaded: The queue is full, or admission took longer than the timeout
+        """
+        granted = threading.Event()
+        ticket = self.enter(granted.set)
+        if ticket.granted:
+            return ticket
+        if not granted.wait(self.queue_timeout if timeout is None else timeout):
+            if self.cancel(ticket):
+                raise self._queue_timeout_error()
+        return ticket
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> Ticket:
+        """Wait for admission on an event loop (see acquire)"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(
+                lambda: granted.done() or granted.set_result(None)
+            )
+
+        ticket = self.enter(wake)
+        if ticket.granted:
+            return ticket
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(granted),
+                self.queue_timeout if timeout is None else timeout,
+            )
+        except asyncio.TimeoutError:
+            if self.cancel(ticket):
+                raise self._queue_timeout_error()
+        except asyncio.CancelledError:
+            # Client went away while queued
+            if not self.cancel(ticket):
+                self.release(ticket, measure=False)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket, measure: bool = True):
+        """
+        Finish an admitted request and adapt the limit to its latency
+
+        Args:
+            ticket: The granted ticket
+            measure: False for requests that failed for reasons unrelated to
+                load (bad input); their latency says nothing about capacity
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight -= 1
+            if measure:
+                latency = now - ticket.started
+                if ticket.dropped or latency > self.target_latency:
+                    # One cut per round of requests: those admitted before the
+                    # last cut saw the old load and don't count again
+                    if ticket.started >= self._last_decrease:
+                        self.limit = max(self.min_limit, self.limit * BACKOFF)
+                        self._last_decrease = now
+                        self.decreases += 1
+                elif self._queue or self._in_flight + 1 >= int(self.limit):
+                    # Grow only while the limit is what holds requests back
+                    self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                if not ticket.dropped:
+                    self.latency = (
+                        latency
+                        if self.latency is None
+                        else self.latency
+                        + LATENCY_SMOOTHING * (latency - self.latency)
+                    )
+            granted = self._grant_queued()
+        for waiter in granted:
+            if waiter.on_grant is not None:
+                waiter.on_grant()
+
+    def stats(self) -> Dict:
+        """Current limit, load and counters"""
+        with self._lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self._in_flight,
+                "queued": len(self._queue),
+                "max_queue": self.max_queue,
+                "latency_ms": round(self.latency * 1000, 1) if self.latency else None,
+                "target_latency_ms": round(self.target_latency * 1000, 1),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "queue_timeouts": self.queue_timeouts,
+                "decreases": self.decreases,
+            }
@@ -5,11 +5,9 @@
 """
 
 import streamlit as st
-from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
-import tempfile
 import json
 import torch
 
@@ -21,7 +19,10 @@ try:
 except Exception:
     pass  # Older PyTorch versions don't have this
 
-from two_stage_detection import TwoStageDetector
+from two_stage_detection import load_image
+from admission import Overloaded
+from worker_pool import DetectorPool
+from config_loader import load_config
 
 # Конфигурация страницы
 st.set_page_config(
@@ -31,9 +32,11 @@ st.set_page_config(
 
 @st.cache_resource
 def load_detector(tree_model_path, defect_model_path):
-    """Загрузить детектор с кэшированием"""
+    """Запустить общий для всех сессий пул процессов детектора"""
     try:
-        detector = TwoStageDetector(tree_model_path, defect_model_path)
+        detector = DetectorPool.from_config(
+            tree_model_path, defect_model_path, load_config()
+        )
         return detector, None
     except Exception as e:
         return None, str(e)
@@ -132,12 +135,14 @@ def main():
         tree_model, defect_model = find_models()
 
         if tree_model and defect_model:
-            st.success("✅ Модель деревьев")
-            st.success("✅ Модель дефектов")
-            detector, error = load_detector(tree_model, defect_model)
+            with st.spinner("Загрузка и прогрев моделей..."):
+                detector, error = load_detector(tree_model, defect_model)
             if error:
                 st.error(f"Ошибка загрузки моделей: {error}")
                 detector = None
+            else:
+                st.success("✅ Модель деревьев")
+                st.success("✅ Модель дефектов")
         else:
             if not tree_model:
                 st.error("❌ Модель деревьев не найдена")
@@ -200,34 +205,43 @@ def main():
     )
 
     if uploaded_file is not None:
-        # Загрузить изображение
-        image = Image.open(uploaded_file)
-
-        # Временно сохранить
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            image.save(tmp_file.name)
-            tmp_path = tmp_file.name
+        # Декодировать изображение один раз, без временных файлов
+        image_bytes = uploaded_file.getvalue()
+        # Работникам пула передаются сжатые байты (их дешевле пересылать),
+        # декодированное изображение нужно только для отрисовки
+        image = load_image(image_bytes)
 
         # Отобразить оригинальное изображение
         col1, col2 = st.columns([1, 1])
 
         with col1:
             st.subheader("📷 Исходное изображение")
-            st.image(image, width=600)
+            st.image(image, width=600, channels="BGR")
 
         with col2:
             st.subheader("🎯 Результаты обнаружения")
 
+            # После первого запуска изменения ползунков пересчитываются сразу:
+            # детектор отвечает из кэша необработанных обнаружений
+            upload_key = (uploaded_file.name, uploaded_file.size)
             if st.button(
                 "🚀 Запустить обнаружение", type="primary", use_container_width=True
             ):
+                st.session_state["detected_upload"] = upload_key
+
+            if st.session_state.get("detected_upload") == upload_key:
                 with st.spinner("Выполняется двухэтапное обнаружение..."):
                     try:
                         # Выполнить обнаружение
-                        results = detector.detect(tmp_path, tree_conf, defect_conf)
+                        results = detector.detect(
+                            image_bytes,
+                            tree_conf,
+                            defect_conf,
+                            image_name=uploaded_file.name,
+                        )
 
                         # Создать визуализацию
-                        vis_img = detector.visualize(tmp_path, results)
+                        vis_img = detector.visualize(image, results)
                         vis_img_rgb = cv2.cvtColor(vis_img, cv2.COLOR_BGR2RGB)
 
                         # Отобразить
@@ -237,6 +251,12 @@ def main():
                         st.session_state["results"] = results
                         st.session_state["vis_img"] = vis_img
 
+                    except Overloaded as e:
+                        st.warning(
+                            f"Сервер перегружен, повторите попытку через {e.retry_after} с"
+                        )
+                    except TimeoutError:
+                        st.warning("Обнаружение заняло слишком много времени")
                     except Exception as e:
                         st.error(f"Ошибка при обнаружении: {str(e)}")
 
@@ -303,12 +323,6 @@ def main():
                     use_container_width=True,
                 )
 
-        # Очистка
-        try:
-            Path(tmp_path).unlink()
-        except:
-            pass
-
     else:
         st.info("👆 Пожалуйста, загрузите изображение для начала работы")
 
@@ -23,7 +23,8 @@ try:
 except Exception:
     pass  # Older PyTorch versions don't have this
 
-from two_stage_detection import TwoStageDetector
+from two_stage_detection import TwoStageDetector, load_image
+from config_loader import load_config
 
 
 class TreeDetectionApp:
@@ -324,7 +325,16 @@ class TreeDetectionApp:
                     defect_model = defect_model_alt
 
                 if tree_model.exists() and defect_model.exists():
-                    self.detector = TwoStageDetector(str(tree_model), str(defect_model))
+                    options = load_config().get_detector_options()
+                    warmup = options.pop("warmup")
+                    detector = TwoStageDetector(
+                        str(tree_model), str(defect_model), warmup=False, **options
+                    )
+                    # Report the models as ready only once they are warmed up
+                    if warmup:
+                        self.root.after(0, self.update_status, "Warming up models...")
+                        detector.warmup()
+                    self.detector = detector
                     self.root.after(0, self.on_models_loaded, True, True)
                 else:
                     self.root.after(
@@ -478,15 +488,19 @@ class TreeDetectionApp:
 
         def detect_in_thread():
             try:
+                # Decode once for detection and visualization
+                image = load_image(self.image_path)
+
                 # Run detection
                 results = self.detector.detect(
-                    self.image_path,
+                    image,
                     tree_conf=self.tree_conf.get(),
                     defect_conf=self.defect_conf.get(),
+                    image_name=self.image_path,
                 )
 
                 # Create visualization
-                vis_img = self.detector.visualize(self.image_path, results)
+                vis_img = self.detector.visualize(image, results)
 
                 self.root.after(0, self.on_detection_complete, results, vis_img)
 
@@ -11,9 +11,11 @@ import sys
 script_dir = Path(__file__).parent.resolve()
 sys.path.insert(0, str(script_dir))
 
-from two_stage_detection import TwoStageDetector
+from config_loader import load_config
+from two_stage_detection import DEFECTS_NOT_EVALUATED, load_image
+from admission import Overloaded
+from worker_pool import DetectorPool
 import cv2
-import numpy as np
 from PIL import Image
 import io
 
@@ -109,7 +111,7 @@ st.markdown("*Мобильная версия*")
 # Initialize detector
 @st.cache_resource
 def load_detector():
-    """Load models with caching"""
+    """Start the detector worker pool shared by all sessions"""
     script_dir = Path(__file__).parent.resolve()
     tree_model = (
         script_dir / "runs" / "detect" / "tree_detection_cpu" / "weights" / "best.pt"
@@ -123,13 +125,12 @@ def load_detector():
         / "best.pt"
     )
 
-    return TwoStageDetector(
-        tree_model_path=str(tree_model), defect_model_path=str(defect_model)
-    )
+    return DetectorPool.from_config(tree_model, defect_model, load_config())
 
 
 try:
-    detector = load_detector()
+    with st.spinner("Загрузка и прогрев моделей..."):
+        detector = load_detector()
 except Exception as e:
     st.error(f"⚠️ Ошибка загрузки моделей: {e}")
     st.stop()
@@ -159,17 +160,36 @@ with st.expander("⚙️ Настройки"):
 if uploaded_file is not None:
     # Show loading spinner
     with st.spinner("🔍 Анализ изображения..."):
-        # Load image
-        image = Image.open(uploaded_file)
-        img_array = np.array(image)
+        # Load image (BGR, like the other apps)
+        image_bytes = uploaded_file.getvalue()
+        # The pool workers get the encoded bytes (cheaper to send than
+        # pixels); the decoded image is only for drawing
+        image = load_image(image_bytes)
 
-        # Run detection
-        results = detector.detect(
-            img_array, tree_conf_threshold=tree_conf, defect_conf_threshold=defect_conf
-        )
+        # Run detection: within the latency budget a fast partial answer
+        # (smaller input size or trees only) beats an endless spinner
+        budget_ms = load_config().get_inference_settings()["mobile_budget_ms"]
+        try:
+            results = detector.detect(
+                image_bytes,
+                tree_conf,
+                defect_conf,
+                image_name=uploaded_file.name,
+                budget_ms=budget_ms or None,
+            )
+        except Overloaded as e:
+            st.warning(
+                f"⏳ Сервер перегружен, повторите попытку через {e.retry_after} с"
+            )
+            st.stop()
+        except TimeoutError:
+            st.warning("⏳ Анализ занял слишком много времени, попробуйте ещё раз")
+            st.stop()
 
         # Display results
-        annotated_img = results["annotated_image"]
+        annotated_img = cv2.cvtColor(
+            detector.visualize(image, results), cv2.COLOR_BGR2RGB
+        )
 
         # Show image (full width on mobile)
         st.image(
@@ -180,18 +200,37 @@ if uploaded_file is not None:
         st.markdown("### 📊 Результаты")
 
         col1, col2, col3 = st.columns(3)
-        col1.metric("Деревья", results["tree_count"])
-        col2.metric("Дефекты", results["defect_count"])
-        col3.metric("Всего", results["tree_count"] + results["defect_count"])
+        defects_evaluated = results.get("defects") != DEFECTS_NOT_EVALUATED
+        col1.metric("Деревья", results["total_trees"])
+        if defects_evaluated:
+            col2.metric("Дефекты", results["total_defects"])
+            col3.metric("Всего", results["total_trees"] + results["total_defects"])
+        else:
+            col2.metric("Дефекты", "—")
+            col3.metric("Всего", results["total_trees"])
+
+        if not defects_evaluated:
+            st.info("⚡ Быстрый ответ: найдены только деревья, дефекты не проверялись")
+        elif results.get("quality", "full") != "full":
+            st.info("⚡ Быстрый ответ: анализ в пониженном разрешении")
 
         # Detection details in expandable section
-        if results["detections"]:
-            with st.expander(f"🔍 Детали ({len(results['detections'])} обнаружений)"):
-                for i, det in enumerate(results["detections"], 1):
-                    conf_percent = det["confidence"] * 100
+        if results["trees"] or results["unmatched_defects"]:
+            with st.expander(f"🔍 Детали ({results['total_trees']} деревьев)"):
+                for i, tree in enumerate(results["trees"], 1):
+                    st.markdown(
+                        f"**{i}.** {tree['type']} (дерево) - "
+                        f"{tree['confidence'] * 100:.1f}%"
+                    )
+                    for defect in tree["defects"]:
+                        st.markdown(
+                            f"  - {defect['type']} (дефект) - "
+                            f"{defect['confidence'] * 100:.1f}%"
+                        )
+                for defect in results["unmatched_defects"]:
                     st.markdown(
-                        f"**{i}.** {det['class_name']} "
-                        f"({det['type']}) - {conf_percent:.1f}%"
+                        f"- {defect['class']} (дефект вне деревьев) - "
+                        f"{defect['confidence'] * 100:.1f}%"
                     )
 
         # Download button
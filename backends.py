@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Inference backends for the YOLO models
+Loads a trained best.pt as eager PyTorch, an exported ONNX Runtime or OpenVINO
+model (FP32, or INT8 from quantize_models.py), or a torch.compile'd model. Exported artifacts are cached next to the
+weights, and any backend that is unavailable, fails to export or disagrees
+with eager PyTorch falls back to eager PyTorch. PyTorch models can also run
+in bf16/fp16 autocast with a channels-last memory layout, and be loaded from a
+fused startup snapshot.
+"""
+
+import functools
+import importlib.util
+import os
+from pathlib import Path
+from typing import Tuple
+
+import torch
+from ultralytics import YOLO
+from ultralytics.utils import DEFAULT_CFG_DICT
+
+from result_cache import file_digest
+
+BACKENDS = ("torch", "onnx", "openvino", "openvino_int8", "torch_compile")
+
+# Runtime package each backend needs
+_RUNTIMES = {
+    "onnx": "onnxruntime",
+    "openvino": "openvino",
+    "openvino_int8": "openvino",
+    "torch_compile": None,
+}
+
+PRECISIONS = ("fp32", "bf16", "fp16")
+
+_AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
+
+# oneDNN's check for native bf16/fp16 kernels (AVX512-BF16/AMX, AVX512-FP16)
+_CPU_SUPPORT_CHECKS = {
+    "bf16": "_is_mkldnn_bf16_supported",
+    "fp16": "_is_mkldnn_fp16_supported",
+}
+
+
+def compile_supported() -> bool:
+    """Whether the installed ultralytics predictor has the ``compile`` option"""
+    return "compile" in DEFAULT_CFG_DICT
+
+
+def model_input_size(model: YOLO, default: int = 640) -> int:
+    """Square input size the model was trained at"""
+    imgsz = model.overrides.get("imgsz", default)
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = max(imgsz)
+    return int(imgsz)
+
+
+def model_stride(model: YOLO, default: int = 32) -> int:
+    """Largest stride of the model's detection head (exported models: the YOLO default)"""
+    stride = getattr(model.model, "stride", None)
+    if stride is None:
+        return default
+    return int(torch.as_tensor(stride).max())
+
+
+def artifact_path(weights: Path, backend: str) -> Path:
+    """Where ultralytics' exporter writes a backend's model for these weights"""
+    if backend == "onnx":
+        return weights.with_suffix(".onnx")
+    if backend == "openvino":
+        return weights.parent / f"{weights.stem}_openvino_model"
+    if backend == "openvino_int8":
+        return weights.parent / f"{weights.stem}_int8_openvino_model"
+    return weights
+
+
+def snapshot_path(weights: Path) -> Path:
+    """Where the fused startup snapshot of these weights is cached"""
+    return weights.parent / f"{weights.stem}.snapshot.pt"
+
+
+def digest_record(target: Path) -> Path:
+    """File next to an exported model that holds the digest of its source weights"""
+    return target.with_name(f"{target.name}.weights_digest")
+
+
+def record_source(target: Path, weights: Path):
+    """Remember which weights an exported model was made from"""
+    digest_record(target).write_text(file_digest(str(weights)))
+
+
+def is_current(target: Path, weights: Path) -> bool:
+    """
+    Whether an exported model exists and was made from these exact weights
+
+    Compared by content: a copied, restored or checked-out best.pt can keep
+    an older modification time than a stale artifact.
+    """
+    record = digest_record(target)
+    if not target.exists() or not record.exists():
+        return False
+    return record.read_text().strip() == file_digest(str(weights))
+
+
+def prepare_snapshot(weights: Path) -> Path:
+    """
+    Fuse a checkpoint once and save it as a startup snapshot
+
+    The snapshot holds the fused fp32 network in eval mode and the training
+    arguments only (no EMA, optimizer or training state), so loading it
+    skips Conv+BN fusion and the fp16 to fp32 conversion. It records the
+    digest of the weights it was made from and is rebuilt when they differ.
+    It is written atomically, so processes starting together don't read a
+    partial file.
+
+    Returns:
+        Path of the snapshot
+    """
+    target = snapshot_path(weights)
+    digest = file_digest(str(weights))
+    if target.exists():
+        try:
+            snapshot = torch.load(target, map_location="cpu", weights_only=False)
+            if snapshot.get("weights_digest") == digest:
+                return target
+        except Exception:
+            pass  # Unreadable snapshot: rebuild it
+
+    print(f"Preparing startup snapshot of {weights} (one-time)...")
+    model = YOLO(str(weights))
+    network = model.model.float().eval()
+    network.fuse(verbose=False)
+    for param in network.parameters():
+        param.requires_grad = False
+    partial = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    torch.save(
+        {
+            "model": network,
+            "train_args": model.ckpt.get("train_args", {}),
+            "weights_digest": digest,
+        },
+        partial,
+    )
+    os.replace(partial, target)
+    return target
+
+
+def export_model(weights: Path, backend: str, imgsz: int) -> Path:
+    """
+    Export weights for a backend, reusing an artifact made from the same weights
+
+    Exports use a dynamic batch dimension so detect_batch() and tiling can
+    send several images per forward pass.
+
+    Returns:
+        Path of the exported model
+    """
+    target = artifact_path(weights, backend)
+    if is_current(target, weights):
+        return target
+
+    print(f"Exporting {weights} to {backend} (one-time)...")
+    exported = Path(YOLO(str(weights)).export(format=backend, imgsz=imgsz, dynamic=True))
+    record_source(exported, weights)
+    return exported
+
+
+def raw_output(model: YOLO, inputs: torch.Tensor) -> torch.Tensor:
+    """Model head output before NMS (batch x (4 + classes) x anchors)"""
+    model(inputs[:1], verbose=False)  # Builds the predictor on first use
+    with torch.no_grad():
+        output = model.predictor.model(inputs)
+    if isinstance(output, (list, tuple)):
+        output = output[0]
+    return torch.as_tensor(output).float()
+
+
+def outputs_match(
+    reference: YOLO,
+    candidate: YOLO,
+    imgsz: int,
+    box_atol: float = 1.0,
+    score_atol: float = 0.01,
+) -> Tuple[bool, float, float]:
+    """
+    Compare two models' raw outputs on a fixed probe batch
+
+    Args:
+        reference: Eager PyTorch model
+        candidate: Model on another backend
+        imgsz: Input size
+        box_atol: Allowed box coordinate difference in pixels
+        score_atol: Allowed class score difference
+
+    Returns:
+        (within tolerance, max box difference, max score difference)
+    """
+    generator = torch.Generator().manual_seed(0)
+    probe = torch.cat(
+        [
+            torch.rand(1, 3, imgsz, imgsz, generator=generator),
+            torch.full((1, 3, imgsz, imgsz), 0.5),
+        ]
+    )
+    expected = raw_output(reference, probe)
+    actual = raw_output(candidate, probe)
+    if expected.shape != actual.shape:
+        return False, float("inf"), float("inf")
+
+    diff = (expected - actual).abs()
+    box_diff = float(diff[:, :4].max())
+    score_diff = float(diff[:, 4:].max())
+    return box_diff <= box_atol and score_diff <= score_atol, box_diff, score_diff
+
+
+def cpu_supports(precision: str) -> bool:
+    """Whether this CPU has native kernels for a precision"""
+    if precision == "fp32":
+        return True
+    if not torch.backends.mkldnn.is_available():
+        return False
+    try:
+        return bool(getattr(torch.ops.mkldnn, _CPU_SUPPORT_CHECKS[precision])())
+    except (AttributeError, RuntimeError):
+        return False  # Older PyTorch without the check
+
+
+def resolve_precision(precision: str) -> str:
+    """
+    Precision to actually run at on this CPU
+
+    Emulated bf16/fp16 is much slower than fp32, so an unsupported precision
+    falls back to fp32 with a warning.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Unknown precision '{precision}', expected one of {PRECISIONS}"
+        )
+    if not cpu_supports(precision):
+        print(f"Warning: this CPU has no native {precision} support, using fp32")
+        return "fp32"
+    return precision
+
+
+def _to_fp32(output):
+    """Cast (nested) autocast outputs back to fp32 before NMS and box scaling"""
+    if isinstance(output, torch.Tensor):
+        return output.float() if output.is_floating_point() else output
+    if isinstance(output, (list, tuple)):
+        return type(output)(_to_fp32(item) for item in output)
+    if isinstance(output, dict):
+        return {key: _to_fp32(value) for key, value in output.items()}
+    return output
+
+
+def set_precision(
+    model: YOLO, backend: str, precision: str = "fp32", channels_last: bool = False
+) -> str:
+    """
+    Run a PyTorch model's forward pass in reduced precision and/or channels-last
+
+    Only the network runs under autocast: its outputs are cast back to fp32,
+    so NMS and the mapping of boxes to image pixels keep full precision.
+    Exported backends keep the precision they were exported with.
+
+    Args:
+        model: Model returned by load_model()
+        backend: Backend the model was loaded with
+        precision: One of PRECISIONS, already checked with resolve_precision()
+        channels_last: Store weights and inputs in NHWC order (faster oneDNN
+            convolutions on x86 CPUs)
+
+    Returns:
+        Precision the model runs at
+    """
+    if backend not in ("torch", "torch_compile"):
+        if precision != "fp32" or channels_last:
+            print(f"Warning: precision/channels_last apply to torch only, ignored for {backend}")
+        return "fp32"
+    if precision == "fp32" and not channels_last:
+        return precision
+
+    network = model.model
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    if channels_last:
+        # Fuse first: fusing Conv+BN later would create new (NCHW) weights
+        network.fuse(verbose=False)
+        network.to(memory_format=memory_format)
+        if "channels_last" in DEFAULT_CFG_DICT:
+            model.overrides["channels_last"] = True  # Keep the predictor from undoing it
+
+    forward = network.forward
+    dtype = _AUTOCAST_DTYPES.get(precision)
+
+    @functools.wraps(forward)
+    def reduced_forward(x, *args, **kwargs):
+        if isinstance(x, torch.Tensor):
+            x = x.contiguous(memory_format=memory_format)
+        if dtype is None:
+            return forward(x, *args, **kwargs)
+        with torch.autocast("cpu", dtype=dtype):
+            return _to_fp32(forward(x, *args, **kwargs))
+
+    network.forward = reduced_forward
+    return precision
+
+
+def load_model(
+    weights: str,
+    backend: str = "torch",
+    verify: bool = True,
+    box_atol: float = 1.0,
+    score_atol: float = 0.01,
+    snapshot: bool = False,
+) -> Tuple[YOLO, str, int]:
+    """
+    Load a trained model on the requested backend
+
+    Falls back to eager PyTorch (with a warning) when the runtime is not
+    installed, the export fails, or outputs differ beyond the tolerance.
+    "openvino_int8" loads the model made by quantize_models.py and is not
+    held to the tolerance.
+
+    Args:
+        weights: Path to a .pt checkpoint
+        backend: One of BACKENDS
+        verify: Check the backend's outputs against eager PyTorch
+        box_atol: Allowed box coordinate difference in pixels
+        score_atol: Allowed class score difference
+        snapshot: Load the torch backends from a fused startup snapshot
+            (see prepare_snapshot), falling back to the weights on failure
+
+    Returns:
+        (model, backend actually used, model input size)
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    if backend == "torch_compile" and not compile_supported():
+        # Older releases reject the unknown argument when building the predictor
+        print(
+            "Warning: this ultralytics version cannot compile the predictor "
+            f"(upgrade ultralytics), using torch for {weights}"
+        )
+        backend = "torch"
+
+    if snapshot and backend in ("torch", "torch_compile"):
+        try:
+            model = YOLO(str(prepare_snapshot(Path(weights))))
+            if backend == "torch_compile":
+                model.overrides["compile"] = True  # Compiled by the predictor
+            return model, backend, model_input_size(model)
+        except Exception as e:
+            print(f"Warning: startup snapshot failed ({e}), loading {weights}")
+
+    reference = YOLO(weights)
+    imgsz = model_input_size(reference)
+    if backend == "torch":
+        return reference, backend, imgsz
+
+    runtime = _RUNTIMES[backend]
+    if runtime and importlib.util.find_spec(runtime) is None:
+        print(f"Warning: {runtime} is not installed, using torch for {weights}")
+        return reference, "torch", imgsz
+
+    if backend == "openvino_int8":
+        # Quantization needs calibration images, so it is never done implicitly
+        quantized = artifact_path(Path(weights), backend)
+        if not is_current(quantized, Path(weights)):
+            print(
+                f"Warning: no up-to-date INT8 model for {weights} "
+                f"(run python quantize_models.py), using torch"
+            )
+            return reference, "torch", imgsz
+
+    try:
+        if backend == "torch_compile":
+            model = YOLO(weights)
+            model.overrides["compile"] = True  # Compiled by the predictor
+        elif backend == "openvino_int8":
+            model = YOLO(str(quantized), task="detect")
+        else:
+            model = YOLO(str(export_model(Path(weights), backend, imgsz)), task="detect")
+
+        if verify:
+            matched, box_diff, score_diff = outputs_match(
+                reference, model, imgsz, box_atol, score_atol
+            )
+            print(
+                f"  {backend} vs torch: max box diff {box_diff:.4f}px, "
+                f"max score diff {score_diff:.5f}"
+            )
+            # INT8 is expected to drift; quantize_models.py checks its accuracy
+            if not matched and backend != "openvino_int8":
+                print(f"Warning: {backend} outputs exceed tolerance, using torch")
+                return reference, "torch", imgsz
+    except Exception as e:
+        print(f"Warning: {backend} backend failed ({e}), using torch")
+        return reference, "torch", imgsz
+
+    return model, backend, imgsz
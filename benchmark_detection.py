@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark two-stage detection latency
+Compares detector modes (e.g. sequential vs concurrent stages) at several
+CPU thread counts and prints a wall-clock summary table.
+
+To reproduce an N-core server on a bigger machine, pin the process, e.g.:
+    taskset -c 0-3 python benchmark_detection.py images/ --threads 4
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+from pathlib import Path
+
+import torch
+
+from two_stage_detection import TwoStageDetector, load_image
+
+DEFAULT_TREE_MODEL = "runs/detect/tree_detection_cpu/weights/best.pt"
+DEFAULT_DEFECT_MODEL = "runs/defects/tree_defects_detection2/weights/best.pt"
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".bmp"}
+
+# Detector modes to compare: name -> TwoStageDetector keyword arguments
+MODES = {
+    "sequential": {"concurrent": False},
+    "concurrent": {"concurrent": True},
+    "cascade": {"cascade": True},
+    "onnx": {"backend": "onnx"},
+    "openvino": {"backend": "openvino"},
+    "torch_compile": {"backend": "torch_compile"},
+    "bf16": {"precision": "bf16", "channels_last": True},
+    "unified": {},  # Needs --unified-model
+}
+
+
+def collect_images(sources, limit):
+    """Expand files and directories into a list of image paths"""
+    paths = []
+    for source in sources:
+        source = Path(source)
+        if source.is_dir():
+            paths.extend(
+                sorted(p for p in source.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+            )
+        elif source.exists():
+            paths.append(source)
+    return paths[:limit] if limit else paths
+
+
+def time_detector(detector, images, runs, warmup, batch_size=1):
+    """
+    Return per-image latencies in milliseconds
+
+    With batch_size > 1 images go through detect_batch() and each image is
+    charged its share of the batch time (i.e. throughput, not latency).
+    """
+    latencies = []
+    # detect() logs every stage; keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for image in images[:warmup]:
+            detector.detect(image)
+        for _ in range(runs):
+            if batch_size > 1:
+                for start_idx in range(0, len(images), batch_size):
+                    chunk = images[start_idx : start_idx + batch_size]
+                    start = time.perf_counter()
+                    detector.detect_batch(chunk, batch_size=batch_size)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    latencies.extend([elapsed / len(chunk)] * len(chunk))
+                continue
+            for image in images:
+                start = time.perf_counter()
+                detector.detect(image)
+                latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark two-stage detection")
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument("--tree-model", default=DEFAULT_TREE_MODEL)
+    parser.add_argument("--defect-model", default=DEFAULT_DEFECT_MODEL)
+    parser.add_argument(
+        "--unified-model", help="Single-pass model for the 'unified' mode"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[4, 8, 16],
+        help="Total CPU thread counts to test (default: 4 8 16)",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["sequential", "concurrent"],
+        choices=list(MODES),
+        help="Detector modes to compare",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Use detect_batch() with this batch size (reports ms per image)",
+    )
+    parser.add_argument("--runs", type=int, default=3, help="Timed passes per image")
+    parser.add_argument("--warmup", type=int, default=2, help="Warm-up images")
+    parser.add_argument("--limit", type=int, default=20, help="Max images to use")
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.images, args.limit)
+    if not image_paths:
+        print("Error: No images found")
+        return
+    if "unified" in args.modes and not args.unified_model:
+        print("Error: The unified mode needs --unified-model")
+        return
+
+    print(f"Decoding {len(image_paths)} images...")
+    images = [load_image(p) for p in image_paths]
+
+    print(f"CPU threads available: {torch.get_num_threads()}")
+    rows = []
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        baseline = None
+        for mode in args.modes:
+            print(f"\nBenchmarking {mode} with {threads} threads...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                detector = TwoStageDetector(
+                    args.tree_model,
+                    args.defect_model,
+                    num_threads=threads,
+                    unified_model_path=args.unified_model if mode == "unified" else None,
+                    **MODES[mode],
+                )
+            latencies = time_detector(
+                detector, images, args.runs, args.warmup, args.batch_size
+            )
+            median = statistics.median(latencies)
+            if baseline is None:
+                baseline = median
+            rows.append(
+                (threads, mode, median, statistics.mean(latencies), baseline / median)
+            )
+
+    print(f"\n{'='*64}")
+    print(f"{'Threads':>8} {'Mode':<14} {'Median ms':>10} {'Mean ms':>10} {'Speedup':>10}")
+    print(f"{'-'*64}")
+    for threads, mode, median, mean, speedup in rows:
+        print(f"{threads:>8} {mode:<14} {median:>10.1f} {mean:>10.1f} {speedup:>9.2f}x")
+    print(f"{'='*64}")
+    print(f"Speedup is relative to the first mode ({args.modes[0]}) at each thread count")
+
+
+if __name__ == "__main__":
+    main()
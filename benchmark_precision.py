@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Benchmark reduced-precision and channels-last inference per stage
+Times the tree (stage 1) and defect (stage 2) forward passes at each precision
+and memory layout, and compares their detections with fp32: the share of fp32
+boxes reproduced (IoU >= 0.5, same class) and the largest confidence change.
+
+Usage:
+    python benchmark_precision.py dataset/test/images --precisions fp32 bf16 --threads 8
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import time
+
+import numpy as np
+import torch
+
+from backends import PRECISIONS, cpu_supports
+from benchmark_detection import (
+    DEFAULT_DEFECT_MODEL,
+    DEFAULT_TREE_MODEL,
+    collect_images,
+)
+from spatial_index import GridIndex
+from two_stage_detection import TwoStageDetector, box_iou, load_image
+
+LAYOUTS = ("default", "channels_last")
+
+
+def agreement(reference, candidate, iou_threshold=0.5):
+    """
+    Compare one stage's predictions with the fp32 predictions
+
+    Returns:
+        (reference boxes reproduced, reference boxes, max confidence change
+        of the reproduced boxes)
+    """
+    found = total = 0
+    max_delta = 0.0
+    for (ref_boxes, ref_conf, ref_cls), (boxes, conf, cls) in zip(reference, candidate):
+        total += len(ref_boxes)
+        if len(ref_boxes) == 0 or len(boxes) == 0:
+            continue
+        cand_idx, ref_idx = GridIndex(boxes).candidate_pairs(ref_boxes)
+        iou = box_iou(ref_boxes[ref_idx], boxes[cand_idx])
+        hit = (iou >= iou_threshold) & (ref_cls[ref_idx] == cls[cand_idx])
+        if not hit.any():
+            continue
+        # Pair each reference box with its best-overlapping candidate
+        order = np.argsort(-iou[hit], kind="stable")
+        ref_hit, cand_hit = ref_idx[hit][order], cand_idx[hit][order]
+        ref_hit, first = np.unique(ref_hit, return_index=True)
+        found += len(ref_hit)
+        delta = np.abs(ref_conf[ref_hit] - conf[cand_hit[first]])
+        max_delta = max(max_delta, float(delta.max()))
+    return found, total, max_delta
+
+
+def time_stages(detector, batches, tree_conf, defect_conf, runs, warmup):
+    """
+    Per-image forward pass latencies of both stages on preprocessed batches
+
+    Returns:
+        ({"tree": [ms, ...], "defect": [ms, ...]}, (tree predictions, defect predictions))
+    """
+    stages = {
+        "tree": (detector.tree_model, detector.tree_imgsz, tree_conf),
+        "defect": (detector.defect_model, detector.defect_imgsz, defect_conf),
+    }
+    latencies = {stage: [] for stage in stages}
+    predictions = {stage: [] for stage in stages}
+    for stage, (model, imgsz, conf) in stages.items():
+        for inputs, shapes in batches[:warmup]:
+            detector._predict(model, inputs[imgsz], conf, shapes)
+        for run in range(runs):
+            for inputs, shapes in batches:
+                start = time.perf_counter()
+                preds = detector._predict(model, inputs[imgsz], conf, shapes)
+                latencies[stage].append((time.perf_counter() - start) * 1000)
+                if run == 0:
+                    predictions[stage].extend(preds)
+    return latencies, (predictions["tree"], predictions["defect"])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark bf16/fp16 and channels-last inference per stage"
+    )
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument("--tree-model", default=DEFAULT_TREE_MODEL)
+    parser.add_argument("--defect-model", default=DEFAULT_DEFECT_MODEL)
+    parser.add_argument(
+        "--precisions", nargs="+", default=list(PRECISIONS), choices=PRECISIONS
+    )
+    parser.add_argument(
+        "--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS
+    )
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads (0 = default)")
+    parser.add_argument("--tree-conf", type=float, default=0.25)
+    parser.add_argument("--defect-conf", type=float, default=0.05)
+    parser.add_argument("--runs", type=int, default=3, help="Timed passes per image")
+    parser.add_argument("--warmup", type=int, default=2, help="Warm-up images")
+    parser.add_argument("--limit", type=int, default=20, help="Max images to use")
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.images, args.limit)
+    if not image_paths:
+        print("Error: No images found")
+        return
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    print(f"Decoding {len(image_paths)} images...")
+    images = [load_image(p) for p in image_paths]
+    print(f"CPU threads: {torch.get_num_threads()}")
+    for precision in PRECISIONS[1:]:
+        print(f"Native {precision}: {'yes' if cpu_supports(precision) else 'no'}")
+
+    # fp32 in the default layout is the reference for speed and accuracy
+    configs = [("fp32", "default")] + [
+        (precision, layout)
+        for precision in args.precisions
+        for layout in args.layouts
+        if (precision, layout) != ("fp32", "default")
+    ]
+
+    rows = []
+    reference = None
+    baseline = {}
+    for precision, layout in configs:
+        name = f"{precision}/{layout}"
+        if not cpu_supports(precision):
+            print(f"\nSkipping {name}: not supported natively by this CPU")
+            continue
+        print(f"\nBenchmarking {name}...")
+        with contextlib.redirect_stdout(io.StringIO()):
+            detector = TwoStageDetector(
+                args.tree_model,
+                args.defect_model,
+                precision=precision,
+                channels_last=layout == "channels_last",
+            )
+        # Letterbox once; the benchmark times the forward passes only
+        batches = [(detector.preprocess([img]), [img.shape]) for img in images]
+        latencies, predictions = time_stages(
+            detector, batches, args.tree_conf, args.defect_conf, args.runs, args.warmup
+        )
+        if reference is None:
+            reference = predictions
+        for stage, stage_ref, stage_preds in zip(
+            ("tree", "defect"), reference, predictions
+        ):
+            median = statistics.median(latencies[stage])
+            baseline.setdefault(stage, median)
+            found, total, max_delta = agreement(stage_ref, stage_preds)
+            rows.append(
+                (stage, name, median, baseline[stage] / median, found, total, max_delta)
+            )
+
+    print(f"\n{'='*78}")
+    print(
+        f"{'Stage':<8} {'Config':<20} {'Median ms':>10} {'Speedup':>8} "
+        f"{'Boxes kept':>16} {'Max conf diff':>13}"
+    )
+    print(f"{'-'*78}")
+    for stage, name, median, speedup, found, total, max_delta in sorted(
+        rows, key=lambda row: row[0] != "tree"
+    ):
+        kept = f"{found}/{total} ({found / total:.1%})" if total else "-"
+        print(
+            f"{stage:<8} {name:<20} {median:>10.1f} {speedup:>7.2f}x "
+            f"{kept:>16} {max_delta:>13.4f}"
+        )
+    print(f"{'='*78}")
+    print("Speedup and boxes kept are relative to fp32/default for the same stage")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@ class Config:
         self.defaults = {
             "model": {
                 "model_path": "",
+                "unified_model_path": "",
             },
             "paths": {
                 "project_root": os.getcwd(),
@@ -31,11 +32,65 @@ class Config:
                 "min_confidence": "0.05",
                 "max_confidence": "0.95",
                 "confidence_step": "0.05",
+                "mobile_budget_ms": "3000",
             },
             "display": {
                 "max_example_images": "3",
                 "default_image_width": "640",
             },
+            "performance": {
+                "concurrent_stages": "false",
+                "torch_threads": "0",
+                "assignment": "auto",
+                "cascade": "false",
+                "backend": "torch",
+                "verify_backend": "true",
+                "precision": "fp32",
+                "channels_last": "false",
+                "snapshot": "true",
+                "warmup": "true",
+                "reduced_scale": "0.6",
+            },
+            "cache": {
+                "enabled": "true",
+                "path": ".cache/detections.sqlite3",
+                "max_size_mb": "512",
+            },
+            "orthomosaic": {
+                "tile_size": "640",
+                "overlap": "0.2",
+                "memory_budget_mb": "4096",
+                "overview_max_side": "4096",
+                "coarse_scale": "0",
+                "coarse_conf": "0.1",
+            },
+            "server": {
+                "host": "127.0.0.1",
+                "port": "8000",
+                "max_batch_size": "8",
+                "max_wait_ms": "10",
+                "max_body_mb": "20",
+            },
+            "jobs": {
+                "database": ".cache/jobs.sqlite3",
+                "spool_directory": ".cache/job_images",
+                "batch_size": "8",
+                "lease_seconds": "300",
+                "page_size": "100",
+                "server_worker": "true",
+            },
+            "pool": {
+                "workers": "2",
+                "timeout_s": "120",
+            },
+            "admission": {
+                "target_latency_ms": "4000",
+                "initial_limit": "4",
+                "min_limit": "1",
+                "max_limit": "32",
+                "max_queue": "16",
+                "queue_timeout_s": "30",
+            },
         }
 
         self.load_config()
@@ -81,6 +136,15 @@ class Config:
                 return int(fallback)
             return 0
 
+    def get_bool(self, section, option, fallback=None):
+        """Get boolean configuration value"""
+        value = str(self.get(section, option, fallback)).strip().lower()
+        if value in ("1", "true", "yes", "on"):
+            return True
+        if value in ("0", "false", "no", "off"):
+            return False
+        return bool(fallback)
+
     def get_path(self, section, option, fallback=None):
         """Get path configuration value and resolve it"""
         value = self.get(section, option, fallback)
@@ -117,6 +181,13 @@ class Config:
         # Try to find latest model
         return self.find_latest_model()
 
+    def get_unified_model_path(self):
+        """Get the unified (single-pass) model path, or None for two models"""
+        path = self.get_path("model", "unified_model_path")
+        if path and path.exists():
+            return str(path)
+        return None
+
     def find_latest_model(self):
         """Find the most recently trained model"""
         runs_dir = self.get_path("paths", "runs_directory")
@@ -156,6 +227,7 @@ class Config:
             "min_confidence": self.get_float("inference", "min_confidence", 0.05),
             "max_confidence": self.get_float("inference", "max_confidence", 0.95),
             "confidence_step": self.get_float("inference", "confidence_step", 0.05),
+            "mobile_budget_ms": self.get_float("inference", "mobile_budget_ms", 3000),
         }
 
     def get_display_settings(self):
@@ -165,6 +237,119 @@ class Config:
             "default_image_width": self.get_int("display", "default_image_width", 640),
         }
 
+    def get_performance_settings(self):
+        """Get all performance settings as a dictionary"""
+        return {
+            "concurrent_stages": self.get_bool(
+                "performance", "concurrent_stages", False
+            ),
+            "torch_threads": self.get_int("performance", "torch_threads", 0),
+            "assignment": self.get("performance", "assignment", "auto").strip(),
+            "cascade": self.get_bool("performance", "cascade", False),
+            "backend": self.get("performance", "backend", "torch").strip(),
+            "verify_backend": self.get_bool("performance", "verify_backend", True),
+            "precision": self.get("performance", "precision", "fp32").strip(),
+            "channels_last": self.get_bool("performance", "channels_last", False),
+            "snapshot": self.get_bool("performance", "snapshot", True),
+            "warmup": self.get_bool("performance", "warmup", True),
+            "reduced_scale": self.get_float("performance", "reduced_scale", 0.6),
+        }
+
+    def get_detector_options(self):
+        """Get TwoStageDetector keyword arguments from the performance settings"""
+        performance = self.get_performance_settings()
+        return {
+            "concurrent": performance["concurrent_stages"],
+            "num_threads": performance["torch_threads"] or None,
+            "assignment": performance["assignment"],
+            "cascade": performance["cascade"],
+            "backend": performance["backend"],
+            "verify_backend": performance["verify_backend"],
+            "unified_model_path": self.get_unified_model_path(),
+            "precision": performance["precision"],
+            "channels_last": performance["channels_last"],
+            "snapshot": performance["snapshot"],
+            "warmup": performance["warmup"],
+            "reduced_scale": performance["reduced_scale"],
+            # Run once at the lowest slider value; higher thresholds are filtered
+            "raw_conf": self.get_float("inference", "min_confidence", 0.05),
+            **self.get_cache_options(),
+        }
+
+    def get_cache_settings(self):
+        """Get persistent result cache settings as a dictionary"""
+        return {
+            "enabled": self.get_bool("cache", "enabled", True),
+            "path": self.get_path("cache", "path", ".cache/detections.sqlite3"),
+            "max_size_mb": self.get_float("cache", "max_size_mb", 512),
+        }
+
+    def get_cache_options(self):
+        """Get TwoStageDetector keyword arguments for the persistent cache"""
+        cache = self.get_cache_settings()
+        return {
+            "cache_path": str(cache["path"]) if cache["enabled"] else None,
+            "cache_size_mb": cache["max_size_mb"],
+        }
+
+    def get_orthomosaic_settings(self):
+        """Get all orthomosaic (out-of-core) settings as a dictionary"""
+        return {
+            "tile_size": self.get_int("orthomosaic", "tile_size", 640),
+            "overlap": self.get_float("orthomosaic", "overlap", 0.2),
+            "memory_budget_mb": self.get_float(
+                "orthomosaic", "memory_budget_mb", 4096
+            ),
+            "overview_max_side": self.get_int(
+                "orthomosaic", "overview_max_side", 4096
+            ),
+            "coarse_scale": self.get_float("orthomosaic", "coarse_scale", 0),
+            "coarse_conf": self.get_float("orthomosaic", "coarse_conf", 0.1),
+        }
+
+    def get_server_settings(self):
+        """Get HTTP inference service settings as a dictionary"""
+        return {
+            "host": self.get("server", "host", "127.0.0.1").strip(),
+            "port": self.get_int("server", "port", 8000),
+            "max_batch_size": self.get_int("server", "max_batch_size", 8),
+            "max_wait_ms": self.get_float("server", "max_wait_ms", 10),
+            "max_body_mb": self.get_float("server", "max_body_mb", 20),
+        }
+
+    def get_job_settings(self):
+        """Get durable job queue settings as a dictionary"""
+        return {
+            "database": self.get_path("jobs", "database", ".cache/jobs.sqlite3"),
+            "spool_directory": self.get_path(
+                "jobs", "spool_directory", ".cache/job_images"
+            ),
+            "batch_size": self.get_int("jobs", "batch_size", 8),
+            "lease_seconds": self.get_float("jobs", "lease_seconds", 300),
+            "page_size": self.get_int("jobs", "page_size", 100),
+            "server_worker": self.get_bool("jobs", "server_worker", True),
+        }
+
+    def get_pool_settings(self):
+        """Get Streamlit worker pool settings as a dictionary"""
+        return {
+            "workers": self.get_int("pool", "workers", 2),
+            "timeout": self.get_float("pool", "timeout_s", 120),
+        }
+
+    def get_admission_settings(self):
+        """Get admission control settings as a dictionary"""
+        return {
+            "target_latency_ms": self.get_float(
+                "admission", "target_latency_ms", 4000
+            ),
+            "initial_limit": self.get_int("admission", "initial_limit", 4),
+            "min_limit": self.get_int("admission", "min_limit", 1),
+            "max_limit": self.get_int("admission", "max_limit", 32),
+            "max_queue": self.get_int("admission", "max_queue", 16),
+            "queue_timeout": self.get_float("admission", "queue_timeout_s", 30),
+        }
+
     def save_config(self):
         """Save current configuration to file"""
         with open(self.config_file, "w") as f:
@@ -196,6 +381,14 @@ if __name__ == "__main__":
     print(f"Config file: {config.config_file}")
     print(f"Project root: {config.get_project_root()}")
     print(f"Model path: {config.get_model_path()}")
+    print(f"Unified model path: {config.get_unified_model_path()}")
     print(f"Test images: {config.get_test_images_dir()}")
     print(f"Inference settings: {config.get_inference_settings()}")
     print(f"Display settings: {config.get_display_settings()}")
+    print(f"Performance settings: {config.get_performance_settings()}")
+    print(f"Cache settings: {config.get_cache_settings()}")
+    print(f"Orthomosaic settings: {config.get_orthomosaic_settings()}")
+    print(f"Server settings: {config.get_server_settings()}")
+    print(f"Job settings: {config.get_job_settings()}")
+    print(f"Pool settings: {config.get_pool_settings()}")
+    print(f"Admission settings: {config.get_admission_settings()}")
@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Durable detection jobs for bulk submissions
+A job is a batch of images with one pair of thresholds. Jobs and their
+per-image results live in SQLite, so submitting returns at once and workers
+process the images at their own pace. After a crash or restart, workers
+continue where they stopped. Results are fetched page by page.
+
+Usage:
+    python detection_jobs.py submit survey_photos/ --tree-conf 0.3
+    python detection_jobs.py worker
+    python detection_jobs.py status <job_id>
+    python detection_jobs.py results <job_id> --offset 0 --limit 100
+
+detection_server.py exposes the same jobs over HTTP (/jobs) and processes
+them between interactive requests.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from benchmark_detection import collect_images
+from two_stage_detection import DEFAULT_DEFECT_CONF, DEFAULT_TREE_CONF, load_image
+
+
+# Item states; "running" items whose lease expired are picked up again
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+# (job id, index, image path, name, tree_conf, defect_conf)
+WorkItem = Tuple[str, int, str, str, float, float]
+
+
+class JobStore:
+    """
+    SQLite-backed job queue and result store
+
+    Uses WAL mode like the result cache, so the detection server, worker
+    processes and the CLI can share one file. Workers lease the items they
+    claim; items of a worker that died are claimed again once the lease
+    runs out. Uploaded images are spooled to files next to the database.
+    """
+
+    def __init__(self, path: str, spool_dir: Optional[str] = None, lease_seconds: float = 300):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            spool_dir: Where uploaded image bytes are kept until their job is
+                deleted (default: <database name>_images next to it)
+            lease_seconds: How long a claimed item stays with its worker
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Absolute, so workers started from another directory find the spooled files
+        self.spool_dir = Path(
+            spool_dir or self.path.with_name(f"{self.path.stem}_images")
+        ).resolve()
+        self.lease_seconds = lease_seconds
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY,"
+                " created REAL NOT NULL,"
+                " tree_conf REAL NOT NULL,"
+                " defect_conf REAL NOT NULL,"
+                " total INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS items ("
+                " job_id TEXT NOT NULL,"
+                " idx INTEGER NOT NULL,"
+                " source TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " lease_until REAL,"
+                " result TEXT,"
+                " error TEXT,"
+                " finished REAL,"
+                " PRIMARY KEY (job_id, idx))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS items_status ON items (status)")
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def submit(
+        self,
+        images: List[Union[str, bytes]],
+        tree_conf: float = DEFAULT_TREE_CONF,
+        defect_conf: float = DEFAULT_DEFECT_CONF,
+        names: Optional[List[str]] = None,
+    ) -> str:
+        """
+        Create a job
+
+        Args:
+            images: Image paths readable by the workers, or encoded image bytes
+                (written to the spool directory)
+            tree_conf: Confidence threshold for tree detection
+            defect_conf: Confidence threshold for defect detection
+            names: Names to report for the images (default: the path, or
+                image_<index> for bytes)
+
+        Returns:
+            Job id
+        """
+        if not images:
+            raise ValueError("A job needs at least one image")
+        job_id = uuid.uuid4().hex
+        names = names or [None] * len(images)
+
+        rows = []
+        for idx, (image, name) in enumerate(zip(images, names)):
+            if isinstance(image, (bytes, bytearray, memoryview)):
+                job_dir = self.spool_dir / job_id
+                job_dir.mkdir(parents=True, exist_ok=True)
+                source = job_dir / f"{idx:06d}.img"
+                source.write_bytes(image)
+                source, default_name = str(source), f"image_{idx + 1}"
+            else:
+                source = default_name = str(Path(image).resolve())
+            rows.append((job_id, idx, source, name or default_name, PENDING))
+
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT INTO jobs (id, created, tree_conf, defect_conf, total)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (job_id, time.time(), tree_conf, defect_conf, len(rows)),
+            )
+            conn.executemany(
+                "INSERT INTO items (job_id, idx, source, name, status) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        return job_id
+
+    def claim(self, limit: int) -> List[WorkItem]:
+        """
+        Lease up to ``limit`` items to the calling worker, oldest job first
+
+        Pending items come first, then running items whose lease expired
+        (their worker stopped or crashed).
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            # Take the write lock before reading so two workers can't claim
+            # the same items
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT i.job_id, i.idx, i.source, i.name, j.tree_conf, j.defect_conf"
+                " FROM items i JOIN jobs j ON j.id = i.job_id"
+                " WHERE i.status = ? OR (i.status = ? AND i.lease_until < ?)"
+                " ORDER BY j.created, i.idx LIMIT ?",
+                (PENDING, RUNNING, now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE items SET status = ?, lease_until = ? WHERE job_id = ? AND idx = ?",
+                [(RUNNING, now + self.lease_seconds, row[0], row[1]) for row in rows],
+            )
+        return rows
+
+    def finish(self, outcomes: List[Tuple[str, int, Optional[Dict], Optional[str]]]):
+        """
+        Store the outcome of processed items
+
+        Args:
+            outcomes: (job id, index, result dictionary or None, error or None)
+        """
+        now = time.time()
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                "UPDATE items SET status = ?, result = ?, error = ?, finished = ?,"
+                " lease_until = NULL WHERE job_id = ? AND idx = ?",
+                [
+                    (
+                        FAILED if error else DONE,
+                        None if result is None else json.dumps(result),
+                        error,
+                        now,
+                        job_id,
+                        idx,
+                    )
+                    for job_id, idx, result, error in outcomes
+                ],
+            )
+
+    def requeue_running(self) -> int:
+        """
+        Put all leased items back in the queue
+
+        For a worker starting up after a crash, so it doesn't wait for the
+        leases of its own earlier run to expire. Only safe when no other
+        worker is processing the same database; results are idempotent, so
+        the worst case is doing an item twice.
+
+        Returns:
+            Number of items requeued
+        """
+        conn = self._connect()
+        with conn:
+            cursor = conn.execute(
+                "UPDATE items SET status = ?, lease_until = NULL WHERE status = ?",
+                (PENDING, RUNNING),
+            )
+        return cursor.rowcount
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Progress of a job, or None if it doesn't exist"""
+        conn = self._connect()
+        job = conn.execute(
+            "SELECT created, tree_conf, defect_conf, total FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if job is None:
+            return None
+        created, tree_conf, defect_conf, total = job
+        counts = dict(
+            conn.execute(
+                "SELECT status, COUNT(*) FROM items WHERE job_id = ? GROUP BY status",
+                (job_id,),
+            ).fetchall()
+        )
+        finished = counts.get(DONE, 0) + counts.get(FAILED, 0)
+        if finished == total:
+            state = "finished"
+        elif finished or counts.get(RUNNING, 0):
+            state = "running"
+        else:
+            state = "queued"
+        last = conn.execute(
+            "SELECT MAX(finished) FROM items WHERE job_id = ?", (job_id,)
+        ).fetchone()[0]
+        return {
+            "job_id": job_id,
+            "state": state,
+            "total": total,
+            "pending": counts.get(PENDING, 0),
+            "running": counts.get(RUNNING, 0),
+            "done": counts.get(DONE, 0),
+            "failed": counts.get(FAILED, 0),
+            "progress": round(finished / total, 4),
+            "tree_conf": tree_conf,
+            "defect_conf": defect_conf,
+            "created": created,
+            "updated": last,
+        }
+
+    def results(self, job_id: str, offset: int = 0, limit: int = 100) -> Optional[Dict]:
+        """
+        One page of a job's per-image outcomes, in submission order
+
+        Returns:
+            {"job_id", "offset", "total", "next_offset" (None on the last
+            page), "items": [{"index", "name", "status", "result", "error"}]},
+            or None if the job doesn't exist
+        """
+        conn = self._connect()
+        job = conn.execute("SELECT total FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        offset, limit = max(0, offset), max(1, limit)
+        rows = conn.execute(
+            "SELECT idx, name, status, result, error FROM items"
+            " WHERE job_id = ? AND idx >= ? ORDER BY idx LIMIT ?",
+            (job_id, offset, limit),
+        ).fetchall()
+        next_offset = offset + limit
+        return {
+            "job_id": job_id,
+            "offset": offset,
+            "total": job[0],
+            "next_offset": next_offset if next_offset < job[0] else None,
+            "items": [
+                {
+                    "index": idx,
+                    "name": name,
+                    "status": status,
+                    "result": json.loads(result) if result else None,
+                    "error": error,
+                }
+                for idx, name, status, result, error in rows
+            ],
+        }
+
+    def jobs(self, limit: int = 50) -> List[Dict]:
+        """Most recent jobs with their progress"""
+        ids = self._connect().execute(
+            "SELECT id FROM jobs ORDER BY created DESC LIMIT ?", (limit,)
+        ).fetchall()
+        return [self.status(job_id) for (job_id,) in ids]
+
+    def delete(self, job_id: str) -> bool:
+        """Delete a job, its results and its spooled images"""
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+            deleted = conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount
+        shutil.rmtree(self.spool_dir / job_id, ignore_errors=True)
+        return bool(deleted)
+
+
+def process_items(store: JobStore, detector, items: List[WorkItem]) -> int:
+    """
+    Run the detector on claimed items and store the outcomes
+
+    All items go through the models as one batch. An image that can't be read
+    fails on its own without failing the rest.
+
+    Returns:
+        Number of items processed
+    """
+    outcomes = []
+    batch = []
+    for job_id, idx, source, name, tree_conf, defect_conf in items:
+        try:
+            batch.append((job_id, idx, load_image(source), name, (tree_conf, defect_conf)))
+        except (OSError, ValueError) as e:
+            outcomes.append((job_id, idx, None, str(e)))
+
+    if batch:
+        try:
+            results = detector.detect_mixed_batch(
+                [entry[2] for entry in batch],
+                [entry[4] for entry in batch],
+                [entry[3] for entry in batch],
+            )
+            outcomes += [
+                (job_id, idx, result, None)
+                for (job_id, idx, *_), result in zip(batch, results)
+            ]
+        except Exception as e:
+            outcomes += [(job_id, idx, None, f"Detection failed: {e}") for job_id, idx, *_ in batch]
+
+    store.finish(outcomes)
+    return len(items)
+
+
+def run_worker(
+    store: JobStore,
+    detector,
+    batch_size: int = 8,
+    poll_interval: float = 1.0,
+    stop: Optional[threading.Event] = None,
+):
+    """Process queued items until ``stop`` is set (or forever)"""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        items = store.claim(batch_size)
+        if not items:
+            stop.wait(poll_interval)
+            continue
+        start = time.perf_counter()
+        process_items(store, detector, items)
+        elapsed = time.perf_counter() - start
+        print(f"Processed {len(items)} image(s) in {elapsed:.1f}s ({len(items) / elapsed:.1f} images/s)")
+
+
+def main():
+    from config_loader import load_config
+
+    config = load_config()
+    settings = config.get_job_settings()
+
+    parser = argparse.ArgumentParser(description="Durable batch detection jobs")
+    parser.add_argument("--database", default=str(settings["database"]))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    submit = commands.add_parser("submit", help="Queue a job of images")
+    submit.add_argument("images", nargs="+", help="Image files or directories")
+    submit.add_argument("--tree-conf", type=float, default=DEFAULT_TREE_CONF)
+    submit.add_argument("--defect-conf", type=float, default=DEFAULT_DEFECT_CONF)
+
+    worker = commands.add_parser("worker", help="Process queued jobs")
+    worker.add_argument(
+        "--tree-model", default="runs/detect/tree_detection_cpu/weights/best.pt"
+    )
+    worker.add_argument(
+        "--defect-model", default="runs/defects/tree_defects_detection2/weights/best.pt"
+    )
+    worker.add_argument("--batch-size", type=int, default=settings["batch_size"])
+    worker.add_argument(
+        "--requeue",
+        action="store_true",
+        help="Requeue items left running by a crashed run right away "
+        "(only when no other worker uses the database)",
+    )
+
+    status = commands.add_parser("status", help="Show job progress")
+    status.add_argument("job_id", nargs="?", help="Job id (default: recent jobs)")
+
+    results = commands.add_parser("results", help="Print a page of job results")
+    results.add_argument("job_id")
+    results.add_argument("--offset", type=int, default=0)
+    results.add_argument("--limit", type=int, default=settings["page_size"])
+
+    delete = commands.add_parser("delete", help="Delete a job and its results")
+    delete.add_argument("job_id")
+
+    args = parser.parse_args()
+    store = JobStore(args.database, settings["spool_directory"], settings["lease_seconds"])
+
+    if args.command == "submit":
+        images = collect_images(args.images, None)
+        if not images:
+            print("Error: No images found")
+            return
+        job_id = store.submit(images, args.tree_conf, args.defect_conf)
+        print(f"Submitted job {job_id} with {len(images)} images")
+    elif args.command == "worker":
+        from two_stage_detection import TwoStageDetector
+
+        if args.requeue:
+            print(f"Requeued {store.requeue_running()} interrupted item(s)")
+        options = config.get_detector_options()
+        options["warmup"] = False  # No latency target for queued work
+        detector = TwoStageDetector(args.tree_model, args.defect_model, **options)
+        print(f"Worker {socket.gethostname()}:{os.getpid()} waiting for jobs in {args.database}")
+        try:
+            run_worker(store, detector, args.batch_size)
+        except KeyboardInterrupt:
+            print("\nWorker stopped; unfinished items are picked up again after their lease")
+    elif args.command == "status":
+        report = store.status(args.job_id) if args.job_id else store.jobs()
+        if report is None:
+            print(f"Error: No job {args.job_id}")
+            return
+        print(json.dumps(report, indent=2))
+    elif args.command == "results":
+        page = store.results(args.job_id, args.offset, args.limit)
+        if page is None:
+            print(f"Error: No job {args.job_id}")
+            return
+        print(json.dumps(page, indent=2))
+    elif args.command == "delete":
+        print("Deleted" if store.delete(args.job_id) else f"Error: No job {args.job_id}")
+
+
+if __name__ == "__main__":
+    main()
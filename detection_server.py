@@ -0,0 +1,739 @@
+#!/usr/bin/env python3
+"""
+HTTP inference service for the two-stage detector
+Serves detect() as a JSON endpoint on the standard library's asyncio. Requests
+that arrive together are collected into micro-batches (up to a maximum batch
+size, waiting at most a few milliseconds for more), so concurrent clients
+share forward passes and the CPU stays busy. Admission control (admission.py)
+sits in front of the batcher: the number of requests in progress adapts to
+latency, excess requests wait in a bounded queue, and once it is full
+requests are rejected at once with 503 and a Retry-After header.
+
+Endpoints:
+    POST /detect   The image file as the body, thresholds in the query string
+                   (?tree_conf=0.25&defect_conf=0.05&name=photo.jpg), or JSON
+                   {"image": "<base64>", "tree_conf": 0.25, "defect_conf": 0.05, "name": "..."}.
+                   Optional budget_ms: latency budget counted from arrival;
+                   when full quality won't fit, a faster quality level is used.
+                   Returns the detect() result dictionary.
+    GET  /health   200 once the models are loaded and warmed up, 503 before
+    GET  /metrics  Queue depth, batch-size histogram, request counts, latencies
+                   and the admission limit
+
+    POST   /jobs                 Queue a bulk job: JSON {"paths": [...]} (files the
+                                 server can read) and/or {"images": ["<base64>", ...]},
+                                 optional "names", "tree_conf", "defect_conf".
+                                 Returns {"job_id": ...} right away (202).
+    GET    /jobs                 Recent jobs and their progress
+    GET    /jobs/<id>            Progress of one job
+    GET    /jobs/<id>/results    One page of results (?offset=0&limit=100)
+    DELETE /jobs/<id>            Delete a job and its results
+
+Jobs are stored by detection_jobs.py in SQLite and processed between
+interactive requests, or by separate `python detection_jobs.py worker` processes.
+
+Usage:
+    python detection_server.py
+    python detection_server.py --port 8080 --max-batch-size 16 --max-wait-ms 20
+
+    curl --data-binary @photo.jpg "http://127.0.0.1:8000/detect?tree_conf=0.3"
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import contextlib
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from admission import AdmissionController, Overloaded
+from config_loader import load_config
+from detection_jobs import JobStore, process_items
+from two_stage_detection import (
+    DEFAULT_DEFECT_CONF,
+    DEFAULT_TREE_CONF,
+    TwoStageDetector,
+    load_image,
+)
+
+DEFAULT_TREE_MODEL = "runs/detect/tree_detection_cpu/weights/best.pt"
+DEFAULT_DEFECT_MODEL = "runs/defects/tree_defects_detection2/weights/best.pt"
+
+# Latency percentiles are computed over the most recent requests
+LATENCY_WINDOW = 1000
+
+# Suggested client back-off while the models are still loading (seconds)
+LOADING_RETRY_AFTER = 5
+
+# Seconds between job queue polls when there is nothing to do
+JOB_POLL_INTERVAL = 1.0
+
+STATUS_TEXT = {
+    200: "OK",
+    202: "Accepted",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+class HTTPError(Exception):
+    """Request error answered with a JSON {"error": message} body"""
+
+    def __init__(self, status: int, message: str, headers: Optional[Dict] = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call on the default thread pool, off the event loop"""
+    # asyncio.to_thread needs Python 3.9
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+def percentiles(values) -> Optional[Dict[str, float]]:
+    """p50/p95/p99 of a window of measurements (None when empty)"""
+    if not values:
+        return None
+    p50, p95, p99 = np.percentile(np.fromiter(values, dtype=float), [50, 95, 99])
+    return {"p50": round(p50, 2), "p95": round(p95, 2), "p99": round(p99, 2)}
+
+
+class ServiceMetrics:
+    """Request counters, batch-size histogram and latency windows"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.batch_sizes = Counter()
+        self.max_queue_depth = 0
+        self.queue_wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self.batch_ms = deque(maxlen=LATENCY_WINDOW)
+        self.latency_ms = deque(maxlen=LATENCY_WINDOW)
+        self.job_images = 0
+
+    def record_batch(self, waits_ms: List[float], batch_ms: float):
+        """One forward pass of len(waits_ms) requests"""
+        self.batches += 1
+        self.batch_sizes[len(waits_ms)] += 1
+        self.queue_wait_ms.extend(waits_ms)
+        self.batch_ms.append(batch_ms)
+
+    def report(self, queue_depth: int, running: int) -> Dict:
+        """Metrics as a JSON-serializable dictionary"""
+        images = sum(size * count for size, count in self.batch_sizes.items())
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "queue_depth": queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "running_batch_size": running,
+            "requests": self.requests,
+            "errors": self.errors,
+            "batches": self.batches,
+            "mean_batch_size": round(images / self.batches, 2) if self.batches else None,
+            "batch_size_histogram": {
+                str(size): self.batch_sizes[size] for size in sorted(self.batch_sizes)
+            },
+            "queue_wait_ms": percentiles(self.queue_wait_ms),
+            "batch_ms": percentiles(self.batch_ms),
+            "latency_ms": percentiles(self.latency_ms),
+            "job_images_processed": self.job_images,
+        }
+
+
+class MicroBatcher:
+    """
+    Collects concurrent detection requests into batched forward passes
+
+    The first waiting request opens a batch. It closes when it holds
+    max_batch_size requests or max_wait_ms after it opened. Batches run one at
+    a time on a single worker thread, because each forward pass already uses
+    all torch threads; requests arriving meanwhile form the next batch. The
+    thread (``executor``) owns the detector: anything else using it, such as
+    job processing, is submitted there too.
+    """
+
+    def __init__(
+        self,
+        detector: TwoStageDetector,
+        max_batch_size: int,
+        max_wait_ms: float,
+        metrics: ServiceMetrics,
+    ):
+        self.detector = detector
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.metrics = metrics
+        self.pending = deque()
+        self.running = 0
+        self._arrived = asyncio.Event()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="detector-batch")
+
+    async def detect(
+        self,
+        image: np.ndarray,
+        tree_conf: float,
+        defect_conf: float,
+        name: str,
+        deadline: Optional[float] = None,
+    ) -> Dict:
+        """
+        Queue one decoded image and wait for its result
+
+        Args:
+            deadline: time.perf_counter() value by which a result is wanted
+                (latency budget); None for full quality
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(
+            (image, (tree_conf, defect_conf), name, deadline, time.perf_counter(), future)
+        )
+        self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, len(self.pending))
+        self._arrived.set()
+        return await future
+
+    async def _collect(self) -> List[Tuple]:
+        """Wait for the next batch of requests"""
+        while not self.pending:
+            self._arrived.clear()
+            await self._arrived.wait()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        batch = []
+        while len(batch) < self.max_batch_size:
+            if self.pending:
+                batch.append(self.pending.popleft())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        # Clients that disconnected while queued
+        return [item for item in batch if not item[-1].cancelled()]
+
+    async def run(self):
+        """Form and run batches until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+            images, thresholds, names, deadlines, queued, futures = zip(*batch)
+            started = time.perf_counter()
+            # What the wait in the queue left of each budget
+            budgets = [
+                None if deadline is None else max(0.0, (deadline - started) * 1000)
+                for deadline in deadlines
+            ]
+            self.running = len(batch)
+            try:
+                results = await loop.run_in_executor(
+                    self.executor,
+                    self.detector.detect_mixed_batch,
+                    list(images),
+                    list(thresholds),
+                    list(names),
+                    budgets,
+                )
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.running = 0
+
+            finished = time.perf_counter()
+            self.metrics.record_batch(
+                [(started - queued_at) * 1000 for queued_at in queued],
+                (finished - started) * 1000,
+            )
+            for future, result in zip(futures, results):
+                if not future.done():
+                    future.set_result(result)
+
+
+async def read_request(
+    reader: asyncio.StreamReader, max_body: int
+) -> Optional[Tuple[str, str, str, Dict[str, str], bytes]]:
+    """
+    Read one HTTP/1.x request
+
+    Returns:
+        (method, target, version, lower-cased headers, body), or None when the
+        client closed the connection
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        raise HTTPError(400, "Chunked bodies are not supported, send Content-Length")
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length")
+    if length > max_body:
+        raise HTTPError(413, f"Body larger than {max_body // 2**20} MB")
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method.upper(), target, version, headers, body
+
+
+def parse_threshold(params: Dict, key: str, default: float) -> float:
+    """Confidence threshold from the request, checked to lie in [0, 1]"""
+    value = params.get(key, default)
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{key} must be a number")
+    if not 0.0 <= value <= 1.0:
+        raise HTTPError(400, f"{key} must be between 0 and 1")
+    return value
+
+
+def parse_budget(value) -> float:
+    """Latency budget from the request in ms, checked to be positive"""
+    try:
+        budget_ms = float(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "budget_ms must be a number")
+    if not budget_ms > 0:
+        raise HTTPError(400, "budget_ms must be positive")
+    return budget_ms
+
+
+class DetectionService:
+    """HTTP front end: routing, request parsing and the micro-batcher"""
+
+    def __init__(
+        self,
+        max_batch_size: int,
+        max_wait_ms: float,
+        max_body_mb: float,
+        jobs: Optional[JobStore] = None,
+        job_batch_size: int = 8,
+        job_page_size: int = 100,
+        job_worker: bool = True,
+        admission: Optional[AdmissionController] = None,
+    ):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_body = int(max_body_mb * 2**20)
+        self.metrics = ServiceMetrics()
+        self.jobs = jobs
+        self.job_batch_size = job_batch_size
+        self.job_page_size = job_page_size
+        self.job_worker = job_worker
+        self.admission = admission or AdmissionController()
+        self.detector = None
+        self.batcher = None
+        self._tasks = []
+
+    @property
+    def ready(self) -> bool:
+        return self.detector is not None and self.detector.ready.is_set()
+
+    async def load(self, **detector_args):
+        """Load (and warm up) the detector off the event loop, then start batching"""
+        loop = asyncio.get_running_loop()
+        detector = await loop.run_in_executor(
+            None, lambda: TwoStageDetector(**detector_args)
+        )
+        self.batcher = MicroBatcher(
+            detector, self.max_batch_size, self.max_wait_ms, self.metrics
+        )
+        self._tasks.append(asyncio.create_task(self.batcher.run()))
+        self.detector = detector
+        print("Models ready, accepting detection requests")
+        if self.jobs is not None and self.job_worker:
+            self._tasks.append(asyncio.create_task(self.process_jobs()))
+
+    async def process_jobs(self):
+        """
+        Work through queued jobs whenever no interactive request is waiting
+
+        Job batches run on the batcher's thread, so they never compete with
+        interactive batches for the CPU; an interactive request waits at
+        most for the job batch in progress.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.batcher.pending or self.batcher.running:
+                await asyncio.sleep(self.max_wait_ms / 1000 or 0.01)
+                continue
+            items = await run_blocking(self.jobs.claim, self.job_batch_size)
+            if not items:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            try:
+                await loop.run_in_executor(
+                    self.batcher.executor, process_items, self.jobs, self.detector, items
+                )
+                self.metrics.job_images += len(items)
+            except Exception as e:
+                # Storage errors: the items return to the queue when the lease ends
+                print(f"Job processing failed: {e}")
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve the requests of one (keep-alive) connection"""
+        try:
+            while True:
+                try:
+                    request = await read_request(reader, self.max_body)
+                except HTTPError as e:
+                    await self.respond(writer, e.status, {"error": e.message}, False)
+                    break
+                if request is None:
+                    break
+
+                method, target, version, headers, body = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = (
+                    connection == "keep-alive"
+                    if version == "HTTP/1.0"
+                    else connection != "close"
+                )
+                try:
+                    status, payload = await self.route(method, target, headers, body)
+                    extra = {}
+                except HTTPError as e:
+                    status, payload, extra = e.status, {"error": e.message}, e.headers
+                await self.respond(writer, status, payload, keep_alive, extra)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Client went away mid-request
+        finally:
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def respond(
+        self,
+        writer: asyncio.StreamWriter,
+        status: int,
+        payload: Dict,
+        keep_alive: bool,
+        headers: Optional[Dict] = None,
+    ):
+        """Write a JSON response"""
+        body = json.dumps(payload).encode()
+        lines = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            f"Connection: {'keep-alive' if keep_alive else 'close'}",
+        ]
+        lines += [f"{key}: {value}" for key, value in (headers or {}).items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    async def route(
+        self, method: str, target: str, headers: Dict[str, str], body: bytes
+    ) -> Tuple[int, Dict]:
+        """Dispatch a request to its endpoint"""
+        url = urlsplit(target)
+        if url.path == "/health":
+            if not self.ready:
+                raise HTTPError(
+                    503, "Loading models", {"Retry-After": LOADING_RETRY_AFTER}
+                )
+            return 200, {"status": "ready"}
+
+        if url.path == "/metrics":
+            if method != "GET":
+                raise HTTPError(405, "Use GET")
+            report = self.metrics.report(
+                len(self.batcher.pending) if self.batcher else 0,
+                self.batcher.running if self.batcher else 0,
+            )
+            report.update(
+                ready=self.ready,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                admission=self.admission.stats(),
+            )
+            return 200, report
+
+        if url.path == "/detect":
+            if method != "POST":
+                raise HTTPError(405, "Use POST")
+            self.metrics.requests += 1
+            start = time.perf_counter()
+            try:
+                result = await self.detect(url.query, headers, body)
+            except HTTPError:
+                self.metrics.errors += 1
+                raise
+            except Exception as e:
+                self.metrics.errors += 1
+                print(f"Detection failed: {e}")
+                raise HTTPError(500, f"Detection failed: {e}")
+            self.metrics.latency_ms.append((time.perf_counter() - start) * 1000)
+            return 200, result
+
+        if url.path == "/jobs" or url.path.startswith("/jobs/"):
+            if self.jobs is None:
+                raise HTTPError(404, "Jobs are disabled")
+            return await self.route_jobs(method, url, headers, body)
+
+        raise HTTPError(404, f"No endpoint {url.path}")
+
+    async def route_jobs(self, method: str, url, headers: Dict[str, str], body: bytes):
+        """The /jobs endpoints (SQLite work runs off the event loop)"""
+        parts = url.path.strip("/").split("/")
+        if len(parts) == 1:
+            if method == "POST":
+                return 202, await self.submit_job(headers, body)
+            if method == "GET":
+                return 200, {"jobs": await run_blocking(self.jobs.jobs)}
+            raise HTTPError(405, "Use GET or POST")
+
+        job_id = parts[1]
+        if len(parts) == 2 and method == "GET":
+            report = await run_blocking(self.jobs.status, job_id)
+        elif len(parts) == 2 and method == "DELETE":
+            deleted = await run_blocking(self.jobs.delete, job_id)
+            report = {"deleted": job_id} if deleted else None
+        elif len(parts) == 3 and parts[2] == "results" and method == "GET":
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                offset = int(params.get("offset", 0))
+                limit = min(int(params.get("limit", self.job_page_size)), 1000)
+            except ValueError:
+                raise HTTPError(400, "offset and limit must be integers")
+            report = await run_blocking(self.jobs.results, job_id, offset, limit)
+        else:
+            raise HTTPError(404, f"No endpoint {url.path}")
+        if report is None:
+            raise HTTPError(404, f"No job {job_id}")
+        return 200, report
+
+    async def submit_job(self, headers: Dict[str, str], body: bytes) -> Dict:
+        """Queue the images of a POST /jobs request"""
+        if not headers.get("content-type", "").startswith("application/json"):
+            raise HTTPError(400, "Send the job as application/json")
+        try:
+            document = json.loads(body)
+            paths = [str(path) for path in document.get("paths", [])]
+            images = [
+                base64.b64decode(image, validate=True)
+                for image in document.get("images", [])
+            ]
+            names = document.get("names")
+        except (ValueError, TypeError, AttributeError, binascii.Error):
+            raise HTTPError(
+                400, 'Expected JSON {"paths": [...]} and/or {"images": ["<base64>", ...]}'
+            )
+        sources = paths + images
+        if not sources:
+            raise HTTPError(400, "A job needs at least one image")
+        if names is not None and (
+            not isinstance(names, list) or len(names) != len(sources)
+        ):
+            raise HTTPError(400, "names must list one name per image (paths first)")
+        missing = [path for path in paths if not Path(path).is_file()]
+        if missing:
+            raise HTTPError(400, f"Not found on the server: {missing[:5]}")
+
+        tree_conf = parse_threshold(document, "tree_conf", DEFAULT_TREE_CONF)
+        defect_conf = parse_threshold(document, "defect_conf", DEFAULT_DEFECT_CONF)
+        job_id = await run_blocking(
+            self.jobs.submit, sources, tree_conf, defect_conf, names
+        )
+        return {"job_id": job_id, "total": len(sources)}
+
+    async def detect(self, query: str, headers: Dict[str, str], body: bytes) -> Dict:
+        """Parse a /detect request, decode the image and queue it for a batch"""
+        if not self.ready:
+            raise HTTPError(503, "Loading models", {"Retry-After": LOADING_RETRY_AFTER})
+
+        params = {key: values[0] for key, values in parse_qs(query).items()}
+        data = body
+        if headers.get("content-type", "").startswith("application/json"):
+            try:
+                document = json.loads(body)
+                data = base64.b64decode(document["image"], validate=True)
+            except (ValueError, KeyError, TypeError, binascii.Error):
+                raise HTTPError(400, 'Expected JSON {"image": "<base64>", ...}')
+            params.update(
+                (key, document[key])
+                for key in ("tree_conf", "defect_conf", "name", "budget_ms")
+                if key in document
+            )
+        if not data:
+            raise HTTPError(400, "Empty image")
+
+        tree_conf = parse_threshold(params, "tree_conf", DEFAULT_TREE_CONF)
+        defect_conf = parse_threshold(params, "defect_conf", DEFAULT_DEFECT_CONF)
+        name = str(params.get("name") or "request")
+        deadline = None
+        if params.get("budget_ms") not in (None, ""):
+            budget_ms = parse_budget(params["budget_ms"])
+            deadline = time.perf_counter() + budget_ms / 1000
+
+        # Admitted before decoding, so rejected requests cost next to nothing
+        try:
+            ticket = await self.admission.acquire_async()
+        except Overloaded as e:
+            raise HTTPError(503, str(e), {"Retry-After": e.retry_after})
+        measure = False
+        try:
+            try:
+                # Decoding releases the GIL; keep it off the event loop
+                image = await run_blocking(load_image, data)
+            except ValueError as e:
+                raise HTTPError(400, str(e))
+            result = await self.batcher.detect(
+                image, tree_conf, defect_conf, name, deadline
+            )
+            measure = True
+            return result
+        finally:
+            self.admission.release(ticket, measure)
+
+
+async def serve(
+    args, detector_args: Dict, job_settings: Dict, admission_settings: Dict
+):
+    """Start listening right away and load the models in the background"""
+    jobs = None
+    if not args.no_jobs:
+        jobs = JobStore(
+            args.job_database,
+            job_settings["spool_directory"],
+            job_settings["lease_seconds"],
+        )
+        if args.requeue:
+            print(f"Requeued {jobs.requeue_running()} interrupted job image(s)")
+    service = DetectionService(
+        args.max_batch_size,
+        args.max_wait_ms,
+        args.max_body_mb,
+        jobs=jobs,
+        job_batch_size=job_settings["batch_size"],
+        job_page_size=job_settings["page_size"],
+        job_worker=job_settings["server_worker"],
+        admission=AdmissionController.from_settings(
+            admission_settings,
+            target_latency_ms=args.target_latency_ms,
+            max_queue=args.max_queue,
+        ),
+    )
+    server = await asyncio.start_server(service.handle, args.host, args.port)
+    print(f"Listening on http://{args.host}:{args.port} (/health reports readiness)")
+    print(
+        f"Micro-batching: up to {args.max_batch_size} images, "
+        f"waiting at most {args.max_wait_ms:g} ms"
+    )
+    print(
+        f"Admission: target latency {args.target_latency_ms:g} ms, "
+        f"queue of {args.max_queue}"
+    )
+    loading = asyncio.create_task(service.load(**detector_args))
+    async with server:
+        await asyncio.gather(server.serve_forever(), loading)
+
+
+def main():
+    config = load_config()
+    settings = config.get_server_settings()
+    job_settings = config.get_job_settings()
+    admission_settings = config.get_admission_settings()
+
+    parser = argparse.ArgumentParser(
+        description="HTTP inference service with dynamic micro-batching"
+    )
+    parser.add_argument("--tree-model", default=DEFAULT_TREE_MODEL)
+    parser.add_argument("--defect-model", default=DEFAULT_DEFECT_MODEL)
+    parser.add_argument(
+        "--unified-model", help="Single-pass model replacing both (see train_defects.py --unified)"
+    )
+    parser.add_argument("--host", default=settings["host"])
+    parser.add_argument("--port", type=int, default=settings["port"])
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=settings["max_batch_size"],
+        help="Most requests per forward pass",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=settings["max_wait_ms"],
+        help="Longest wait for more requests once a batch is open",
+    )
+    parser.add_argument(
+        "--max-body-mb", type=float, default=settings["max_body_mb"]
+    )
+    parser.add_argument(
+        "--target-latency-ms",
+        type=float,
+        default=admission_settings["target_latency_ms"],
+        help="Admitted requests slower than this lower the concurrency limit",
+    )
+    parser.add_argument(
+        "--max-queue",
+        type=int,
+        default=admission_settings["max_queue"],
+        help="Requests waiting for admission before new ones are rejected (503)",
+    )
+    parser.add_argument("--job-database", default=str(job_settings["database"]))
+    parser.add_argument("--no-jobs", action="store_true", help="Disable the /jobs API")
+    parser.add_argument(
+        "--requeue",
+        action="store_true",
+        help="Requeue job images left running by a crashed run right away "
+        "(only when no other worker uses the job database)",
+    )
+    args = parser.parse_args()
+
+    detector_args = config.get_detector_options()
+    if args.unified_model:
+        detector_args["unified_model_path"] = args.unified_model
+    if not detector_args.get("unified_model_path"):
+        detector_args.update(
+            tree_model_path=args.tree_model, defect_model_path=args.defect_model
+        )
+
+    try:
+        asyncio.run(serve(args, detector_args, job_settings, admission_settings))
+    except KeyboardInterrupt:
+        print("\nServer stopped")
+
+
+if __name__ == "__main__":
+    main()
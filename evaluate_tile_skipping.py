@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Check coarse-to-fine tile skipping against exhaustive tiled inference
+Runs detect_tiled() on every tile and with the coarse tree pass, then reports
+the fraction of tiles skipped, the time saved and the recall of the coarse run
+relative to the exhaustive one (trees and defects, IoU >= 0.5, same type).
+
+Usage:
+    python evaluate_tile_skipping.py dataset/valid/images --tile-size 640 --coarse-scale 0.25
+"""
+
+import argparse
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from benchmark_detection import (
+    DEFAULT_DEFECT_MODEL,
+    DEFAULT_TREE_MODEL,
+    collect_images,
+)
+from spatial_index import GridIndex
+from two_stage_detection import TwoStageDetector, box_iou, load_image
+
+
+def _boxes_by_type(results, kind):
+    """(boxes, types) of all trees or all defects in a result"""
+    if kind == "trees":
+        items = results["trees"]
+    else:
+        items = [d for tree in results["trees"] for d in tree["defects"]]
+        items += results["unmatched_defects"]
+    boxes = np.array([item["bbox"] for item in items], dtype=np.float64).reshape(-1, 4)
+    return boxes, [item["type"] for item in items]
+
+
+def count_found(reference, candidate, kind, iou_threshold=0.5):
+    """
+    How many reference boxes have a same-type candidate box above the IoU threshold
+
+    Returns:
+        (found, total)
+    """
+    ref_boxes, ref_types = _boxes_by_type(reference, kind)
+    cand_boxes, cand_types = _boxes_by_type(candidate, kind)
+    if len(ref_boxes) == 0 or len(cand_boxes) == 0:
+        return 0, len(ref_boxes)
+
+    # Only overlapping pairs are compared; scenes can hold 100k+ boxes
+    cand_idx, ref_idx = GridIndex(cand_boxes).candidate_pairs(ref_boxes)
+    hit = box_iou(ref_boxes[ref_idx], cand_boxes[cand_idx]) >= iou_threshold
+    hit &= np.array(ref_types)[ref_idx] == np.array(cand_types)[cand_idx]
+    return len(np.unique(ref_idx[hit])), len(ref_boxes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare coarse-to-fine tile skipping with exhaustive tiling"
+    )
+    parser.add_argument("images", nargs="+", help="Image files or directories")
+    parser.add_argument("--tree-model", default=DEFAULT_TREE_MODEL)
+    parser.add_argument("--defect-model", default=DEFAULT_DEFECT_MODEL)
+    parser.add_argument("--tile-size", type=int, default=640)
+    parser.add_argument("--overlap", type=float, default=0.2)
+    parser.add_argument("--coarse-scale", type=float, default=0.25)
+    parser.add_argument("--coarse-conf", type=float, default=0.1)
+    parser.add_argument("--tree-conf", type=float, default=0.25)
+    parser.add_argument("--defect-conf", type=float, default=0.05)
+    parser.add_argument("--limit", type=int, default=0, help="Max images (0 = all)")
+    args = parser.parse_args()
+
+    image_paths = collect_images(args.images, args.limit)
+    if not image_paths:
+        print("Error: No images found")
+        return
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector = TwoStageDetector(args.tree_model, args.defect_model)
+
+    options = dict(
+        tree_conf=args.tree_conf,
+        defect_conf=args.defect_conf,
+        tile_size=args.tile_size,
+        overlap=args.overlap,
+    )
+    totals = {"tiles": 0, "processed": 0, "full_s": 0.0, "coarse_s": 0.0}
+    found = {"trees": [0, 0], "defects": [0, 0]}
+
+    print(f"{'Image':<32} {'Tiles':>6} {'Skipped':>8} {'Trees':>9} {'Defects':>9}")
+    for path in image_paths:
+        image = load_image(path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            full = detector.detect_tiled(image, **options)
+            middle = time.perf_counter()
+            coarse = detector.detect_tiled(
+                image,
+                coarse_scale=args.coarse_scale,
+                coarse_conf=args.coarse_conf,
+                **options,
+            )
+            end = time.perf_counter()
+
+        totals["tiles"] += coarse["tiles_total"]
+        totals["processed"] += coarse["tiles_processed"]
+        totals["full_s"] += middle - start
+        totals["coarse_s"] += end - middle
+
+        row = []
+        for kind in ("trees", "defects"):
+            hit, total = count_found(full, coarse, kind)
+            found[kind][0] += hit
+            found[kind][1] += total
+            row.append(f"{hit}/{total}")
+        skipped = 1 - coarse["tiles_processed"] / coarse["tiles_total"]
+        print(
+            f"{path.name[:32]:<32} {coarse['tiles_total']:>6} {skipped:>8.0%} "
+            f"{row[0]:>9} {row[1]:>9}"
+        )
+
+    print(f"\n{'='*60}")
+    print(f"Images: {len(image_paths)}")
+    print(
+        f"Tiles skipped: {totals['tiles'] - totals['processed']}/{totals['tiles']} "
+        f"({1 - totals['processed'] / totals['tiles']:.1%})"
+    )
+    print(
+        f"Time: exhaustive {totals['full_s']:.1f}s, coarse-to-fine "
+        f"{totals['coarse_s']:.1f}s"
+    )
+    for kind, (hit, total) in found.items():
+        recall = hit / total if total else 1.0
+        print(f"{kind.capitalize()} recall vs exhaustive: {hit}/{total} ({recall:.1%})")
+    print(f"{'='*60}")
+
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,8 @@ from ultralytics import YOLO
 import torch
 import os
 
+from two_stage_detection import draw_boxes, load_image, predict_image
+
 # Fix for PyTorch 2.6+ weights_only security change
 
 try:
@@ -279,26 +281,23 @@ class YOLOInferenceGUI:
 
             # Run inference
             conf_threshold = self.confidence_var.get()
-            results = self.model(
-                self.current_image_path, conf=conf_threshold, verbose=False
-            )
+            image = load_image(self.current_image_path)
+            boxes, confidences, _ = predict_image(self.model, image, conf_threshold)
 
             # Get the result image with bounding boxes
-            result_img = results[0].plot()
+            result_img = draw_boxes(image, boxes, confidences)
             self.result_image = result_img
 
             # Display result
             self.display_image(result_img, self.result_canvas)
 
             # Get detection info
-            boxes = results[0].boxes
             num_detections = len(boxes)
 
             info_text = f"Detections: {num_detections} trees found\n"
             info_text += f"Confidence threshold: {conf_threshold}\n"
 
             if num_detections > 0:
-                confidences = boxes.conf.cpu().numpy()
                 info_text += f"Confidence range: {confidences.min():.3f} - {confidences.max():.3f}\n"
                 info_text += f"Average confidence: {confidences.mean():.3f}"
             else:
@@ -1,17 +1,4 @@
-#!/usrfrom ultralytics import YOLO
-from pathlib import Path
-import sys
-import cv2
-import torch
-from config_loader import load_config
-
-# Fix for PyTorch 2.6+ weights_only security change
-try:
-    from ultralytics.nn.tasks import DetectionModel
-
-    torch.serialization.add_safe_globals([DetectionModel])
-except Exception:
-    pass  # Older PyTorch versions don't have thishon3
+#!/usr/bin/env python3
 """
 YOLOv11 Simple Inference Script for Tree Detection
 Command-line tool for running inference on images
@@ -23,10 +10,13 @@ import sys
 import cv2
 import torch
 from config_loader import load_config
+from two_stage_detection import draw_boxes, load_image, predict_image
 
 # Fix for PyTorch 2.6+ weights_only security change
 try:
-    torch.serialization.add_safe_globals(["ultralytics.nn.tasks.DetectionModel"])
+    from ultralytics.nn.tasks import DetectionModel
+
+    torch.serialization.add_safe_globals([DetectionModel])
 except Exception:
     pass  # Older PyTorch versions don't have this
 
@@ -47,10 +37,10 @@ def run_inference(model_path, image_path, conf=0.25, save=True):
 
     # Run inference
     print(f"Running inference on: {image_path}")
-    results = model(image_path, conf=conf, save=save, project="runs/predict")
+    image = load_image(image_path)
+    boxes, confidences, _ = predict_image(model, image, conf)
 
     # Print results
-    boxes = results[0].boxes
     num_detections = len(boxes)
 
     print(f"\n{'='*50}")
@@ -59,12 +49,11 @@ def run_inference(model_path, image_path, conf=0.25, save=True):
     print(f"Detections: {num_detections} trees found")
 
     if num_detections > 0:
-        confidences = boxes.conf.cpu().numpy()
         print(f"Confidence range: {confidences.min():.3f} - {confidences.max():.3f}")
         print(f"Average confidence: {confidences.mean():.3f}")
 
         print(f"\nDetailed detections:")
-        for i, (box, conf) in enumerate(zip(boxes.xyxy.cpu().numpy(), confidences)):
+        for i, (box, conf) in enumerate(zip(boxes, confidences)):
             x1, y1, x2, y2 = box
             print(
                 f"  Tree {i+1}: Confidence={conf:.3f}, BBox=[{x1:.0f}, {y1:.0f}, {x2:.0f}, {y2:.0f}]"
@@ -73,7 +62,10 @@ def run_inference(model_path, image_path, conf=0.25, save=True):
         print("No trees detected above confidence threshold")
 
     if save:
-        print(f"\nResult saved to: {results[0].save_dir}")
+        output_path = Path("runs/predict") / Path(image_path).name
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(output_path), draw_boxes(image, boxes, confidences))
+        print(f"\nResult saved to: {output_path}")
 
     print(f"{'='*50}\n")
 
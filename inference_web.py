@@ -9,7 +9,6 @@ from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
-import tempfile
 import json
 import torch
 
@@ -21,7 +20,9 @@ try:
 except Exception:
     pass  # Older PyTorch versions don't have this
 
-from two_stage_detection import TwoStageDetector
+from two_stage_detection import load_image
+from admission import Overloaded
+from worker_pool import DetectorPool
 from config_loader import load_config
 
 # Page configuration
@@ -34,9 +35,11 @@ config = load_config()
 # Cache the model loading
 @st.cache_resource
 def load_detector(tree_model_path, defect_model_path):
-    """Load two-stage detector with caching"""
+    """Start the detector worker pool shared by all sessions"""
     try:
-        detector = TwoStageDetector(tree_model_path, defect_model_path)
+        detector = DetectorPool.from_config(
+            tree_model_path, defect_model_path, config
+        )
         return detector, None
     except Exception as e:
         return None, str(e)
@@ -63,23 +66,24 @@ def find_models():
     return tree_model, str(defect_model) if defect_model.exists() else None
 
 
-def run_inference(detector, image, tree_conf_threshold, defect_conf_threshold):
-    """Run two-stage inference on image"""
-    # Save uploaded image temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-        image.save(tmp_file.name)
-        tmp_path = tmp_file.name
-
+def run_inference(
+    detector,
+    image_bytes,
+    image,
+    tree_conf_threshold,
+    defect_conf_threshold,
+    image_name=None,
+):
+    """Run two-stage inference on an encoded upload and draw it on the decoded image"""
     # Run two-stage detection
-    results = detector.detect(tmp_path, tree_conf_threshold, defect_conf_threshold)
+    results = detector.detect(
+        image_bytes, tree_conf_threshold, defect_conf_threshold, image_name=image_name
+    )
 
     # Create visualization
-    vis_img = detector.visualize(tmp_path, results)
+    vis_img = detector.visualize(image, results)
     vis_img_rgb = cv2.cvtColor(vis_img, cv2.COLOR_BGR2RGB)
 
-    # Cleanup
-    Path(tmp_path).unlink()
-
     return results, vis_img_rgb
 
 
@@ -146,14 +150,15 @@ def main():
 
         detector = None
         if tree_model_path and defect_model_path:
-            # Show model status
-            st.success("✅ Tree Model")
-            st.success("✅ Defect Model")
-
-            detector, error = load_detector(tree_model_path, defect_model_path)
+            with st.spinner("Loading and warming up models..."):
+                detector, error = load_detector(tree_model_path, defect_model_path)
             if error:
                 st.error(f"Error loading models: {error}")
                 detector = None
+            else:
+                # Show model status once the models are loaded and warmed up
+                st.success("✅ Tree Model")
+                st.success("✅ Defect Model")
         else:
             if not tree_model_path:
                 st.error("❌ Tree Model Not Found")
@@ -235,25 +240,38 @@ def main():
     )
 
     if uploaded_file is not None:
-        # Load image
-        image = Image.open(uploaded_file)
+        # Decode once, in memory
+        image_bytes = uploaded_file.getvalue()
+        # The pool workers get the encoded bytes (cheaper to send than
+        # pixels); the decoded image is only for drawing
+        image = load_image(image_bytes)
 
         # Create two columns for display
         col1, col2 = st.columns(2)
 
         with col1:
             st.subheader("📷 Original Image")
-            st.image(image, use_container_width=True)
+            st.image(image, use_container_width=True, channels="BGR")
 
         with col2:
             st.subheader("🎯 Detection Results")
 
-            # Run inference button
+            # Run inference button. After the first run, slider changes
+            # re-render immediately from the detector's raw detection cache
+            upload_key = (uploaded_file.name, uploaded_file.size)
             if st.button("🚀 Run Detection", type="primary", use_container_width=True):
+                st.session_state["detected_upload"] = upload_key
+
+            if st.session_state.get("detected_upload") == upload_key:
                 with st.spinner("Running two-stage detection..."):
                     try:
                         results, vis_img = run_inference(
-                            detector, image, tree_conf, defect_conf
+                            detector,
+                            image_bytes,
+                            image,
+                            tree_conf,
+                            defect_conf,
+                            image_name=uploaded_file.name,
                         )
 
                         # Display result image
@@ -263,6 +281,12 @@ def main():
                         st.session_state["results"] = results
                         st.session_state["vis_img"] = vis_img
 
+                    except Overloaded as e:
+                        st.warning(
+                            f"The server is busy, please retry in {e.retry_after}s"
+                        )
+                    except TimeoutError:
+                        st.warning("Detection took too long, please retry")
                     except Exception as e:
                         st.error(f"Error during detection: {str(e)}")
 
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+"""
+Out-of-core two-stage detection for orthomosaics larger than RAM
+Streams tiles from disk (tiled/striped TIFF via tifffile + zarr, memory-mapped
+.npy) through the detector and writes per-tile detections and a downscaled
+overview incrementally, so the full raster is never held in memory.
+
+Usage:
+    python orthomosaic.py mosaic.tif
+    python orthomosaic.py mosaic.tif --memory-budget-mb 6000 --output-dir out/
+"""
+
+import json
+import math
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from result_cache import file_digest
+from tiling import select_windows, tile_windows
+
+# Rough peak activation memory of a YOLO forward pass per input pixel
+# (float32 feature maps of backbone + neck); used to size batches
+ACTIVATION_BYTES_PER_PIXEL = 160
+
+# Memory the budget cannot be spent on: both models, torch and python itself
+MODEL_OVERHEAD_MB = 1024
+
+TIFF_SUFFIXES = {".tif", ".tiff"}
+
+
+class WindowedReader:
+    """Random-access window reader over a raster on disk"""
+
+    def __init__(self, path: str):
+        """
+        Open a raster without reading its pixels
+
+        TIFFs are opened through tifffile's zarr store, so only the strips or
+        tiles touching a window are decoded (the full-resolution level of a
+        pyramidal TIFF is used). ``.npy`` arrays are memory-mapped. Any other
+        format is decoded whole with OpenCV as a fallback.
+
+        Args:
+            path: Raster file path
+        """
+        self.path = Path(path)
+        if not self.path.exists():
+            raise FileNotFoundError(f"Could not load image: {path}")
+
+        self._tiff = None
+        suffix = self.path.suffix.lower()
+        if suffix in TIFF_SUFFIXES:
+            self._array, self.rgb = self._open_tiff()
+        elif suffix == ".npy":
+            self._array, self.rgb = np.load(self.path, mmap_mode="r"), False
+        else:
+            print(f"Warning: {suffix} has no windowed reader, decoding it whole")
+            self._array = cv2.imread(str(self.path), cv2.IMREAD_UNCHANGED)
+            if self._array is None:
+                raise FileNotFoundError(f"Could not load image: {path}")
+            self.rgb = False
+
+        self.height, self.width = self._array.shape[:2]
+
+    def _open_tiff(self):
+        """Lazy (height, width[, channels]) view of the first TIFF series"""
+        import tifffile
+        import zarr
+
+        self._tiff = tifffile.TiffFile(self.path)
+        series = self._tiff.series[0]
+        store = series.aszarr(level=0)
+        array = zarr.open(store, mode="r")
+        if not hasattr(array, "shape"):  # pyramid opened as a group
+            array = array["0"]
+
+        axes = series.levels[0].axes
+        if axes not in ("YX", "YXS", "SYX"):
+            raise ValueError(f"Unsupported TIFF layout {axes} in {self.path}")
+        if axes == "SYX":
+            array = _PlanarView(array)
+        return array, True
+
+    def read_window(self, window: Tuple[int, int, int, int]) -> np.ndarray:
+        """
+        Read one window as an 8-bit BGR image
+
+        Args:
+            window: (x0, y0, x1, y1) in pixels
+
+        Returns:
+            HxWx3 uint8 BGR array
+        """
+        x0, y0, x1, y1 = window
+        return to_bgr8(np.asarray(self._array[y0:y1, x0:x1]), self.rgb)
+
+    def read_overview(self, scale: float, strip_rows: int = 1024) -> np.ndarray:
+        """
+        Downscaled 8-bit BGR copy of the whole raster
+
+        Read in horizontal strips, so memory is one strip plus the result.
+
+        Args:
+            scale: Output size divided by full-resolution size
+            strip_rows: Full-resolution rows per strip
+
+        Returns:
+            Downscaled BGR array
+        """
+        out_width = max(1, round(self.width * scale))
+        out_height = max(1, round(self.height * scale))
+        overview = np.zeros((out_height, out_width, 3), np.uint8)
+        for y0 in range(0, self.height, strip_rows):
+            y1 = min(y0 + strip_rows, self.height)
+            oy0, oy1 = round(y0 * scale), round(y1 * scale)
+            if oy1 <= oy0:
+                continue
+            strip = self.read_window((0, y0, self.width, y1))
+            overview[oy0:oy1] = cv2.resize(
+                strip, (out_width, oy1 - oy0), interpolation=cv2.INTER_AREA
+            )
+        return overview
+
+    def close(self):
+        """Release the file handle"""
+        if self._tiff is not None:
+            self._tiff.close()
+            self._tiff = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _PlanarView:
+    """Index a planar (channels, height, width) array as (height, width, channels)"""
+
+    def __init__(self, array):
+        self._array = array
+        self.shape = tuple(array.shape[1:]) + (array.shape[0],)
+
+    def __getitem__(self, key):
+        return np.moveaxis(np.asarray(self._array[(slice(None),) + key]), 0, -1)
+
+
+def to_bgr8(pixels: np.ndarray, rgb: bool = True) -> np.ndarray:
+    """
+    Convert raster pixels to 8-bit BGR
+
+    16-bit data is scaled to 8 bits, float data is assumed to be 0-1 (or
+    0-255 if it exceeds 1), gray is expanded and alpha dropped.
+
+    Args:
+        pixels: HxW or HxWxC array
+        rgb: Channels are in RGB order (TIFF) rather than BGR
+
+    Returns:
+        HxWx3 uint8 BGR array
+    """
+    if pixels.dtype == np.uint16:
+        pixels = (pixels >> 8).astype(np.uint8)
+    elif pixels.dtype != np.uint8:
+        pixels = pixels.astype(np.float32)
+        if pixels.size and pixels.max() <= 1.0:
+            pixels = pixels * 255
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+
+    if pixels.ndim == 2 or pixels.shape[2] == 1:
+        return cv2.cvtColor(pixels.reshape(pixels.shape[:2]), cv2.COLOR_GRAY2BGR)
+    pixels = pixels[:, :, :3]
+    if rgb:
+        return cv2.cvtColor(np.ascontiguousarray(pixels), cv2.COLOR_RGB2BGR)
+    return np.ascontiguousarray(pixels)
+
+
+def batch_size_for_budget(
+    memory_budget_mb: float,
+    tile_size: int,
+    model_sizes: List[int],
+    workers: int,
+    overview_pixels: int,
+    max_batch_size: int = 16,
+) -> int:
+    """
+    Largest tile batch that keeps peak memory within the budget
+
+    Accounts for tiles held in flight (two batches per worker), the letterboxed
+    float tensors and activations of every model, and the overview canvas.
+
+    Args:
+        memory_budget_mb: Total memory budget in megabytes
+        tile_size: Tile side in pixels
+        model_sizes: Input sizes of the models each tile goes through
+        workers: Tile worker threads
+        overview_pixels: Pixels of the overview canvas
+        max_batch_size: Upper limit on the batch size
+
+    Returns:
+        Tiles per batch (at least 1)
+    """
+    available = (memory_budget_mb - MODEL_OVERHEAD_MB) * 2**20 - overview_pixels * 3
+    tile_bytes = tile_size * tile_size * 3
+    model_bytes = sum(
+        size * size * (3 * 4 + ACTIVATION_BYTES_PER_PIXEL) for size in model_sizes
+    )
+    # 2 batches of raw tiles per worker in flight, 1 batch per worker in the models
+    per_tile = 2 * workers * tile_bytes + workers * model_bytes
+    batch_size = int(available // per_tile) if available > 0 else 0
+    if batch_size < 1:
+        print(
+            f"Warning: memory budget of {memory_budget_mb:.0f} MB is below the "
+            f"estimate for one tile per worker; using batches of 1"
+        )
+    return max(1, min(batch_size, max_batch_size))
+
+
+def _prediction_to_json(prediction) -> Dict:
+    boxes, scores, classes = prediction
+    return {
+        "boxes": boxes.tolist(),
+        "scores": scores.tolist(),
+        "classes": classes.astype(int).tolist(),
+    }
+
+
+def _tile_record(window, tree_pred, defect_pred) -> str:
+    record = {
+        "window": list(window),
+        "trees": _prediction_to_json(tree_pred),
+        "defects": _prediction_to_json(defect_pred),
+    }
+    return json.dumps(record) + "\n"
+
+
+def _prediction_from_json(data: Dict):
+    return (
+        np.asarray(data["boxes"], dtype=np.float32).reshape(-1, 4),
+        np.asarray(data["scores"], dtype=np.float32),
+        np.asarray(data["classes"], dtype=np.float32),
+    )
+
+
+def tile_log_header(
+    detector, tree_conf: float, defect_conf: float, tile_size: int, overlap: float
+) -> Dict:
+    """
+    Settings that per-tile detections depend on (first line of the tile log)
+
+    Args:
+        detector: TwoStageDetector instance
+        tree_conf: Confidence threshold for tree detection
+        defect_conf: Confidence threshold for defect detection
+        tile_size: Tile side in pixels
+        overlap: Fraction of each tile shared with its neighbour
+
+    Returns:
+        JSON-compatible dictionary of thresholds, tiling, backends and the
+        content digests of both models
+    """
+    header = {
+        "tree_conf": tree_conf,
+        "defect_conf": defect_conf,
+        "tile_size": tile_size,
+        "overlap": overlap,
+        "cascade": detector.cascade,
+        "backend": [detector.tree_backend, detector.defect_backend],
+        "precision": [detector.tree_precision, detector.defect_precision],
+        "models": [
+            file_digest(detector.tree_model_path),
+            file_digest(detector.defect_model_path),
+        ],
+    }
+    # Round-trip so tuples compare equal to what is read back from the log
+    return json.loads(json.dumps(header))
+
+
+def load_tile_log(
+    path: Path, header: Dict
+) -> Dict[Tuple[int, int, int, int], Tuple]:
+    """
+    Read per-tile detections written by a previous (possibly interrupted) run
+
+    Tiles are only reused when the log was written with the same settings;
+    otherwise (or for a log without a header) nothing is returned and the
+    caller starts a fresh log.
+
+    Args:
+        path: JSON lines file with a header line and one processed tile per line
+        header: Settings of the current run (see tile_log_header())
+
+    Returns:
+        Dictionary of window -> (tree prediction, defect prediction)
+    """
+    done = {}
+    if not path.exists():
+        return done
+    with open(path) as f:
+        try:
+            previous = json.loads(f.readline()).get("header")
+        except json.JSONDecodeError:
+            previous = None
+        if previous != header:
+            changed = sorted(
+                key for key in header if (previous or {}).get(key) != header[key]
+            )
+            print(
+                f"  Ignoring {path.name}: written with different settings "
+                f"({', '.join(changed)}); starting over"
+            )
+            return done
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break  # Truncated last line of an interrupted run
+            done[tuple(record["window"])] = (
+                _prediction_from_json(record["trees"]),
+                _prediction_from_json(record["defects"]),
+            )
+    return done
+
+
+def scale_results(results: Dict, scale: float) -> Dict:
+    """Copy of detection results with every box scaled (for the overview)"""
+    trees = []
+    for tree in results["trees"]:
+        trees.append(
+            {
+                **tree,
+                "bbox": [v * scale for v in tree["bbox"]],
+                "defects": [
+                    {**defect, "bbox": [v * scale for v in defect["bbox"]]}
+                    for defect in tree["defects"]
+                ],
+            }
+        )
+    return {**results, "trees": trees}
+
+
+def process_orthomosaic(
+    detector,
+    path: str,
+    output_dir: Optional[str] = None,
+    tree_conf: float = 0.25,
+    defect_conf: float = 0.05,
+    tile_size: int = 640,
+    overlap: float = 0.2,
+    memory_budget_mb: float = 4096,
+    overview_max_side: int = 4096,
+    workers: Optional[int] = None,
+    resume: bool = True,
+    flush_every: int = 20,
+    coarse_scale: Optional[float] = None,
+    coarse_conf: float = 0.1,
+) -> Dict:
+    """
+    Run two-stage detection over an orthomosaic without loading it into memory
+
+    Tiles are read window by window and streamed through the detector with a
+    batch size derived from the memory budget. Raw per-tile detections are
+    appended to ``<name>_tiles.jsonl`` as they arrive (an interrupted run
+    resumes from it if thresholds, tiling and models are unchanged) and the overview canvas is refreshed on disk every
+    ``flush_every`` batches. At the end detections are merged across tile
+    seams, matched to trees and drawn on the overview.
+
+    With ``coarse_scale`` the tree model first runs on a downscaled copy of
+    the mosaic and only tiles that contain trees are processed at full
+    resolution.
+
+    Args:
+        detector: TwoStageDetector instance
+        path: Orthomosaic file (TIFF, .npy or any OpenCV format)
+        output_dir: Directory for outputs (default: next to the input)
+        tree_conf: Confidence threshold for tree detection
+        defect_conf: Confidence threshold for defect detection
+        tile_size: Tile side in pixels
+        overlap: Fraction of each tile shared with its neighbour
+        memory_budget_mb: Peak memory budget for the whole process
+        overview_max_side: Longest side of the overview rendering in pixels
+        workers: Tile worker threads (default: up to 4, limited by CPU threads)
+        resume: Reuse tiles already recorded by a previous run with the same
+            settings
+        flush_every: Batches between overview writes
+        coarse_scale: Downscale factor of the coarse tree pass (default: process
+            every tile)
+        coarse_conf: Tree confidence threshold for the coarse pass
+
+    Returns:
+        Dictionary containing trees and their associated defects (same schema
+        as detect()), plus the number of tiles in the mosaic and processed
+    """
+    path = Path(path)
+    output_dir = Path(output_dir) if output_dir else path.parent
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tile_log = output_dir / f"{path.stem}_tiles.jsonl"
+    overview_path = output_dir / f"{path.stem}_overview.jpg"
+    results_path = output_dir / f"{path.stem}_results.json"
+
+    with WindowedReader(path) as reader:
+        width, height = reader.width, reader.height
+        windows = tile_windows(width, height, tile_size, overlap)
+
+        scale = min(1.0, overview_max_side / max(width, height))
+        overview = np.zeros(
+            (max(1, round(height * scale)), max(1, round(width * scale)), 3), np.uint8
+        )
+
+        overview_pixels = overview.shape[0] * overview.shape[1]
+        if coarse_scale:
+            overview_pixels += round(width * coarse_scale) * round(height * coarse_scale)
+
+        if workers is None:
+            workers = min(4, detector.num_threads)
+        batch_size = batch_size_for_budget(
+            memory_budget_mb,
+            tile_size,
+            [detector.tree_imgsz, detector.defect_imgsz],
+            workers,
+            overview_pixels,
+        )
+
+        print(f"\n{'='*60}")
+        print(f"Orthomosaic: {path.name} ({width}x{height})")
+        print(f"  {len(windows)} tiles of {tile_size}px")
+        print(f"  Batch size {batch_size} x {workers} workers "
+              f"(budget {memory_budget_mb:.0f} MB)")
+        print(f"{'='*60}")
+
+        selected = windows
+        if coarse_scale:
+            coarse = reader.read_overview(coarse_scale, strip_rows=tile_size)
+            regions = detector.find_tree_regions(coarse, coarse_scale, coarse_conf)
+            selected = [windows[i] for i in select_windows(windows, regions)]
+            # Skipped tiles are never read again; fill the overview from here
+            overview[:] = cv2.resize(
+                coarse, overview.shape[1::-1], interpolation=cv2.INTER_AREA
+            )
+            del coarse
+            print(
+                f"  Coarse pass: {len(regions)} tree regions, skipping "
+                f"{len(windows) - len(selected)}/{len(windows)} tiles "
+                f"({1 - len(selected) / len(windows):.0%})"
+            )
+
+        header = tile_log_header(detector, tree_conf, defect_conf, tile_size, overlap)
+        done = load_tile_log(tile_log, header) if resume else {}
+        todo = [window for window in selected if window not in done]
+        if done:
+            print(f"  {len(done)} tiles already done")
+
+        def paste(window, tile):
+            x0, y0, x1, y1 = window
+            ox0, oy0 = int(x0 * scale), int(y0 * scale)
+            ox1 = max(ox0 + 1, min(overview.shape[1], int(math.ceil(x1 * scale))))
+            oy1 = max(oy0 + 1, min(overview.shape[0], int(math.ceil(y1 * scale))))
+            overview[oy0:oy1, ox0:ox1] = cv2.resize(
+                tile, (ox1 - ox0, oy1 - oy0), interpolation=cv2.INTER_AREA
+            )
+
+        # Tiles finished by an earlier run still need their overview pixels
+        for window in done:
+            paste(window, reader.read_window(window))
+
+        start = time.perf_counter()
+        processed = 0
+        with open(tile_log, "w") as log:
+            log.write(json.dumps({"header": header}) + "\n")
+            # Rewrite earlier records (drops a line truncated by an interruption)
+            for window, (tree_pred, defect_pred) in done.items():
+                log.write(_tile_record(window, tree_pred, defect_pred))
+            batches = detector.iter_tile_predictions(
+                reader.read_window,
+                todo,
+                tree_conf,
+                defect_conf,
+                batch_size=batch_size,
+                workers=workers,
+            )
+            for i, (batch, tiles, tree_preds, defect_preds) in enumerate(batches, 1):
+                for window, tile, tree_pred, defect_pred in zip(
+                    batch, tiles, tree_preds, defect_preds
+                ):
+                    paste(window, tile)
+                    done[window] = (tree_pred, defect_pred)
+                    log.write(_tile_record(window, tree_pred, defect_pred))
+                log.flush()
+
+                processed += len(batch)
+                if i % flush_every == 0:
+                    cv2.imwrite(str(overview_path), overview)
+                    elapsed = time.perf_counter() - start
+                    print(
+                        f"  {processed}/{len(todo)} tiles "
+                        f"({processed / elapsed:.1f} tiles/s)"
+                    )
+
+    # Merge in window order so results do not depend on resume history
+    parts = [done[window] for window in windows if window in done]
+    results = detector.merge_tile_results(
+        str(path), [part[0] for part in parts], [part[1] for part in parts]
+    )
+    results["image_size"] = [width, height]
+    results["tiles_total"] = len(windows)
+    results["tiles_processed"] = len(parts)
+
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to: {results_path}")
+
+    detector.visualize(overview, scale_results(results, scale), overview_path)
+    return results
+
+
+def main():
+    """Command-line entry point"""
+    import argparse
+
+    from config_loader import load_config
+    from two_stage_detection import TwoStageDetector
+
+    config = load_config()
+    settings = config.get_orthomosaic_settings()
+
+    parser = argparse.ArgumentParser(
+        description="Two-stage detection on orthomosaics larger than RAM"
+    )
+    parser.add_argument("mosaic", help="Orthomosaic file (tiled TIFF recommended)")
+    parser.add_argument(
+        "--tree-model", default="runs/detect/tree_detection_cpu/weights/best.pt"
+    )
+    parser.add_argument(
+        "--defect-model", default="runs/defects/tree_defects_detection2/weights/best.pt"
+    )
+    parser.add_argument("--output-dir", help="Output directory (default: next to input)")
+    parser.add_argument("--tree-conf", type=float, default=0.25)
+    parser.add_argument("--defect-conf", type=float, default=0.05)
+    parser.add_argument("--tile-size", type=int, default=settings["tile_size"])
+    parser.add_argument("--overlap", type=float, default=settings["overlap"])
+    parser.add_argument(
+        "--memory-budget-mb", type=float, default=settings["memory_budget_mb"]
+    )
+    parser.add_argument(
+        "--overview-max-side", type=int, default=settings["overview_max_side"]
+    )
+    parser.add_argument(
+        "--coarse-scale",
+        type=float,
+        default=settings["coarse_scale"],
+        help="Find trees on a copy downscaled by this factor first and skip "
+        "tiles without trees (0 = process every tile)",
+    )
+    parser.add_argument(
+        "--coarse-conf", type=float, default=settings["coarse_conf"]
+    )
+    parser.add_argument("--workers", type=int, help="Tile worker threads")
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore tiles from a previous run"
+    )
+    args = parser.parse_args()
+
+    detector = TwoStageDetector(
+        args.tree_model, args.defect_model, **config.get_detector_options()
+    )
+    results = process_orthomosaic(
+        detector,
+        args.mosaic,
+        output_dir=args.output_dir,
+        tree_conf=args.tree_conf,
+        defect_conf=args.defect_conf,
+        tile_size=args.tile_size,
+        overlap=args.overlap,
+        memory_budget_mb=args.memory_budget_mb,
+        overview_max_side=args.overview_max_side,
+        workers=args.workers,
+        resume=not args.restart,
+        coarse_scale=args.coarse_scale or None,
+        coarse_conf=args.coarse_conf,
+    )
+    print(f"Trees: {results['total_trees']}, defects: {results['total_defects']}")
+
+
+if __name__ == "__main__":
+    main()
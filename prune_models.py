@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Structured channel pruning of the tree or defect model to a CPU latency target
+Removes the lowest-magnitude convolution channels step by step, fine-tunes
+after every step with the settings of train_cpu.py / train_defects.py, and
+stops at the first step whose forward pass meets the target latency. Each
+step's latency and mAP are reported so a smaller model can be picked for a
+per-image SLA on cheaper hardware.
+
+Usage:
+    python prune_models.py --stage tree --target-ms 40
+    python prune_models.py --stage defect --target-ms 120 --threads 4 --finetune-epochs 20
+
+Needs torch-pruning (pip install torch-pruning). The pruned checkpoints
+contain SplitC2f blocks from this file, so keep prune_models.py next to the
+scripts that load them.
+"""
+
+import argparse
+import copy
+import json
+import shutil
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List
+
+import torch
+from torch import nn
+from ultralytics import YOLO
+from ultralytics.nn.modules import C2PSA, Detect
+from ultralytics.nn.modules.block import C2f
+from ultralytics.nn.modules.conv import Conv
+
+from backends import model_input_size
+from quantize_models import evaluate
+
+# Stage name -> default weights, dataset and the fine-tuning settings of the
+# script that trained it
+STAGES = {
+    "tree": {
+        "weights": "runs/detect/tree_detection_cpu/weights/best.pt",
+        "data": "dataset/data.yaml",
+        # train_cpu.py
+        "train": dict(batch=4, workers=2, patience=5, cache=False, amp=False),
+    },
+    "defect": {
+        "weights": "runs/defects/tree_defects_detection2/weights/best.pt",
+        "data": "defects/dataset/data.yaml",
+        # train_defects.py
+        "train": dict(
+            batch=8,
+            workers=4,
+            patience=10,
+            cache=False,
+            amp=False,
+            seed=0,
+            deterministic=True,
+            hsv_h=0.015,
+            hsv_s=0.7,
+            hsv_v=0.4,
+            degrees=0.0,
+            translate=0.1,
+            scale=0.5,
+            shear=0.0,
+            perspective=0.0,
+            flipud=0.0,
+            fliplr=0.5,
+            mosaic=1.0,
+            mixup=0.0,
+        ),
+    },
+}
+
+
+class SplitC2f(nn.Module):
+    """
+    C2f/C3k2 block with its input convolution split in two
+
+    C2f chunks one convolution's output into two halves, which channel
+    pruning can't follow. Two separate convolutions compute the same thing
+    and let each half be pruned on its own.
+    """
+
+    def __init__(self, block: C2f):
+        super().__init__()
+        half = block.c
+        in_channels = block.cv1.conv.in_channels
+        self.cv0 = Conv(in_channels, half, 1, 1)
+        self.cv1 = Conv(in_channels, half, 1, 1)
+        for idx, conv in enumerate((self.cv0, self.cv1)):
+            rows = slice(idx * half, (idx + 1) * half)
+            conv.conv.weight.data.copy_(block.cv1.conv.weight.data[rows])
+            for name in ("weight", "bias", "running_mean", "running_var"):
+                getattr(conv.bn, name).data.copy_(getattr(block.cv1.bn, name).data[rows])
+            conv.bn.eps = block.cv1.bn.eps
+        self.cv2 = block.cv2
+        self.m = block.m
+        # Graph bookkeeping used by DetectionModel's forward
+        for attr in ("i", "f", "type", "np"):
+            if hasattr(block, attr):
+                setattr(self, attr, getattr(block, attr))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        y = [self.cv0(x), self.cv1(x)]
+        y.extend(m(y[-1]) for m in self.m)
+        return self.cv2(torch.cat(y, 1))
+
+
+def split_c2f_blocks(module: nn.Module):
+    """Replace every C2f-family block (C2f, C3k2) with a SplitC2f, in place"""
+    for name, child in module.named_children():
+        if isinstance(child, C2f):
+            child = SplitC2f(child)
+            setattr(module, name, child)
+        split_c2f_blocks(child)
+
+
+def measure_latency(network: nn.Module, imgsz: int, runs: int = 20) -> float:
+    """Median forward pass time (ms) of a fused copy of the network, batch of 1"""
+    model = copy.deepcopy(network).float().eval()
+    model.fuse(verbose=False)
+    inputs = torch.zeros(1, 3, imgsz, imgsz)
+    times = []
+    with torch.no_grad():
+        for _ in range(3):
+            model(inputs)
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(inputs)
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def finetune(
+    network: nn.Module,
+    weights: Path,
+    data: str,
+    imgsz: int,
+    epochs: int,
+    settings: Dict,
+    project: Path,
+    name: str,
+) -> Path:
+    """
+    Fine-tune a pruned network in place with ultralytics' detection trainer
+
+    Returns:
+        Path of the best checkpoint of this step
+    """
+    from ultralytics.models.yolo.detect import DetectionTrainer
+
+    device = "0" if torch.cuda.is_available() else "cpu"
+    trainer = DetectionTrainer(
+        overrides=dict(
+            model=str(weights),
+            data=data,
+            imgsz=imgsz,
+            epochs=epochs,
+            device=device,
+            project=str(project),
+            name=name,
+            exist_ok=True,
+            plots=False,
+            verbose=False,
+            **settings,
+        )
+    )
+    trainer.model = network  # Trained as is instead of rebuilt from its YAML
+    trainer.train()
+    return Path(trainer.best)
+
+
+def print_table(rows: List[Dict], target_ms: float):
+    """Print the latency/accuracy tradeoff of all steps so far"""
+    print(f"\n{'='*72}")
+    print(
+        f"{'Step':>4} {'Params M':>9} {'GFLOPs':>7} {'Latency ms':>11} "
+        f"{'mAP50':>7} {'mAP50-95':>9} {'Meets':>6}"
+    )
+    print(f"{'-'*72}")
+    for row in rows:
+        meets = "yes" if row["latency_ms"] <= target_ms else ""
+        print(
+            f"{row['step']:>4} {row['params_m']:>9.2f} {row['gflops']:>7.2f} "
+            f"{row['latency_ms']:>11.1f} {row['map50']:>7.3f} {row['map50_95']:>9.3f} "
+            f"{meets:>6}"
+        )
+    print(f"{'='*72}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Prune a detection model to a CPU latency target"
+    )
+    parser.add_argument("--stage", default="tree", choices=list(STAGES))
+    parser.add_argument("--weights", help="Checkpoint to prune (default: the stage's best.pt)")
+    parser.add_argument("--data", help="Dataset YAML (default: the stage's dataset)")
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        required=True,
+        help="Target forward pass latency per image in ms",
+    )
+    parser.add_argument(
+        "--max-ratio",
+        type=float,
+        default=0.75,
+        help="Largest fraction of channels removed in total (default 0.75)",
+    )
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=6,
+        help="Pruning steps to reach --max-ratio (default 6)",
+    )
+    parser.add_argument(
+        "--finetune-epochs", type=int, default=10, help="Fine-tuning epochs per step"
+    )
+    parser.add_argument("--threads", type=int, default=0, help="Torch threads for timing (0 = default)")
+    parser.add_argument("--runs", type=int, default=20, help="Timed forward passes")
+    parser.add_argument("--split", default="val", help="Evaluation split")
+    parser.add_argument("--output", help="Output directory (default: runs/pruned/<stage>)")
+    args = parser.parse_args()
+
+    try:
+        import torch_pruning as tp
+    except ImportError:
+        print("Error: torch-pruning is not installed (pip install torch-pruning)")
+        sys.exit(1)
+
+    stage = STAGES[args.stage]
+    weights = Path(args.weights or stage["weights"])
+    data = args.data or stage["data"]
+    output = Path(args.output or f"runs/pruned/{args.stage}").resolve()
+    if not weights.exists():
+        print(f"Error: {args.stage} model not found at {weights}")
+        sys.exit(1)
+    if not Path(data).exists():
+        print(f"Error: {args.stage} dataset not found at {data}")
+        sys.exit(1)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    model = YOLO(str(weights))
+    imgsz = model_input_size(model)
+    network = model.model.float()
+    split_c2f_blocks(network)
+    network.eval()
+    for param in network.parameters():
+        param.requires_grad = True  # The dependency graph is traced through autograd
+
+    # Channel dependencies don't depend on the input size; keep the trace small
+    example = torch.zeros(1, 3, 128, 128)
+    pruner = tp.pruner.BasePruner(
+        network,
+        example,
+        importance=tp.importance.GroupMagnitudeImportance(p=2),
+        pruning_ratio=args.max_ratio,
+        iterative_steps=args.steps,
+        # The head's output channels are the classes/boxes; attention reshapes by head
+        ignored_layers=[m for m in network.modules() if isinstance(m, (Detect, C2PSA))],
+        round_to=8,  # SIMD-friendly channel counts
+    )
+
+    def record(step: int, checkpoint: Path) -> Dict:
+        with torch.no_grad():
+            macs, params = tp.utils.count_ops_and_params(
+                network, torch.zeros(1, 3, imgsz, imgsz)
+            )
+        metrics = evaluate(str(checkpoint), data, imgsz, args.split)
+        return {
+            "step": step,
+            "checkpoint": str(checkpoint),
+            "params_m": params / 1e6,
+            "gflops": 2 * macs / 1e9,
+            "latency_ms": measure_latency(network, imgsz, args.runs),
+            "map50": metrics["map50"],
+            "map50_95": metrics["map50_95"],
+        }
+
+    print(f"Measuring the unpruned {args.stage} model ({imgsz}px, {torch.get_num_threads()} threads)...")
+    rows = [record(0, weights)]
+    print_table(rows, args.target_ms)
+
+    chosen = rows[0] if rows[0]["latency_ms"] <= args.target_ms else None
+    for step in range(1, args.steps + 1):
+        if chosen is not None:
+            break
+        pruner.step()
+        print(f"\nStep {step}/{args.steps}: pruned to {args.max_ratio * step / args.steps:.0%} fewer channels, fine-tuning...")
+        best = finetune(
+            network,
+            weights,
+            data,
+            imgsz,
+            args.finetune_epochs,
+            stage["train"],
+            output,
+            f"step_{step}",
+        )
+        # Continue pruning from the best fine-tuned weights
+        network.load_state_dict(YOLO(str(best)).model.float().state_dict())
+        network.eval()
+        for param in network.parameters():
+            param.requires_grad = True
+
+        rows.append(record(step, best))
+        print_table(rows, args.target_ms)
+        if rows[-1]["latency_ms"] <= args.target_ms:
+            chosen = rows[-1]
+
+    output.mkdir(parents=True, exist_ok=True)
+    report_path = output / "pruning_report.json"
+    with open(report_path, "w") as f:
+        json.dump(
+            {
+                "weights": str(weights),
+                "data": data,
+                "target_ms": args.target_ms,
+                "threads": torch.get_num_threads(),
+                "steps": rows,
+                "chosen": chosen,
+            },
+            f,
+            indent=2,
+        )
+    print(f"\nReport saved to: {report_path}")
+
+    if chosen is None:
+        print(
+            f"WARNING: no step reached {args.target_ms:.1f} ms; "
+            f"try a larger --max-ratio or more threads"
+        )
+        sys.exit(1)
+    if chosen["step"] == 0:
+        print("The unpruned model already meets the target")
+        sys.exit(0)
+
+    final = output / "best.pt"
+    shutil.copy2(chosen["checkpoint"], final)
+    print(
+        f"Step {chosen['step']} meets the target: {chosen['latency_ms']:.1f} ms, "
+        f"mAP50 {rows[0]['map50']:.3f} -> {chosen['map50']:.3f}"
+    )
+    print(f"Pruned model saved to: {final}")
+
+
+if __name__ == "__main__":
+    # Run the imported module so pickled checkpoints refer to
+    # prune_models.SplitC2f rather than __main__.SplitC2f
+    from prune_models import main as prune_main
+
+    prune_main()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+INT8 post-training quantization of the tree and defect models
+Calibrates on a sample of the training images, exports INT8 OpenVINO models
+next to best.pt and compares them with the FP32 models: per-stage latency,
+mAP50 and per-class recall. Classes whose recall drops by more than the
+allowed margin are flagged and the script exits with an error, so rare
+classes like tree_hole are never lost silently.
+
+Usage:
+    python quantize_models.py
+    python quantize_models.py --stages defect --fraction 0.5 --max-recall-drop 0.05
+
+The detector uses the INT8 models with backend = openvino_int8 in config.ini.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import sys
+from pathlib import Path
+
+from ultralytics import YOLO
+
+from backends import artifact_path, model_input_size, record_source
+
+# Stage name -> (default weights, default dataset)
+STAGES = {
+    "tree": (
+        "runs/detect/tree_detection_cpu/weights/best.pt",
+        "dataset/data.yaml",
+    ),
+    "defect": (
+        "runs/defects/tree_defects_detection2/weights/best.pt",
+        "defects/dataset/data.yaml",
+    ),
+}
+
+
+def quantize(weights: Path, data: str, imgsz: int, fraction: float) -> Path:
+    """
+    Export an INT8 OpenVINO model calibrated on part of the training set
+
+    Args:
+        weights: FP32 .pt checkpoint
+        data: Dataset YAML (the train split is used for calibration)
+        imgsz: Model input size
+        fraction: Fraction of the training images used for calibration
+
+    Returns:
+        Path of the INT8 model directory (next to the weights), recorded as
+        made from these weights (see backends.is_current)
+    """
+    print(f"Quantizing {weights} (calibration: {fraction:.0%} of {data})...")
+    exported = YOLO(str(weights)).export(
+        format="openvino",
+        int8=True,
+        data=data,
+        imgsz=imgsz,
+        fraction=fraction,
+        dynamic=True,
+    )
+    record_source(Path(exported), weights)
+    return Path(exported)
+
+
+def evaluate(model_path: str, data: str, imgsz: int, split: str) -> dict:
+    """
+    Validate a model and collect the numbers the report compares
+
+    Returns:
+        Dictionary with mAP50, mAP50-95, inference latency (ms/image) and
+        recall per class name
+    """
+    model = YOLO(model_path, task="detect")
+    with contextlib.redirect_stdout(io.StringIO()):
+        metrics = model.val(
+            data=data,
+            imgsz=imgsz,
+            split=split,
+            batch=1,
+            device="cpu",
+            plots=False,
+            verbose=False,
+        )
+
+    names = metrics.names
+    recall = {
+        names[int(cls)]: float(metrics.box.r[i])
+        for i, cls in enumerate(metrics.box.ap_class_index)
+    }
+    return {
+        "map50": float(metrics.box.map50),
+        "map50_95": float(metrics.box.map),
+        "latency_ms": float(metrics.speed["inference"]),
+        "recall": recall,
+    }
+
+
+def compare(fp32: dict, int8: dict, max_recall_drop: float) -> list:
+    """
+    Per-class recall comparison
+
+    A class is flagged when its recall drops by more than ``max_recall_drop``
+    or when INT8 stops finding a class that FP32 found at all.
+
+    Returns:
+        List of (class name, FP32 recall, INT8 recall, flagged)
+    """
+    rows = []
+    for name, before in fp32["recall"].items():
+        after = int8["recall"].get(name, 0.0)
+        flagged = before - after > max_recall_drop or (before > 0 and after == 0)
+        rows.append((name, before, after, flagged))
+    return rows
+
+
+def print_report(stage: str, fp32: dict, int8: dict, rows: list):
+    """Print the FP32 vs INT8 comparison of one stage"""
+    print(f"\n{'='*60}")
+    print(f"{stage.upper()} MODEL: FP32 vs INT8")
+    print(f"{'='*60}")
+    speedup = fp32["latency_ms"] / int8["latency_ms"] if int8["latency_ms"] else 0
+    print(
+        f"Latency:  {fp32['latency_ms']:.1f} ms -> {int8['latency_ms']:.1f} ms "
+        f"({speedup:.2f}x)"
+    )
+    print(f"mAP50:    {fp32['map50']:.3f} -> {int8['map50']:.3f}")
+    print(f"mAP50-95: {fp32['map50_95']:.3f} -> {int8['map50_95']:.3f}")
+    print(f"\n{'Class':<16} {'FP32 R':>8} {'INT8 R':>8} {'Delta':>8}")
+    print(f"{'-'*44}")
+    for name, before, after, flagged in rows:
+        mark = "  <-- DROPPED" if flagged else ""
+        print(f"{name:<16} {before:>8.3f} {after:>8.3f} {after - before:>+8.3f}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="INT8 quantization of the tree and defect models"
+    )
+    parser.add_argument(
+        "--stages", nargs="+", default=list(STAGES), choices=list(STAGES)
+    )
+    parser.add_argument("--tree-model", default=STAGES["tree"][0])
+    parser.add_argument("--tree-data", default=STAGES["tree"][1])
+    parser.add_argument("--defect-model", default=STAGES["defect"][0])
+    parser.add_argument("--defect-data", default=STAGES["defect"][1])
+    parser.add_argument(
+        "--fraction",
+        type=float,
+        default=0.25,
+        help="Fraction of training images used for calibration (default 0.25)",
+    )
+    parser.add_argument("--split", default="val", help="Evaluation split")
+    parser.add_argument(
+        "--max-recall-drop",
+        type=float,
+        default=0.10,
+        help="Flag classes whose recall drops by more than this (default 0.10)",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for stage in args.stages:
+        weights = Path(getattr(args, f"{stage}_model"))
+        data = getattr(args, f"{stage}_data")
+        if not weights.exists():
+            print(f"Error: {stage} model not found at {weights}")
+            sys.exit(1)
+        if not Path(data).exists():
+            print(f"Error: {stage} dataset not found at {data}")
+            sys.exit(1)
+
+        imgsz = model_input_size(YOLO(str(weights)))
+        int8_path = quantize(weights, data, imgsz, args.fraction)
+        if int8_path != artifact_path(weights, "openvino_int8"):
+            print(f"Warning: INT8 model written to unexpected path {int8_path}")
+
+        print("Evaluating FP32 and INT8 models...")
+        fp32 = evaluate(str(weights), data, imgsz, args.split)
+        int8 = evaluate(str(int8_path), data, imgsz, args.split)
+        rows = compare(fp32, int8, args.max_recall_drop)
+        print_report(stage, fp32, int8, rows)
+
+        dropped = [name for name, _, _, flagged in rows if flagged]
+        report_path = int8_path / "quantization_report.json"
+        with open(report_path, "w") as f:
+            json.dump(
+                {
+                    "weights": str(weights),
+                    "data": data,
+                    "fraction": args.fraction,
+                    "max_recall_drop": args.max_recall_drop,
+                    "fp32": fp32,
+                    "int8": int8,
+                    "dropped_classes": dropped,
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nReport saved to: {report_path}")
+
+        if dropped:
+            failed = True
+            print(
+                f"WARNING: INT8 {stage} model loses recall on: {', '.join(dropped)}. "
+                f"Keep FP32 for this stage or calibrate with more images of these classes."
+            )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
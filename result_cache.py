@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Result caching for two-stage detection
+Raw (low-threshold) model outputs are kept per image so that a different
+confidence threshold is answered by filtering instead of re-running the models,
+in memory per detector and optionally on disk across processes.
+"""
+
+import hashlib
+import io
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# (boxes, confidences, class ids) of one model on one image
+Prediction = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def image_digest(image: np.ndarray) -> str:
+    """Content hash of a decoded image (pixels, shape and dtype)"""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(f"{image.shape}{image.dtype}".encode())
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+def filter_prediction(prediction: Prediction, conf: float) -> Prediction:
+    """
+    Keep the detections above a confidence threshold
+
+    Uses the same strict ``>`` test as YOLO's NMS. Greedy NMS never lets a
+    lower-scoring box suppress a higher-scoring one, so filtering detections
+    made at a lower threshold gives exactly what a run at ``conf`` would.
+    """
+    boxes, scores, classes = prediction
+    keep = scores > conf
+    return boxes[keep], scores[keep], classes[keep]
+
+
+class RawDetectionCache:
+    """Thread-safe in-memory LRU of raw detections per image"""
+
+    def __init__(self, max_entries: int = 32):
+        """
+        Args:
+            max_entries: Images to keep (least recently used are dropped)
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(
+        self, key: str, conf: float
+    ) -> Optional[Tuple[Prediction, Prediction]]:
+        """
+        Cached (tree, defect) predictions usable for threshold ``conf``
+
+        Returns:
+            Predictions made at a threshold <= conf, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] > conf:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, conf: float, raw: Tuple[Prediction, Prediction]):
+        """Store predictions made at threshold ``conf``"""
+        with self._lock:
+            self._entries[key] = (conf, raw)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def file_digest(*paths: str) -> str:
+    """Content hash of one or more files (e.g. both model weight files)"""
+    digest = hashlib.blake2b(digest_size=20)
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_key(image_key: str, model_key: str, params: Dict) -> str:
+    """Key of one detection: image content, model weights and parameters"""
+    payload = json.dumps([image_key, model_key, params], sort_keys=True)
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+def _encode(raw: Tuple[Prediction, Prediction]) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(buffer, *[array for prediction in raw for array in prediction])
+    return buffer.getvalue()
+
+
+def _decode(blob: bytes) -> Tuple[Prediction, Prediction]:
+    with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+        arrays = [data[f"arr_{i}"] for i in range(6)]
+    return tuple(arrays[:3]), tuple(arrays[3:])
+
+
+class PersistentResultCache:
+    """
+    On-disk cache of raw detections shared between processes
+
+    Backed by SQLite in WAL mode, so the CLI, the Streamlit apps and the
+    desktop GUI can read and write the same file at once. Entries are evicted
+    least recently used first once the stored bytes exceed the budget.
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 512):
+        """
+        Args:
+            path: SQLite database file (created if missing)
+            max_size_mb: Byte budget for stored detections
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_size_mb * 2**20)
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS detections ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS detections_last_access"
+                " ON detections (last_access)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Connection owned by the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Tuple[Prediction, Prediction]]:
+        """Cached (tree, defect) predictions, or None"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT value FROM detections WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute(
+                "UPDATE detections SET last_access = ? WHERE key = ?",
+                (time.time(), key),
+            )
+        return _decode(row[0])
+
+    def contains(self, key: str) -> bool:
+        """Whether predictions are cached under a key (without reading them)"""
+        row = self._connect().execute(
+            "SELECT 1 FROM detections WHERE key = ?", (key,)
+        ).fetchone()
+        return row is not None
+
+    def put(self, key: str, raw: Tuple[Prediction, Prediction]):
+        """Store predictions and evict old entries beyond the byte budget"""
+        blob = _encode(raw)
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO detections (key, value, size, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, blob, len(blob), time.time()),
+            )
+            total = conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM detections"
+            ).fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            # Drop least recently used entries until back under budget
+            freed = 0
+            rows = conn.execute(
+                "SELECT key, size FROM detections ORDER BY last_access"
+            )
+            stale = []
+            for old_key, size in rows:
+                if total - freed <= self.max_bytes:
+                    break
+                stale.append((old_key,))
+                freed += size
+            conn.executemany("DELETE FROM detections WHERE key = ?", stale)
+
+    def stats(self) -> Dict:
+        """Number of entries and stored bytes"""
+        count, size = self._connect().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM detections"
+        ).fetchone()
+        return {"entries": count, "bytes": size, "max_bytes": self.max_bytes}
+
+    def clear(self):
+        """Delete all entries"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM detections")
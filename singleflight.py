@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Single-flight request coalescing
+Concurrent calls with the same key share one computation: the first caller
+runs it, the others wait for its result instead of repeating the work.
+"""
+
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class SingleFlight:
+    """Table of in-flight computations keyed by request"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0  # Calls answered by another caller's computation
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run ``fn`` unless an identical call is already running, then share its result
+
+        Exceptions are shared too: every waiting caller re-raises the error of
+        the computation it joined. Results are not kept once the call
+        finishes (caching is a separate concern).
+
+        Args:
+            key: Hashable identity of the request (e.g. image hash + parameters)
+            fn: Computation to run
+
+        Returns:
+            (result, True if this call joined another caller's computation)
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(fn())
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result(), False
+
+    def in_flight(self) -> int:
+        """Number of distinct computations currently running"""
+        with self._lock:
+            return len(self._calls)
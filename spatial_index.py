@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Uniform grid spatial index over bounding boxes
+Used to find overlapping box pairs without building an all-pairs matrix,
+which runs out of memory on stitched orthomosaics with tens of thousands of boxes
+"""
+
+import numpy as np
+from typing import Optional, Tuple
+
+
+def _normalized(boxes: np.ndarray) -> np.ndarray:
+    """xyxy boxes as float64 with x1 <= x2 and y1 <= y2"""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.concatenate(
+        [np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])],
+        axis=1,
+    )
+
+
+class GridIndex:
+    """Uniform grid over xyxy boxes for overlap candidate queries"""
+
+    def __init__(self, boxes: np.ndarray, cell_size: Optional[float] = None):
+        """
+        Build the index
+
+        Args:
+            boxes: Nx4 xyxy boxes to index
+            cell_size: Grid cell side in pixels (default: median box side)
+        """
+        self.boxes = _normalized(boxes)
+
+        if cell_size is None:
+            sides = np.maximum(
+                self.boxes[:, 2] - self.boxes[:, 0], self.boxes[:, 3] - self.boxes[:, 1]
+            )
+            cell_size = float(np.median(sides)) if len(sides) else 1.0
+        self.cell_size = max(cell_size, 1.0)
+
+        # Sorted (cell key, box index) table; lookups are binary searches
+        cells_x, cells_y, owners = self._cells(self.boxes)
+        self._origin = (
+            (int(cells_x.min()), int(cells_y.min())) if len(owners) else (0, 0)
+        )
+        keys = self._keys(cells_x, cells_y)
+        order = np.argsort(keys, kind="stable")
+        self._keys_sorted = keys[order]
+        self._owners_sorted = owners[order]
+
+    def _cells(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Expand every box into the grid cells it touches"""
+        x0 = np.floor(boxes[:, 0] / self.cell_size).astype(np.int64)
+        y0 = np.floor(boxes[:, 1] / self.cell_size).astype(np.int64)
+        x1 = np.floor(boxes[:, 2] / self.cell_size).astype(np.int64)
+        y1 = np.floor(boxes[:, 3] / self.cell_size).astype(np.int64)
+        nx = np.maximum(x1 - x0 + 1, 1)
+        ny = np.maximum(y1 - y0 + 1, 1)
+        counts = nx * ny
+
+        owners = np.repeat(np.arange(len(boxes)), counts)
+        # Position of each cell within its box's block of cells
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells_x = np.repeat(x0, counts) + offsets // np.repeat(ny, counts)
+        cells_y = np.repeat(y0, counts) + offsets % np.repeat(ny, counts)
+        return cells_x, cells_y, owners
+
+    def _keys(self, cells_x: np.ndarray, cells_y: np.ndarray) -> np.ndarray:
+        """Single int64 key per cell (rows of 2**31 cells)"""
+        return (cells_x - self._origin[0]) * (1 << 31) + (cells_y - self._origin[1])
+
+    def candidate_pairs(self, queries: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find all (indexed box, query box) pairs that intersect
+
+        Boxes that only touch at an edge or corner count as intersecting.
+        Corners are normalized first, so a box given as (x2, y2, x1, y1) still
+        covers its area.
+
+        Args:
+            queries: Mx4 xyxy boxes
+
+        Returns:
+            (indexed box indices, query indices) of intersecting pairs, without duplicates
+        """
+        queries = _normalized(queries)
+        empty = np.zeros(0, dtype=np.int64)
+        if len(self._keys_sorted) == 0 or len(queries) == 0:
+            return empty, empty
+
+        # Boxes sharing at least one cell with each query
+        cells_x, cells_y, query_owners = self._cells(queries)
+        keys = self._keys(cells_x, cells_y)
+        left = np.searchsorted(self._keys_sorted, keys, side="left")
+        right = np.searchsorted(self._keys_sorted, keys, side="right")
+        hits = right - left
+
+        query_idx = np.repeat(query_owners, hits)
+        positions = np.arange(hits.sum()) - np.repeat(np.cumsum(hits) - hits, hits)
+        box_idx = self._owners_sorted[np.repeat(left, hits) + positions]
+
+        # A pair can share several cells
+        pair_keys = np.unique(box_idx * len(queries) + query_idx)
+        box_idx = pair_keys // len(queries)
+        query_idx = pair_keys % len(queries)
+
+        # Exact (closed) intersection test
+        b = self.boxes[box_idx]
+        q = queries[query_idx]
+        overlap = (
+            (np.maximum(b[:, 0], q[:, 0]) <= np.minimum(b[:, 2], q[:, 2]))
+            & (np.maximum(b[:, 1], q[:, 1]) <= np.minimum(b[:, 3], q[:, 3]))
+        )
+        return box_idx[overlap], query_idx[overlap]
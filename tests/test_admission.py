@@ -0,0 +1,112 @@
+"""
+AIMD admission control: limit increase, backoff and rejection
+"""
+
+import pytest
+
+import admission
+from admission import BACKOFF, AdmissionController, Overloaded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(admission.time, "monotonic", fake)
+    return fake
+
+
+def controller(**kwargs):
+    options = dict(target_latency_ms=1000, initial_limit=2, max_queue=2)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+
+def test_fast_requests_at_the_limit_grow_it(clock):
+    control = controller()
+    tickets = [control.enter(), control.enter()]
+    clock.now += 0.1
+    control.release(tickets[0])
+    assert control.limit == pytest.approx(2.5)
+    control.release(tickets[1])  # One running below the limit: no growth
+    assert control.limit == pytest.approx(2.5)
+    assert control.latency == pytest.approx(0.1)
+
+
+def test_limit_stays_below_max(clock):
+    control = controller(initial_limit=3, max_limit=3)
+    tickets = [control.enter() for _ in range(3)]
+    clock.now += 0.1
+    control.release(tickets[0])
+    assert control.limit == 3
+
+
+def test_slow_requests_back_off_once_per_round(clock):
+    control = controller(initial_limit=4)
+    tickets = [control.enter() for _ in range(3)]
+    clock.now += 2.0
+    control.release(tickets[0])
+    assert control.limit == pytest.approx(4 * BACKOFF)
+    # Admitted before the cut: already accounted for
+    control.release(tickets[1])
+    assert control.limit == pytest.approx(4 * BACKOFF)
+    assert control.decreases == 1
+
+    late = control.enter()
+    clock.now += 2.0
+    control.release(late)
+    assert control.limit == pytest.approx(4 * BACKOFF**2)
+    control.release(tickets[2], measure=False)
+    assert control.decreases == 2
+
+
+def test_backoff_stops_at_min_limit(clock):
+    control = controller(initial_limit=1, min_limit=1)
+    ticket = control.enter()
+    clock.now += 2.0
+    control.release(ticket)
+    assert control.limit == 1
+
+
+def test_dropped_request_counts_as_overload(clock):
+    control = controller(initial_limit=4)
+    ticket = control.enter()
+    ticket.dropped = True
+    control.release(ticket)
+    assert control.limit == pytest.approx(4 * BACKOFF)
+    assert control.latency is None
+
+
+def test_rejects_once_the_queue_is_full(clock):
+    control = controller(initial_limit=1, max_queue=1)
+    running = control.enter()
+    granted = []
+    waiting = control.enter(lambda: granted.append(True))
+    assert running.granted and not waiting.granted
+
+    with pytest.raises(Overloaded) as error:
+        control.enter()
+    assert error.value.retry_after >= 1
+    assert control.stats()["rejected"] == 1
+
+    clock.now += 0.1
+    control.release(running)
+    assert waiting.granted and granted == [True]
+    assert control.stats()["in_flight"] == 1
+
+
+def test_acquire_times_out_in_the_queue():
+    control = controller(initial_limit=1, max_queue=1)
+    running = control.acquire()
+    with pytest.raises(Overloaded):
+        control.acquire(timeout=0.01)
+    stats = control.stats()
+    assert stats["queued"] == 0 and stats["queue_timeouts"] == 1
+    control.release(running)
@@ -0,0 +1,37 @@
+"""
+Backend loading: torch_compile support check
+"""
+
+import pytest
+
+pytest.importorskip("ultralytics")
+import torch
+from ultralytics import YOLO
+
+import backends
+from backends import load_model
+
+
+@pytest.fixture
+def weights(tmp_path):
+    """Untrained checkpoint in the layout the trainer writes"""
+    path = tmp_path / "best.pt"
+    torch.save({"model": YOLO("yolov8n.yaml").model, "train_args": {"imgsz": 320}}, path)
+    return str(path)
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_torch_compile_sets_the_predictor_option(weights, snapshot):
+    model, backend, imgsz = load_model(
+        weights, "torch_compile", verify=False, snapshot=snapshot
+    )
+    assert backend == "torch_compile" and imgsz == 320
+    assert model.overrides["compile"] is True
+
+
+@pytest.mark.parametrize("snapshot", [False, True])
+def test_torch_compile_falls_back_without_support(weights, snapshot, monkeypatch):
+    monkeypatch.delitem(backends.DEFAULT_CFG_DICT, "compile", raising=False)
+    model, backend, _ = load_model(weights, "torch_compile", snapshot=snapshot)
+    assert backend == "torch"
+    assert "compile" not in model.overrides
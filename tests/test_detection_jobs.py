@@ -0,0 +1,22 @@
+"""
+Durable job store: spooled uploads
+"""
+
+from pathlib import Path
+
+from detection_jobs import JobStore
+
+
+def test_spooled_images_have_absolute_paths(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = JobStore("jobs.sqlite", "spool")
+    store.submit([b"encoded image"])
+
+    item = store.claim(1)[0]
+    source = Path(item[2])
+    assert source.is_absolute()
+    assert source.parent.parent == tmp_path / "spool"
+
+    # A worker started from another directory still finds the file
+    monkeypatch.chdir(Path(tmp_path).parent)
+    assert source.read_bytes() == b"encoded image"
@@ -0,0 +1,92 @@
+"""
+Lean inference path vs model.predict on non-square images
+The detector letterboxes images itself (letterbox_tensor) instead of going
+through the ultralytics predictor. Both must produce the same boxes, including
+for photos that aren't square, where the predictor pads only up to a multiple
+of the stride. Run after upgrading ultralytics.
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+pytest.importorskip("ultralytics")
+import torch
+from ultralytics import YOLO
+
+from two_stage_detection import TwoStageDetector, predict_image
+
+# (height, width): landscape, portrait, square, not a multiple of the stride
+SHAPES = [(480, 640), (640, 360), (500, 500), (333, 517)]
+
+
+def generated_model(path, imgsz: int) -> str:
+    """
+    Save a small randomly initialized DetectionModel that still detects things
+
+    Untrained weights give nearly constant scores, so batch norm and the class
+    head are randomized until the scores vary between boxes.
+    """
+    torch.manual_seed(2)
+    model = YOLO("yolov8n.yaml")
+    with torch.no_grad():
+        for module in model.model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                module.weight.normal_(1.0, 0.3)
+                module.bias.normal_(0.0, 0.3)
+        for branch in model.model.model[-1].cv3:
+            branch[-1].weight.normal_(0.0, 0.5)
+            branch[-1].bias.fill_(-3.0)
+    # Same checkpoint layout the trainer writes, so load_model sees the imgsz
+    torch.save({"model": model.model, "train_args": {"imgsz": imgsz}}, path)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def model_paths(tmp_path_factory):
+    """Tree and defect stand-ins at the input sizes of the trained models"""
+    directory = tmp_path_factory.mktemp("models")
+    return (
+        generated_model(directory / "tree.pt", 416),
+        generated_model(directory / "defect.pt", 640),
+    )
+
+
+def scene(height: int, width: int) -> np.ndarray:
+    """Random filled shapes, so there is structure for the models to respond to"""
+    rng = np.random.default_rng(height * width)
+    image = np.full((height, width, 3), 90, np.uint8)
+    for _ in range(40):
+        x, y = int(rng.integers(width)), int(rng.integers(height))
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(image, (x, y), int(rng.integers(5, 60)), color, -1)
+    return image
+
+
+@pytest.mark.parametrize("shape", SHAPES, ids=lambda shape: f"{shape[1]}x{shape[0]}")
+@pytest.mark.parametrize("stage", [0, 1], ids=["tree", "defect"])
+def test_predict_image_matches_predict(model_paths, shape, stage):
+    model = YOLO(model_paths[stage])
+    image = scene(*shape)
+    conf = 0.3
+
+    boxes, scores, classes = predict_image(model, image, conf)
+    reference = model.predict(image, conf=conf, verbose=False)[0].boxes
+    assert len(boxes) > 0
+    assert len(boxes) == len(reference)
+    np.testing.assert_allclose(boxes, reference.xyxy.cpu().numpy(), atol=0.01)
+    np.testing.assert_allclose(scores, reference.conf.cpu().numpy(), atol=0.01)
+    np.testing.assert_array_equal(classes, reference.cls.cpu().numpy())
+
+
+@pytest.mark.parametrize("shape", SHAPES, ids=lambda shape: f"{shape[1]}x{shape[0]}")
+def test_shared_letterbox_matches_predictor(model_paths, shape):
+    detector = TwoStageDetector(*model_paths)
+    image = scene(*shape)
+    inputs = detector.preprocess([image])
+    assert set(inputs) == {detector.tree_imgsz, detector.defect_imgsz}
+    for model in (detector.tree_model, detector.defect_model):
+        model.predict(image, verbose=False)  # Builds the predictor
+        expected = tuple(model.predictor.preprocess([image]).shape)
+        imgsz = detector.tree_imgsz if model is detector.tree_model else detector.defect_imgsz
+        assert tuple(inputs[imgsz].shape) == expected
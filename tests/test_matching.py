@@ -0,0 +1,121 @@
+"""
+Tree type and defect matching: loop reference vs dense vs grid backend
+The vectorized matchers must assign exactly what the original per-pair loops
+over TwoStageDetector.calculate_iou / box_contains did.
+"""
+
+import numpy as np
+import pytest
+
+from spatial_index import GridIndex
+from two_stage_detection import TwoStageDetector, match_defects, match_tree_types
+
+# calculate_iou and box_contains don't touch detector state
+REFERENCE = TwoStageDetector.__new__(TwoStageDetector)
+
+SIZES = [(0, 0), (0, 5), (5, 0), (1, 1), (1, 12), (12, 1), (40, 60), (150, 200)]
+
+
+def random_boxes(rng: np.random.Generator, count: int, extent: int = 400) -> np.ndarray:
+    """Integer-valued boxes, so duplicates, shared edges and IoU ties occur"""
+    corners = rng.integers(0, extent, size=(count, 2))
+    sides = rng.integers(0, 80, size=(count, 2))
+    boxes = np.concatenate([corners, corners + sides], axis=1).astype(np.float64)
+    if count > 2:
+        boxes[-1] = boxes[0]  # Exact duplicate
+    return boxes
+
+
+def reference_tree_types(tree_boxes, type_boxes, iou_threshold=0.3):
+    """Stage 3 as originally written: best IoU above the threshold, first on ties"""
+    best = []
+    for tree in tree_boxes.tolist():
+        best_match, best_iou = -1, 0.0
+        for idx, type_box in enumerate(type_boxes.tolist()):
+            iou = REFERENCE.calculate_iou(tree, type_box)
+            if iou > best_iou and iou > iou_threshold:
+                best_iou, best_match = iou, idx
+        best.append(best_match)
+    return np.array(best, dtype=np.int64)
+
+
+def reference_defects(tree_boxes, defect_boxes, iou_threshold=0.3):
+    """Stage 4 as originally written, as (tree, defect) pairs ordered by tree"""
+    pairs = [
+        (tree_idx, defect_idx)
+        for tree_idx, tree in enumerate(tree_boxes.tolist())
+        for defect_idx, defect in enumerate(defect_boxes.tolist())
+        if REFERENCE.box_contains(tree, defect, iou_threshold)
+    ]
+    return sorted(pairs)
+
+
+def scenes():
+    params = []
+    for seed, (num_trees, num_other) in enumerate(SIZES):
+        rng = np.random.default_rng(seed)
+        params.append(
+            pytest.param(
+                random_boxes(rng, num_trees),
+                random_boxes(rng, num_other),
+                id=f"{num_trees}x{num_other}",
+            )
+        )
+    return params
+
+
+@pytest.mark.parametrize("tree_boxes, type_boxes", scenes())
+@pytest.mark.parametrize("backend", ["dense", "grid"])
+def test_match_tree_types(tree_boxes, type_boxes, backend):
+    expected = reference_tree_types(tree_boxes, type_boxes)
+    actual = match_tree_types(tree_boxes, type_boxes, backend=backend)
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize("tree_boxes, defect_boxes", scenes())
+@pytest.mark.parametrize("backend", ["dense", "grid"])
+def test_match_defects(tree_boxes, defect_boxes, backend):
+    expected = reference_defects(tree_boxes, defect_boxes)
+    tree_idx, defect_idx = match_defects(tree_boxes, defect_boxes, backend=backend)
+    assert list(zip(tree_idx.tolist(), defect_idx.tolist())) == expected
+
+
+def test_single_box_matches_itself():
+    box = np.array([[10.0, 10.0, 50.0, 90.0]])
+    for backend in ("dense", "grid"):
+        assert match_tree_types(box, box, backend=backend).tolist() == [0]
+        tree_idx, defect_idx = match_defects(box, box, backend=backend)
+        assert (tree_idx.tolist(), defect_idx.tolist()) == ([0], [0])
+
+
+def test_touching_defect_center_on_tree_border():
+    tree = np.array([[0.0, 0.0, 100.0, 100.0]])
+    # Center (100, 50) lies on the right border; IoU is far below the threshold
+    defect = np.array([[90.0, 40.0, 110.0, 60.0]])
+    for backend in ("dense", "grid"):
+        tree_idx, defect_idx = match_defects(tree, defect, backend=backend)
+        assert (tree_idx.tolist(), defect_idx.tolist()) == ([0], [0])
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_grid_candidates_are_all_intersecting_pairs(seed):
+    rng = np.random.default_rng(seed)
+    boxes = random_boxes(rng, 60)
+    queries = random_boxes(rng, 80)
+    # Closed intersection: boxes sharing only an edge or corner count
+    overlap = (
+        (np.maximum(boxes[:, None, 0], queries[None, :, 0])
+         <= np.minimum(boxes[:, None, 2], queries[None, :, 2]))
+        & (np.maximum(boxes[:, None, 1], queries[None, :, 1])
+           <= np.minimum(boxes[:, None, 3], queries[None, :, 3]))
+    )
+    box_idx, query_idx = GridIndex(boxes).candidate_pairs(queries)
+    assert sorted(zip(box_idx.tolist(), query_idx.tolist())) == sorted(
+        zip(*map(np.ndarray.tolist, np.nonzero(overlap)))
+    )
+
+
+def test_unknown_backend():
+    boxes = np.zeros((1, 4))
+    with pytest.raises(ValueError):
+        match_tree_types(boxes, boxes, backend="kdtree")
@@ -0,0 +1,112 @@
+"""
+Detection caches: threshold reuse, LRU eviction, persistence and cache keys
+"""
+
+import itertools
+
+import numpy as np
+
+import result_cache
+from result_cache import (
+    PersistentResultCache,
+    RawDetectionCache,
+    cache_key,
+    file_digest,
+    filter_prediction,
+)
+
+
+def prediction(scores, offset=0.0):
+    """(boxes, confidences, class ids) with one box per score"""
+    scores = np.asarray(scores, dtype=np.float32)
+    boxes = np.arange(len(scores) * 4, dtype=np.float32).reshape(-1, 4) + offset
+    return boxes, scores, np.zeros(len(scores), dtype=np.float32)
+
+
+def test_filter_prediction_is_strict():
+    boxes, scores, classes = filter_prediction(prediction([0.1, 0.25, 0.5]), 0.25)
+    assert scores.tolist() == [0.5]
+    assert boxes.shape == (1, 4) and classes.shape == (1,)
+
+
+def test_raw_cache_answers_higher_thresholds_only():
+    cache = RawDetectionCache()
+    raw = (prediction([0.1, 0.6]), prediction([0.3]))
+    cache.put("image", 0.05, raw)
+    assert cache.get("image", 0.25) is raw
+    assert cache.get("image", 0.05) is raw
+    assert cache.get("image", 0.01) is None
+    assert cache.get("other", 0.25) is None
+
+
+def test_raw_cache_evicts_least_recently_used():
+    cache = RawDetectionCache(max_entries=2)
+    raw = (prediction([0.5]), prediction([0.5]))
+    cache.put("a", 0.05, raw)
+    cache.put("b", 0.05, raw)
+    cache.get("a", 0.05)  # "b" is now the oldest
+    cache.put("c", 0.05, raw)
+    assert len(cache) == 2
+    assert cache.get("b", 0.05) is None
+    assert cache.get("a", 0.05) is raw and cache.get("c", 0.05) is raw
+
+
+def assert_same(actual, expected):
+    for actual_pred, expected_pred in zip(actual, expected):
+        for actual_array, expected_array in zip(actual_pred, expected_pred):
+            np.testing.assert_array_equal(actual_array, expected_array)
+
+
+def entry_size(raw):
+    return len(result_cache._encode(raw))
+
+
+def test_persistent_cache_survives_reopen(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    raw = (prediction([0.1, 0.6]), prediction([0.3], offset=5))
+    cache = PersistentResultCache(str(path))
+    cache.put("key", raw)
+    del cache
+
+    reopened = PersistentResultCache(str(path))
+    mode = reopened._connect().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+    assert reopened.contains("key")
+    assert_same(reopened.get("key"), raw)
+    assert reopened.get("missing") is None
+
+
+def test_persistent_cache_evicts_lru_beyond_byte_budget(tmp_path, monkeypatch):
+    # Distinct, increasing access times regardless of clock resolution
+    clock = itertools.count(1)
+    monkeypatch.setattr(result_cache.time, "time", lambda: float(next(clock)))
+
+    raw = (prediction([0.5] * 20), prediction([0.5] * 20))
+    size = entry_size(raw)
+    cache = PersistentResultCache(str(tmp_path / "cache.sqlite"), max_size_mb=1)
+    cache.max_bytes = 3 * size  # Room for three entries
+
+    for key in ("a", "b", "c"):
+        cache.put(key, raw)
+    cache.get("a")  # "b" is now the least recently used
+    cache.put("d", raw)
+
+    assert not cache.contains("b")
+    assert all(cache.contains(key) for key in ("a", "c", "d"))
+    assert cache.stats()["bytes"] == 3 * size
+
+
+def test_cache_key_changes_with_models_and_parameters(tmp_path):
+    weights = tmp_path / "best.pt"
+    weights.write_bytes(b"weights v1")
+    old_digest = file_digest(str(weights))
+    weights.write_bytes(b"weights v2")
+    new_digest = file_digest(str(weights))
+    assert old_digest != new_digest
+
+    params = {"tree_conf": 0.25, "defect_conf": 0.05}
+    key = cache_key("image", old_digest, params)
+    assert key == cache_key("image", old_digest, dict(reversed(params.items())))
+    assert key != cache_key("image", new_digest, params)
+    assert key != cache_key("image", old_digest, dict(params, tree_conf=0.3))
+    assert key != cache_key("other", old_digest, params)
@@ -0,0 +1,65 @@
+"""
+Single-flight coalescing of identical concurrent calls
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+CALLERS = 4
+
+
+def wait_for_joiners(flight, timeout=5.0):
+    """Hold the leader's call open until every other caller waits on it"""
+    deadline = time.monotonic() + timeout
+    while flight.coalesced < CALLERS - 1 and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def run_concurrently(flight, key, fn):
+    """Start CALLERS identical calls and wait for all of them"""
+    with ThreadPoolExecutor(CALLERS) as pool:
+        futures = [pool.submit(flight.do, key, fn) for _ in range(CALLERS)]
+    return futures
+
+
+def test_duplicate_calls_run_once():
+    flight = SingleFlight()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        wait_for_joiners(flight)
+        return "result"
+
+    outcomes = [future.result() for future in run_concurrently(flight, "k", compute)]
+    assert len(calls) == 1
+    assert [result for result, _ in outcomes] == ["result"] * CALLERS
+    assert sorted(joined for _, joined in outcomes) == [False] + [True] * (CALLERS - 1)
+    assert flight.in_flight() == 0
+
+
+def test_exception_reaches_every_waiter():
+    flight = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(1)
+        wait_for_joiners(flight)
+        raise ValueError("bad image")
+
+    for future in run_concurrently(flight, "k", fail):
+        with pytest.raises(ValueError, match="bad image"):
+            future.result()
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
+
+
+def test_finished_calls_are_not_cached():
+    flight = SingleFlight()
+    assert flight.do("k", lambda: 1) == (1, False)
+    assert flight.do("k", lambda: 2) == (2, False)
+    assert flight.coalesced == 0
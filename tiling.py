@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tiling helpers for sliced inference on large aerial images
+Splits a frame into overlapping tiles and merges the per-tile detections
+back into one set of global boxes
+"""
+
+import numpy as np
+from typing import List, Tuple
+
+from spatial_index import GridIndex
+
+
+def tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    """Tile start offsets along one axis; the last tile is aligned to the edge"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_windows(
+    width: int, height: int, tile_size: int = 640, overlap: float = 0.2
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Overlapping tile windows covering an image
+
+    All tiles have the full tile size except on images smaller than a tile.
+
+    Args:
+        width: Image width in pixels
+        height: Image height in pixels
+        tile_size: Tile side in pixels
+        overlap: Fraction of the tile shared with its neighbour (0 - 0.9)
+
+    Returns:
+        List of (x0, y0, x1, y1) windows, row by row
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError(f"overlap must be in [0, 1), got {overlap}")
+    stride = max(1, int(round(tile_size * (1 - overlap))))
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in tile_starts(height, tile_size, stride)
+        for x0 in tile_starts(width, tile_size, stride)
+    ]
+
+
+def merge_tile_detections(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    tile_ids: np.ndarray,
+    match_threshold: float = 0.5,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merge duplicate detections of the same object from neighbouring tiles
+
+    An object on a tile seam is usually seen whole by one tile and cut off by
+    the other, so duplicates are matched by intersection over the smaller box
+    (IoS) rather than IoU. Greedy in score order: the best box absorbs every
+    same-class box from another tile with IoS above the threshold and grows to
+    their union. Boxes from the same tile are never merged (the model's own
+    NMS already handled those).
+
+    Args:
+        boxes: Nx4 xyxy boxes in global image coordinates
+        scores: N confidences
+        classes: N class ids
+        tile_ids: N indices of the tile each box came from
+        match_threshold: Minimum IoS for two boxes to be the same object
+
+    Returns:
+        (boxes, scores, classes) after merging, highest score first
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return boxes, np.asarray(scores), np.asarray(classes)
+
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    boxes = boxes[order].copy()
+    scores = np.asarray(scores)[order]
+    classes = np.asarray(classes)[order]
+    tile_ids = np.asarray(tile_ids)[order]
+
+    # Candidate duplicates: overlapping, same class, different tiles
+    first, second = GridIndex(boxes).candidate_pairs(boxes)
+    keep = (first < second) & (classes[first] == classes[second])
+    keep &= tile_ids[first] != tile_ids[second]
+    first, second = first[keep], second[keep]
+
+    b1, b2 = boxes[first], boxes[second]
+    width = np.minimum(b1[:, 2], b2[:, 2]) - np.maximum(b1[:, 0], b2[:, 0])
+    height = np.minimum(b1[:, 3], b2[:, 3]) - np.maximum(b1[:, 1], b2[:, 1])
+    intersection = np.clip(width, 0, None) * np.clip(height, 0, None)
+    area1 = (b1[:, 2] - b1[:, 0]) * (b1[:, 3] - b1[:, 1])
+    area2 = (b2[:, 2] - b2[:, 0]) * (b2[:, 3] - b2[:, 1])
+    smaller = np.minimum(area1, area2)
+    ios = np.divide(
+        intersection, smaller, out=np.zeros_like(intersection), where=smaller > 0
+    )
+    duplicate = ios > match_threshold
+    first, second = first[duplicate], second[duplicate]
+
+    # Greedy merge in score order (indices are already sorted by score)
+    neighbours = {}
+    for i, j in zip(first.tolist(), second.tolist()):
+        neighbours.setdefault(i, []).append(j)
+
+    absorbed = np.zeros(len(boxes), dtype=bool)
+    for i in range(len(boxes)):
+        if absorbed[i]:
+            continue
+        for j in neighbours.get(i, ()):
+            if absorbed[j]:
+                continue
+            absorbed[j] = True
+            boxes[i, :2] = np.minimum(boxes[i, :2], boxes[j, :2])
+            boxes[i, 2:] = np.maximum(boxes[i, 2:], boxes[j, 2:])
+
+    survivors = ~absorbed
+    return boxes[survivors], scores[survivors], classes[survivors]
+
+
+def select_windows(
+    windows: List[Tuple[int, int, int, int]],
+    regions: np.ndarray,
+    padding: float = 0.1,
+) -> List[int]:
+    """
+    Windows that intersect at least one region of interest
+
+    Args:
+        windows: (x0, y0, x1, y1) tile windows
+        regions: Nx4 xyxy boxes in the same coordinates (e.g. coarse tree boxes)
+        padding: Grow each region by this fraction of its size on every side,
+            so boxes from a low-resolution pass don't clip the object
+
+    Returns:
+        Sorted indices of the selected windows
+    """
+    regions = np.asarray(regions, dtype=np.float64).reshape(-1, 4)
+    if len(windows) == 0 or len(regions) == 0:
+        return []
+
+    size = regions[:, 2:] - regions[:, :2]
+    padded = np.concatenate(
+        [regions[:, :2] - size * padding, regions[:, 2:] + size * padding], axis=1
+    )
+    window_idx, _ = GridIndex(np.asarray(windows)).candidate_pairs(padded)
+    return np.unique(window_idx).tolist()
@@ -2,27 +2,215 @@
 """
 YOLOv11 Training Script for Tree Defect Detection
 Trains on the defects dataset with 14 classes (tree types + defects)
+
+With --unified, trains one model for the generic tree class plus all tree type
+and defect classes instead, on a dataset merged from the tree dataset
+(dataset/data.yaml) and the defects dataset. TwoStageDetector runs it in
+place of both models (unified_model_path), with one forward pass per image.
+
+Usage:
+    python train_defects.py
+    python train_defects.py --unified
+    python train_defects.py --unified --no-pseudo-labels --epochs 60
 """
 
 from ultralytics import YOLO
+import argparse
+import os
+import shutil
 import torch
+import yaml
 from pathlib import Path
-import os
+from typing import Dict, List, Optional
 
+from two_stage_detection import UNIFIED_TREE_CLASS
 
-def main():
-    # Get the script directory
-    script_dir = Path(__file__).parent.resolve()
+TREE_MODEL = "runs/detect/tree_detection_cpu/weights/best.pt"
+DEFECT_MODEL = "runs/defects/tree_defects_detection2/weights/best.pt"
+
+# Without a val split, every Nth training image is held out (80/20)
+HOLDOUT_EVERY = 5
+
+
+def get_device() -> str:
+    """Print the PyTorch setup and pick the training device"""
     print(f"PyTorch version: {torch.__version__}")
     print(f"CUDA available: {torch.cuda.is_available()}")
 
     if torch.cuda.is_available():
         print(f"CUDA device count: {torch.cuda.device_count()}")
-        device = "0"
-    else:
-        print("Using CPU for training")
-        device = "cpu"
+        return "0"
+    print("Using CPU for training")
+    return "cpu"
+
+
+def _split_images(data: Dict, split: str) -> List[Path]:
+    """Image files of a dataset split (directory, list file or list of either)"""
+    from ultralytics.data.utils import IMG_FORMATS
+
+    sources = data.get(split) or []
+    if not isinstance(sources, list):
+        sources = [sources]
+
+    images = []
+    for source in map(Path, sources):
+        if source.is_dir():
+            images.extend(
+                sorted(
+                    p for p in source.rglob("*") if p.suffix[1:].lower() in IMG_FORMATS
+                )
+            )
+        elif source.is_file():  # .txt list of image paths
+            for line in source.read_text().splitlines():
+                image = Path(line.strip())
+                if line.strip():
+                    images.append(image if image.is_absolute() else source.parent / image)
+    return images
+
+
+def _read_labels(image: Path) -> List[List[float]]:
+    """YOLO labels of an image as [class, x, y, w, h] (polygons become boxes)"""
+    from ultralytics.data.utils import img2label_paths
+
+    label_file = Path(img2label_paths([str(image)])[0])
+    if not label_file.exists():
+        return []
+
+    labels = []
+    for line in label_file.read_text().splitlines():
+        values = [float(v) for v in line.split()]
+        if len(values) == 5:
+            labels.append(values)
+        elif len(values) > 5:  # Segmentation polygon
+            xs, ys = values[1::2], values[2::2]
+            x0, x1, y0, y1 = min(xs), max(xs), min(ys), max(ys)
+            labels.append(
+                [values[0], (x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0]
+            )
+    return labels
+
+
+def _pseudo_labels(
+    model: YOLO, image: Path, class_map: Dict[int, int], conf: float
+) -> List[List[float]]:
+    """Labels predicted by an existing model, mapped to unified class ids"""
+    result = model(str(image), conf=conf, verbose=False)[0]
+    labels = []
+    for cls, xywhn in zip(result.boxes.cls.tolist(), result.boxes.xywhn.tolist()):
+        if int(cls) in class_map:
+            labels.append([class_map[int(cls)], *xywhn])
+    return labels
+
 
+def _link_image(source: Path, target: Path):
+    """Symlink an image into the merged dataset (copy where links aren't allowed)"""
+    if target.exists() or target.is_symlink():
+        target.unlink()
+    try:
+        os.symlink(source.resolve(), target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def build_unified_dataset(
+    tree_data: str,
+    defect_data: str,
+    output_dir: str,
+    tree_model: Optional[str] = None,
+    defect_model: Optional[str] = None,
+    pseudo_conf: float = 0.5,
+) -> Path:
+    """
+    Merge the tree and defects datasets into one dataset for a unified model
+
+    Classes are the generic tree class followed by the defects dataset's
+    classes. Every class of the tree dataset becomes the tree class. Each
+    dataset only labels its own classes, which would teach the model that
+    unlabeled trees and defects are background, so the missing classes are
+    filled in with pseudo-labels from the existing models when given.
+
+    Args:
+        tree_data: Tree dataset YAML
+        defect_data: Defects dataset YAML
+        output_dir: Directory for the merged dataset (images are symlinked)
+        tree_model: Tree model that labels trees on the defects images
+        defect_model: Defect model that labels types/defects on the tree images
+        pseudo_conf: Confidence threshold for pseudo-labels
+
+    Returns:
+        Path of the merged dataset's data.yaml
+    """
+    from ultralytics.data.utils import check_det_dataset
+
+    trees = check_det_dataset(tree_data)
+    defects = check_det_dataset(defect_data)
+    defect_names = [defects["names"][i] for i in sorted(defects["names"])]
+    names = [UNIFIED_TREE_CLASS] + [n for n in defect_names if n != UNIFIED_TREE_CLASS]
+    tree_ids = {i: 0 for i in trees["names"]}
+    defect_ids = {i: names.index(n) for i, n in enumerate(defect_names)}
+
+    # (prefix, dataset, unified ids of its labels, model for the missing
+    # classes, unified ids of that model's classes)
+    sources = [
+        ("tree", trees, tree_ids, YOLO(defect_model) if defect_model else None, defect_ids),
+        ("defect", defects, defect_ids, YOLO(tree_model) if tree_model else None, None),
+    ]
+
+    output = Path(output_dir)
+    counts = {"train": 0, "val": 0}
+    for prefix, data, own_ids, other_model, other_ids in sources:
+        if other_model is not None and other_ids is None:
+            other_ids = {i: 0 for i in other_model.names}  # Any tree model class
+        train = _split_images(data, "train")
+        val = _split_images(data, "val")
+        if not val:
+            val = train[::HOLDOUT_EVERY]
+            train = [image for i, image in enumerate(train) if i % HOLDOUT_EVERY]
+
+        for split, images in (("train", train), ("val", val)):
+            image_dir = output / split / "images"
+            label_dir = output / split / "labels"
+            image_dir.mkdir(parents=True, exist_ok=True)
+            label_dir.mkdir(parents=True, exist_ok=True)
+            print(f"  {prefix} {split}: {len(images)} images")
+
+            for idx, image in enumerate(images):
+                # Index keeps names unique across sub-folders
+                stem = f"{prefix}_{idx:06d}_{image.stem}"
+                _link_image(image, image_dir / f"{stem}{image.suffix}")
+                labels = [
+                    [own_ids[int(label[0])], *label[1:]]
+                    for label in _read_labels(image)
+                ]
+                if other_model is not None:
+                    labels += _pseudo_labels(other_model, image, other_ids, pseudo_conf)
+                (label_dir / f"{stem}.txt").write_text(
+                    "".join(
+                        f"{int(c)} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n"
+                        for c, x, y, w, h in labels
+                    )
+                )
+                counts[split] += 1
+
+    data_yaml = output / "data.yaml"
+    with open(data_yaml, "w") as f:
+        yaml.safe_dump(
+            {
+                "path": str(output.resolve()),
+                "train": "train/images",
+                "val": "val/images",
+                "nc": len(names),
+                "names": names,
+            },
+            f,
+            sort_keys=False,
+        )
+    print(f"Merged dataset: {counts['train']} train, {counts['val']} val images")
+    return data_yaml
+
+
+def train_defect_model(script_dir: Path, device: str):
+    """Train the 14-class defect model (stage 2 of the two-model system)"""
     # Path to defects dataset (relative to script location)
     data_yaml = script_dir / "defects" / "dataset" / "data.yaml"
 
@@ -80,5 +268,113 @@ def main():
     print(f"Model ready for two-stage detection (trees + defects)")
 
 
+def train_unified_model(args, device: str):
+    """Build the merged dataset and train the unified single-pass model"""
+    tree_model = defect_model = None
+    if args.pseudo_labels:
+        tree_model = args.tree_model if Path(args.tree_model).exists() else None
+        defect_model = args.defect_model if Path(args.defect_model).exists() else None
+        if not (tree_model and defect_model):
+            print(
+                "Warning: existing models not found, training without pseudo-labels "
+                "(trees on defect images and defects on tree images count as background)"
+            )
+
+    print(f"\nMerging {args.tree_data} and {args.defect_data} into {args.dataset_dir}...")
+    data_yaml = build_unified_dataset(
+        args.tree_data,
+        args.defect_data,
+        args.dataset_dir,
+        tree_model=tree_model,
+        defect_model=defect_model,
+        pseudo_conf=args.pseudo_conf,
+    )
+
+    print(f"\nInitializing YOLOv11n model...")
+    model = YOLO("yolo11n.pt")
+
+    print(f"\nStarting training...")
+    results = model.train(
+        data=str(data_yaml),
+        epochs=args.epochs,
+        imgsz=640,  # Defects need the larger input size
+        batch=8,
+        device=device,
+        project="runs/unified",
+        name="unified_detection",
+        workers=4,
+        patience=10,
+        cache=False,
+        amp=False if device == "cpu" else True,
+        verbose=True,
+        seed=0,
+        deterministic=True,
+        # Data augmentation (same as the defect model)
+        hsv_h=0.015,
+        hsv_s=0.7,
+        hsv_v=0.4,
+        degrees=0.0,
+        translate=0.1,
+        scale=0.5,
+        shear=0.0,
+        perspective=0.0,
+        flipud=0.0,
+        fliplr=0.5,
+        mosaic=1.0,
+        mixup=0.0,
+    )
+
+    print(f"\nTraining completed!")
+    print(f"Results saved in: {results.save_dir}")
+    print(f"\nValidating the model...")
+    model.val(data=str(data_yaml), split="val")
+
+    print(f"\nValidation completed!")
+    print(
+        f"Use it with unified_model_path = {Path(results.save_dir) / 'weights' / 'best.pt'} "
+        f"in config.ini"
+    )
+
+
+def main():
+    # Get the script directory
+    script_dir = Path(__file__).parent.resolve()
+
+    parser = argparse.ArgumentParser(description="Train the tree defect model")
+    parser.add_argument(
+        "--unified",
+        action="store_true",
+        help="Train one model for trees, tree types and defects",
+    )
+    parser.add_argument(
+        "--tree-data", default=str(script_dir / "dataset" / "data.yaml")
+    )
+    parser.add_argument(
+        "--defect-data", default=str(script_dir / "defects" / "dataset" / "data.yaml")
+    )
+    parser.add_argument(
+        "--dataset-dir",
+        default=str(script_dir / "unified" / "dataset"),
+        help="Where the merged dataset is written (--unified)",
+    )
+    parser.add_argument("--tree-model", default=str(script_dir / TREE_MODEL))
+    parser.add_argument("--defect-model", default=str(script_dir / DEFECT_MODEL))
+    parser.add_argument(
+        "--no-pseudo-labels",
+        dest="pseudo_labels",
+        action="store_false",
+        help="Don't label missing classes with the existing models (--unified)",
+    )
+    parser.add_argument("--pseudo-conf", type=float, default=0.5)
+    parser.add_argument("--epochs", type=int, default=40, help="Epochs (--unified)")
+    args = parser.parse_args()
+
+    device = get_device()
+    if args.unified:
+        train_unified_model(args, device)
+    else:
+        train_defect_model(script_dir, device)
+
+
 if __name__ == "__main__":
     main()
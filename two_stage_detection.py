@@ -7,12 +7,44 @@ Two-Stage Tree and Defect Detection System
 """
 
 from ultralytics import YOLO
+from ultralytics.data.augment import LetterBox
+from ultralytics.utils import ops
 import cv2
 import numpy as np
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import Callable, Iterator, List, Dict, Tuple, Union, Optional
+from collections import deque
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 import json
+import threading
+import time
 import torch
+from PIL import Image
+
+try:
+    from ultralytics.utils.nms import non_max_suppression
+except ImportError:  # Older ultralytics keeps NMS in ops
+    non_max_suppression = ops.non_max_suppression
+
+from backends import (
+    load_model,
+    model_input_size,
+    model_stride,
+    resolve_precision,
+    set_precision,
+)
+from result_cache import (
+    PersistentResultCache,
+    RawDetectionCache,
+    cache_key,
+    file_digest,
+    filter_prediction,
+    image_digest,
+)
+from singleflight import SingleFlight
+from spatial_index import GridIndex
+from tiling import tile_windows, merge_tile_detections, select_windows
 
 # Fix for PyTorch 2.6+ weights_only security change
 # Allow YOLO model classes to be loaded
@@ -24,22 +56,678 @@ except Exception:
     pass  # Older PyTorch versions don't have this
 
 
+# Anything detect()/visualize() accept as an image: a file path, a BGR numpy
+# array (OpenCV convention), a PIL image, raw encoded bytes or a file-like
+# object such as a Streamlit UploadedFile.
+ImageSource = Union[str, Path, np.ndarray, Image.Image, bytes]
+
+IN_MEMORY_IMAGE_NAME = "<in-memory>"
+
+
+def load_image(source: ImageSource) -> np.ndarray:
+    """
+    Decode an image source into a BGR uint8 numpy array
+
+    Args:
+        source: File path, BGR numpy array, PIL image, encoded bytes or file-like object
+
+    Returns:
+        HxWx3 BGR image
+    """
+    if isinstance(source, (str, Path)):
+        img = cv2.imread(str(source))
+        if img is None:
+            raise FileNotFoundError(f"Could not read image: {source}")
+        return img
+
+    if isinstance(source, Image.Image):
+        return cv2.cvtColor(np.asarray(source.convert("RGB")), cv2.COLOR_RGB2BGR)
+
+    if hasattr(source, "getvalue"):
+        source = source.getvalue()
+    elif hasattr(source, "read"):
+        source = source.read()
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Could not decode image bytes")
+        return img
+
+    if isinstance(source, np.ndarray):
+        if source.ndim == 2:
+            return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+        if source.ndim == 3 and source.shape[2] == 4:
+            return cv2.cvtColor(source, cv2.COLOR_BGRA2BGR)
+        if source.ndim == 3 and source.shape[2] == 3:
+            return source
+        raise ValueError(f"Unsupported image array shape: {source.shape}")
+
+    raise TypeError(f"Unsupported image source type: {type(source).__name__}")
+
+
+def _image_name(source: ImageSource, name: Optional[str] = None) -> str:
+    """Name used for an image source in results and log output"""
+    if name:
+        return name
+    if isinstance(source, (str, Path)):
+        return str(source)
+    return getattr(source, "name", None) or IN_MEMORY_IMAGE_NAME
+
+
+
+def letterbox_tensor(
+    image: np.ndarray, imgsz: int, stride: int = 32, rect: bool = True
+) -> torch.Tensor:
+    """
+    Letterbox a BGR image into a model input tensor
+
+    Mirrors the ultralytics predictor preprocessing (resize keeping aspect
+    ratio, centered gray padding, BGR->RGB, 0-1 range) so the tensor can be
+    passed straight to a YOLO model and shared between models of the same size.
+
+    Args:
+        image: HxWx3 BGR image
+        imgsz: Model input size (the long side after resizing)
+        stride: Largest stride of the models the tensor is for
+        rect: Pad the short side only up to a multiple of the stride, like the
+            predictor does for a single image. False pads to the full square,
+            so images of different shapes can be stacked into one batch.
+
+    Returns:
+        1x3xHxW float tensor (HxW is imgsz x imgsz unless rect)
+    """
+    padded = LetterBox(new_shape=imgsz, auto=rect, stride=stride)(image=image)
+    chw = np.ascontiguousarray(padded[..., ::-1].transpose(2, 0, 1))
+    return torch.from_numpy(chw).float().div_(255.0).unsqueeze(0)
+
+
+def letterbox_batch(images: List[np.ndarray], imgsz: int, stride: int = 32) -> torch.Tensor:
+    """
+    Letterbox images into one model input batch
+
+    Like the ultralytics predictor, images of one shape get the rect letterbox;
+    a batch of mixed shapes is padded to the full square so the tensors stack.
+
+    Returns:
+        Nx3xHxW float tensor
+    """
+    rect = len({img.shape for img in images}) == 1
+    return torch.cat([letterbox_tensor(img, imgsz, stride, rect) for img in images])
+
+
+def _by_shape(run: Callable, images: List[np.ndarray], *args) -> Tuple[List, List]:
+    """
+    Call ``run(images, *args)`` once per image shape and reassemble the results
+
+    Each shape gets its own rect letterbox, so an image's detections don't
+    depend on which other images share its batch.
+
+    Returns:
+        (tree predictions, defect predictions) in the order of ``images``
+    """
+    groups: Dict[Tuple[int, ...], List[int]] = {}
+    for idx, img in enumerate(images):
+        groups.setdefault(img.shape, []).append(idx)
+    tree_preds, defect_preds = [None] * len(images), [None] * len(images)
+    for indices in groups.values():
+        trees, defects = run([images[idx] for idx in indices], *args)
+        for idx, tree_pred, defect_pred in zip(indices, trees, defects):
+            tree_preds[idx], defect_preds[idx] = tree_pred, defect_pred
+    return tree_preds, defect_preds
+
+
+def predict_arrays(
+    model: YOLO,
+    inputs: torch.Tensor,
+    conf: float,
+    image_shapes: List[Tuple[int, ...]],
+) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    Forward pass, NMS and box scaling without ultralytics Results objects
+
+    The predictor is built on the first call only; later calls go straight to
+    its inference module, skipping per-call source setup, Results objects and
+    plotting. Each image's detections leave the tensor world in one copy.
+
+    Args:
+        model: YOLO model on any backend
+        inputs: Nx3xHxW letterboxed batch (see letterbox_tensor)
+        conf: Confidence threshold
+        image_shapes: Shape of each original image
+
+    Returns:
+        Per image: (boxes in original image pixels, confidences, class ids)
+    """
+    if model.predictor is None:
+        model(inputs[:1], conf=conf, verbose=False)  # Builds the predictor once
+    network, args = model.predictor.model, model.predictor.args
+    end2end = {"end2end": True} if getattr(network, "end2end", False) else {}
+
+    predictions = []
+    with torch.inference_mode():
+        batch = inputs.to(network.device)
+        batch = batch.half() if network.fp16 else batch.float()
+        detections = non_max_suppression(
+            network(batch),
+            conf,
+            args.iou,
+            args.classes,
+            args.agnostic_nms,
+            max_det=args.max_det,
+            **end2end,
+        )
+        for det, shape in zip(detections, image_shapes):
+            det[:, :4] = ops.scale_boxes(inputs.shape[2:], det[:, :4], shape[:2])
+            rows = det[:, :6].float().cpu().numpy()
+            predictions.append((rows[:, :4], rows[:, 4], rows[:, 5]))
+    return predictions
+
+
+def predict_image(
+    model: YOLO, image: np.ndarray, conf: float = 0.25
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lean single-image prediction for one YOLO model
+
+    Args:
+        model: YOLO model
+        image: HxWx3 BGR image
+        conf: Confidence threshold
+
+    Returns:
+        (Nx4 xyxy boxes in image pixels, confidences, class ids)
+    """
+    inputs = letterbox_tensor(image, model_input_size(model), model_stride(model))
+    return predict_arrays(model, inputs, conf, [image.shape])[0]
+
+
+def draw_boxes(
+    image: np.ndarray,
+    boxes: np.ndarray,
+    confidences: np.ndarray,
+    label: str = "tree",
+    color: Tuple[int, int, int] = (0, 255, 0),
+) -> np.ndarray:
+    """
+    Draw boxes with their confidence on a copy of a BGR image
+
+    Returns:
+        Annotated copy of the image
+    """
+    img = image.copy()
+    for box, conf in zip(boxes.astype(int), confidences):
+        x1, y1, x2, y2 = box
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(
+            img,
+            f"{label} {conf:.2f}",
+            (x1, max(y1 - 5, 12)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            color,
+            1,
+        )
+    return img
+
+
+def draw_results(
+    image: ImageSource, results: Dict, output_path: Optional[str] = None
+) -> np.ndarray:
+    """
+    Draw a detection result dict (trees with their types and defects)
+
+    Needs no models, so callers that get results from elsewhere (worker
+    processes, the HTTP service) can render them locally.
+
+    Args:
+        image: Original image (path, BGR numpy array, PIL image or encoded bytes)
+        results: Detection results dictionary
+        output_path: Path to save visualization (optional). In-memory images
+            are only written to disk when an output path is given.
+
+    Returns:
+        Annotated BGR image
+    """
+    img = load_image(image)
+    if img is image:
+        img = img.copy()  # Never draw on the caller's array
+
+    # Color scheme
+    tree_color = (0, 255, 0)  # Green for trees
+    defect_color = (0, 0, 255)  # Red for defects
+
+    # Draw trees
+    for tree in results["trees"]:
+        x1, y1, x2, y2 = [int(v) for v in tree["bbox"]]
+
+        # Draw tree bounding box
+        cv2.rectangle(img, (x1, y1), (x2, y2), tree_color, 3)
+
+        # Label
+        label = f"{tree['id']}: {tree['type']}"
+        cv2.putText(
+            img, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, tree_color, 2
+        )
+
+        # Draw defects within this tree
+        for defect in tree["defects"]:
+            dx1, dy1, dx2, dy2 = [int(v) for v in defect["bbox"]]
+            cv2.rectangle(img, (dx1, dy1), (dx2, dy2), defect_color, 2)
+
+            defect_label = f"{defect['type'][:10]}"
+            cv2.putText(
+                img,
+                defect_label,
+                (dx1, dy1 - 5),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.4,
+                defect_color,
+                1,
+            )
+
+    if output_path is None and isinstance(image, (str, Path)):
+        output_path = Path(image).stem + "_detected.jpg"
+
+    if output_path is not None:
+        cv2.imwrite(str(output_path), img)
+        print(f"\nVisualization saved to: {output_path}")
+
+    return img
+
+
+# Default confidence thresholds of the detection entry points. Defects are
+# kept from a low score: they are small and only count when inside a tree
+DEFAULT_TREE_CONF = 0.25
+DEFAULT_DEFECT_CONF = 0.05
+
+# Cascade mode: padding around each tree crop (fraction of the box size) and
+# the most crops per image before falling back to one full-frame defect pass
+CASCADE_PADDING = 0.15
+CASCADE_MAX_CROPS = 4
+
+# Above this many tree x detection pairs, matching switches from the dense
+# all-pairs matrices to the grid spatial index (memory stays linear)
+GRID_ASSIGNMENT_MIN_PAIRS = 4_000_000
+
+# Matching backends: "dense" (all-pairs matrices), "grid" (spatial index) or "auto"
+ASSIGNMENT_BACKENDS = ("auto", "dense", "grid")
+
+# Class of a unified model (train_defects.py --unified) that plays the role of
+# the tree model's detections
+UNIFIED_TREE_CLASS = "tree"
+
+# Latency budgets: quality levels from best to fastest. Each level keeps the
+# savings of the ones before it: smaller input size, one whole-frame pass
+# instead of tiles, then the tree stage alone
+QUALITY_LEVELS = ("full", "reduced_size", "no_tiles", "trees_only")
+
+# The "defects" entry of results whose defects were not evaluated (trees_only)
+DEFECTS_NOT_EVALUATED = "not evaluated"
+
+# Share of a latency budget planned for forward passes; the rest covers
+# decoding, NMS and matching
+BUDGET_HEADROOM = 0.8
+
+# Weight of the newest measurement in the forward pass time estimates
+ESTIMATE_SMOOTHING = 0.2
+
+
+def box_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Element-wise Intersection over Union of two broadcastable box arrays
+
+    Same arithmetic as TwoStageDetector.calculate_iou.
+
+    Args:
+        boxes1: ...x4 xyxy boxes
+        boxes2: ...x4 xyxy boxes
+
+    Returns:
+        IoU per box pair
+    """
+    # Intersection (zero when boxes don't overlap)
+    width = np.minimum(boxes1[..., 2], boxes2[..., 2]) - np.maximum(
+        boxes1[..., 0], boxes2[..., 0]
+    )
+    height = np.minimum(boxes1[..., 3], boxes2[..., 3]) - np.maximum(
+        boxes1[..., 1], boxes2[..., 1]
+    )
+    intersection = np.where((width >= 0) & (height >= 0), width * height, 0.0)
+
+    # Union
+    area1 = (boxes1[..., 2] - boxes1[..., 0]) * (boxes1[..., 3] - boxes1[..., 1])
+    area2 = (boxes2[..., 2] - boxes2[..., 0]) * (boxes2[..., 3] - boxes2[..., 1])
+    union = area1 + area2 - intersection
+
+    return np.divide(
+        intersection, union, out=np.zeros_like(intersection), where=union > 0
+    )
+
+
+def center_inside(outer_boxes: np.ndarray, inner_boxes: np.ndarray) -> np.ndarray:
+    """Element-wise check that the inner box center lies in the outer box (borders inclusive)"""
+    center_x = (inner_boxes[..., 0] + inner_boxes[..., 2]) / 2
+    center_y = (inner_boxes[..., 1] + inner_boxes[..., 3]) / 2
+    return (
+        (outer_boxes[..., 0] <= center_x)
+        & (center_x <= outer_boxes[..., 2])
+        & (outer_boxes[..., 1] <= center_y)
+        & (center_y <= outer_boxes[..., 3])
+    )
+
+
+def pairwise_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    """
+    Intersection over Union for every pair of boxes
+
+    Args:
+        boxes1: Nx4 xyxy boxes
+        boxes2: Mx4 xyxy boxes
+
+    Returns:
+        NxM IoU matrix
+    """
+    return box_iou(boxes1[:, None, :], boxes2[None, :, :])
+
+
+def centers_inside(outer_boxes: np.ndarray, inner_boxes: np.ndarray) -> np.ndarray:
+    """
+    Check for every pair whether the inner box center lies in the outer box
+
+    Returns:
+        NxM boolean matrix (N outer boxes, M inner boxes), borders inclusive
+    """
+    return center_inside(outer_boxes[:, None, :], inner_boxes[None, :, :])
+
+
+def _use_grid(backend: str, num_pairs: int) -> bool:
+    """Resolve the matching backend for a problem size"""
+    if backend not in ASSIGNMENT_BACKENDS:
+        raise ValueError(
+            f"Unknown assignment backend '{backend}', expected one of {ASSIGNMENT_BACKENDS}"
+        )
+    if backend == "auto":
+        return num_pairs >= GRID_ASSIGNMENT_MIN_PAIRS
+    return backend == "grid"
+
+
+def match_tree_types(
+    tree_boxes: np.ndarray,
+    type_boxes: np.ndarray,
+    iou_threshold: float = 0.3,
+    backend: str = "auto",
+) -> np.ndarray:
+    """
+    Pick the best tree type detection for every tree
+
+    A tree gets the type box with the highest IoU (first one on ties) if
+    that IoU is above the threshold.
+
+    Args:
+        tree_boxes: Nx4 tree boxes
+        type_boxes: Mx4 tree type boxes
+        iou_threshold: Minimum IoU for a match
+        backend: "dense", "grid" or "auto" (grid above GRID_ASSIGNMENT_MIN_PAIRS pairs)
+
+    Returns:
+        Index into type_boxes for every tree, -1 where no type matched
+    """
+    best = np.full(len(tree_boxes), -1, dtype=np.int64)
+    if len(tree_boxes) == 0 or len(type_boxes) == 0:
+        return best
+
+    if not _use_grid(backend, len(tree_boxes) * len(type_boxes)):
+        iou = pairwise_iou(tree_boxes, type_boxes)
+        best_idx = iou.argmax(axis=1)
+        best_iou = iou[np.arange(len(tree_boxes)), best_idx]
+        return np.where(best_iou > iou_threshold, best_idx, best)
+
+    # Only boxes that overlap a tree can have IoU > threshold with it
+    tree_idx, type_idx = GridIndex(tree_boxes).candidate_pairs(type_boxes)
+    iou = box_iou(tree_boxes[tree_idx], type_boxes[type_idx])
+    keep = iou > iou_threshold
+    tree_idx, type_idx, iou = tree_idx[keep], type_idx[keep], iou[keep]
+
+    # Per tree: highest IoU first, lowest type index on ties
+    order = np.lexsort((type_idx, -iou, tree_idx))
+    tree_idx, type_idx = tree_idx[order], type_idx[order]
+    first = np.ones(len(tree_idx), dtype=bool)
+    first[1:] = tree_idx[1:] != tree_idx[:-1]
+    best[tree_idx[first]] = type_idx[first]
+    return best
+
+
+def match_defects(
+    tree_boxes: np.ndarray,
+    defect_boxes: np.ndarray,
+    iou_threshold: float = 0.3,
+    backend: str = "auto",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find every (tree, defect) pair where the defect belongs to the tree
+
+    Same rule as TwoStageDetector.box_contains: IoU above the threshold or
+    defect center inside the tree box. A defect can belong to several trees.
+
+    Args:
+        tree_boxes: Nx4 tree boxes
+        defect_boxes: Mx4 defect boxes
+        iou_threshold: IoU above which a defect belongs to a tree
+        backend: "dense", "grid" or "auto" (grid above GRID_ASSIGNMENT_MIN_PAIRS pairs)
+
+    Returns:
+        (tree indices, defect indices) of the matching pairs, ordered by tree then defect
+    """
+    if len(tree_boxes) == 0 or len(defect_boxes) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    if not _use_grid(backend, len(tree_boxes) * len(defect_boxes)):
+        matches = (pairwise_iou(tree_boxes, defect_boxes) > iou_threshold) | (
+            centers_inside(tree_boxes, defect_boxes)
+        )
+        return np.nonzero(matches)
+
+    # Both rules imply the boxes intersect, so overlapping pairs are the only candidates
+    tree_idx, defect_idx = GridIndex(tree_boxes).candidate_pairs(defect_boxes)
+    trees = tree_boxes[tree_idx]
+    defects = defect_boxes[defect_idx]
+    keep = (box_iou(trees, defects) > iou_threshold) | center_inside(trees, defects)
+    tree_idx, defect_idx = tree_idx[keep], defect_idx[keep]
+
+    order = np.lexsort((defect_idx, tree_idx))
+    return tree_idx[order], defect_idx[order]
+
+
+def _offset_prediction(
+    prediction: Tuple[np.ndarray, ...], window: Tuple[int, int, int, int]
+) -> Tuple[np.ndarray, ...]:
+    """Shift tile-local (boxes, confidences, class ids) to image coordinates"""
+    boxes, scores, classes = prediction
+    offset = np.array([window[0], window[1], window[0], window[1]], dtype=boxes.dtype)
+    return boxes + offset, scores, classes
+
+
+def _concat_predictions(
+    parts: List[Tuple[np.ndarray, ...]],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Concatenate per-tile predictions into (boxes, scores, classes, tile ids)"""
+    if not parts:
+        empty = np.zeros(0, dtype=np.float32)
+        return empty.reshape(0, 4), empty, empty, np.zeros(0, dtype=np.int64)
+    boxes = np.concatenate([part[0].reshape(-1, 4) for part in parts])
+    scores = np.concatenate([part[1] for part in parts])
+    classes = np.concatenate([part[2] for part in parts])
+    tile_ids = np.concatenate(
+        [np.full(len(part[1]), idx) for idx, part in enumerate(parts)]
+    )
+    return boxes, scores, classes, tile_ids
+
+
 class TwoStageDetector:
     """Two-stage detector for trees and their defects"""
 
-    def __init__(self, tree_model_path: str, defect_model_path: str):
+    def __init__(
+        self,
+        tree_model_path: Optional[str] = None,
+        defect_model_path: Optional[str] = None,
+        concurrent: bool = False,
+        num_threads: Optional[int] = None,
+        assignment: str = "auto",
+        cascade: bool = False,
+        raw_conf: Optional[float] = None,
+        raw_cache_size: int = 32,
+        cache_path: Optional[str] = None,
+        cache_size_mb: float = 512,
+        backend: str = "torch",
+        verify_backend: bool = True,
+        precision: str = "fp32",
+        channels_last: bool = False,
+        unified_model_path: Optional[str] = None,
+        snapshot: bool = False,
+        warmup: bool = False,
+        reduced_scale: float = 0.6,
+    ):
         """
         Initialize the two-stage detector
 
         Args:
             tree_model_path: Path to trained tree detection model
             defect_model_path: Path to trained defect detection model
+            concurrent: Run the tree and defect forward passes in parallel
+            num_threads: Torch intra-op threads to use in total (default: torch's current
+                setting). In concurrent mode they are split between the two stages.
+            assignment: Defect/type to tree matching backend: "dense", "grid" or
+                "auto" (grid spatial index for very dense scenes)
+            cascade: Run the defect model on padded crops of the detected trees
+                instead of the whole frame (skipped when there are no trees)
+            raw_conf: Run both models once per image at this (low) threshold and
+                answer detect() at any higher threshold by filtering the cached
+                detections, e.g. [inference] min_confidence (default: no cache)
+            raw_cache_size: Images kept in the raw detection cache
+            cache_path: SQLite file of a persistent detection cache shared
+                between processes, keyed by image content, both weight files
+                and the parameters (default: no persistent cache)
+            cache_size_mb: Byte budget of the persistent cache (LRU eviction)
+            backend: Inference backend, one of backends.BACKENDS ("torch", "onnx",
+                "openvino", "torch_compile"). Exports are cached next to the
+                weights; falls back to "torch" if the runtime is missing.
+            verify_backend: Check a non-torch backend's outputs against eager
+                PyTorch at load time and fall back if they differ
+            precision: "fp32", "bf16" or "fp16" autocast for the torch backends;
+                falls back to fp32 if the CPU has no native support
+            channels_last: Run the torch backends in channels-last (NHWC) layout
+            unified_model_path: One model trained on the generic tree class plus
+                all tree type and defect classes (train_defects.py --unified).
+                Replaces both models: one forward pass per image, same output.
+            snapshot: Load the torch backends from a fused snapshot cached next
+                to the weights (built on first use, rebuilt when they change)
+            warmup: Run both stages on a blank image before returning, so the
+                first real request doesn't pay the lazy setup cost. The
+                ready event is set only after the warm-up.
+            reduced_scale: Input size factor of the degraded quality levels
+                that detect() falls back to under a tight latency budget
         """
-        print(f"Loading tree detection model: {tree_model_path}")
-        self.tree_model = YOLO(tree_model_path)
+        self.unified = unified_model_path is not None
+        if self.unified:
+            tree_model_path = defect_model_path = unified_model_path
+        elif tree_model_path is None or defect_model_path is None:
+            raise ValueError(
+                "Pass tree_model_path and defect_model_path, or unified_model_path"
+            )
+        self.tree_model_path = str(tree_model_path)
+        self.defect_model_path = str(defect_model_path)
+        self.channels_last = channels_last
+        self.snapshot = snapshot
+        self.reduced_scale = reduced_scale
+        # Measured forward pass ms per image by (stage, input size), for budgets
+        self._stage_ms: Dict[Tuple[str, int], float] = {}
+        # Set once the models are loaded (and warmed up, if requested)
+        self.ready = threading.Event()
+        precision = resolve_precision(precision)
+
+        if self.unified:
+            print(f"Loading unified tree and defect model: {unified_model_path}")
+            self.tree_model, self.tree_backend, self.tree_imgsz = load_model(
+                unified_model_path, backend, verify_backend, snapshot=snapshot
+            )
+            self.tree_precision = set_precision(
+                self.tree_model, self.tree_backend, precision, channels_last
+            )
+            # Both stages share the model
+            self.defect_model, self.defect_backend = self.tree_model, self.tree_backend
+            self.defect_imgsz, self.defect_precision = self.tree_imgsz, self.tree_precision
+            self.tree_class_ids = np.array(
+                [i for i, name in self.tree_model.names.items() if name == UNIFIED_TREE_CLASS]
+            )
+            if len(self.tree_class_ids) == 0:
+                raise ValueError(
+                    f"{unified_model_path} has no '{UNIFIED_TREE_CLASS}' class; "
+                    f"train it with: python train_defects.py --unified"
+                )
+            if cascade or concurrent:
+                print("Note: cascade and concurrent stages don't apply to a unified model")
+                cascade = concurrent = False
+        else:
+            print(f"Loading tree detection model: {tree_model_path}")
+            self.tree_model, self.tree_backend, self.tree_imgsz = load_model(
+                tree_model_path, backend, verify_backend, snapshot=snapshot
+            )
+
+            print(f"Loading defect detection model: {defect_model_path}")
+            self.defect_model, self.defect_backend, self.defect_imgsz = load_model(
+                defect_model_path, backend, verify_backend, snapshot=snapshot
+            )
 
-        print(f"Loading defect detection model: {defect_model_path}")
-        self.defect_model = YOLO(defect_model_path)
+            self.tree_precision = set_precision(
+                self.tree_model, self.tree_backend, precision, channels_last
+            )
+            self.defect_precision = set_precision(
+                self.defect_model, self.defect_backend, precision, channels_last
+            )
+        # Shared letterbox tensors are padded to a multiple of both models' strides
+        self.stride = max(model_stride(self.tree_model), model_stride(self.defect_model))
+        if precision != "fp32" or channels_last:
+            layout = "channels-last" if channels_last else "default layout"
+            print(f"Precision: {precision}, {layout}")
+
+        _use_grid(assignment, 0)  # Validate early
+        self.assignment = assignment
+
+        self.cascade = cascade
+        self.raw_conf = raw_conf
+        self.raw_cache = RawDetectionCache(raw_cache_size) if raw_conf is not None else None
+        self.result_cache = None
+        if cache_path:
+            self.model_digest = file_digest(self.tree_model_path, self.defect_model_path)
+            self.result_cache = PersistentResultCache(cache_path, cache_size_mb)
+
+        # Concurrent mode: one worker per stage, each with half of the cores so
+        # the two forward passes don't oversubscribe the CPU
+        self.num_threads = num_threads or torch.get_num_threads()
+        self.concurrent = concurrent
+        self._stage_executor = None
+        if concurrent:
+            self._stage_executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="detector-stage"
+            )
+            tree_threads = max(1, self.num_threads // 2)
+            self.stage_threads = (tree_threads, max(1, self.num_threads - tree_threads))
+        else:
+            self.stage_threads = (self.num_threads, self.num_threads)
+
+        # Identical concurrent detect() calls (same image and thresholds) share
+        # one computation
+        self.in_flight = SingleFlight()
+
+        # Tile worker threads (one executor per worker count) and warmed-up
+        # model replicas, created on first use and kept for later calls. YOLO
+        # predictors are not safe to share between threads, so each tile batch
+        # borrows a replica of its own.
+        self._tile_executors: Dict[int, ThreadPoolExecutor] = {}
+        self._replicas: List[Tuple[YOLO, YOLO]] = []
+        self._replica_lock = threading.Lock()
 
         # Define which classes are tree types vs defects
         # Based on the updated defects dataset classes (14 classes)
@@ -63,6 +751,173 @@ class TwoStageDetector:
             "tree_hole",
         }
 
+        if warmup:
+            self.warmup()
+        else:
+            self.ready.set()
+
+    def warmup(self, runs: int = 2) -> float:
+        """
+        Run both stages on a blank image and mark the detector ready
+
+        Builds the predictors, loads the lazily imported NMS code, creates the
+        CPU kernels for single-image inputs and starts the concurrent stage
+        workers. The last pass, at both the full and the reduced input size,
+        seeds the forward pass estimates used by latency budgets. No cache is
+        read or written.
+
+        Args:
+            runs: Warm-up passes (the second one settles kernel caches)
+
+        Returns:
+            Seconds the warm-up took
+        """
+        start = time.perf_counter()
+        blank = np.full((480, 640, 3), 114, dtype=np.uint8)
+        for run in range(runs):
+            if run == runs - 1:
+                self._stage_ms.clear()  # Estimates from the settled last pass only
+            self._run_stages([blank], 0.25, 0.25)
+            if self.reduced_scale < 1:
+                self._run_stages([blank], 0.25, 0.25, reduced=True)
+        elapsed = time.perf_counter() - start
+        self.ready.set()
+        print(f"Warm-up done in {elapsed:.1f}s, detector ready")
+        return elapsed
+
+    def reduced_size(self, imgsz: int) -> int:
+        """Input size of the degraded quality levels (a multiple of the 32 px stride)"""
+        return max(32, int(round(imgsz * self.reduced_scale / 32)) * 32)
+
+    def _record_time(self, stage: str, imgsz: int, ms_per_image: float):
+        """Update the running estimate of one stage ("tree", "defect" or "tile")"""
+        previous = self._stage_ms.get((stage, imgsz))
+        self._stage_ms[(stage, imgsz)] = (
+            ms_per_image
+            if previous is None
+            else previous + ESTIMATE_SMOOTHING * (ms_per_image - previous)
+        )
+
+    def _record_stage_time(self, model: YOLO, imgsz: int, ms_per_image: float):
+        """Update the forward pass estimate of the stage that ``model`` runs"""
+        if model is self.tree_model:
+            self._record_time("tree", imgsz, ms_per_image)
+        elif model is self.defect_model:
+            self._record_time("defect", imgsz, ms_per_image)
+        # Tile worker replicas are timed per tile by detect_tiled()
+
+    def _stage_estimate(self, stage: str, imgsz: int) -> Optional[float]:
+        """Estimated ms per image of one stage; unmeasured sizes scale by input area"""
+        measured = self._stage_ms.get((stage, imgsz))
+        if measured is not None:
+            return measured
+        for (other_stage, other_size), ms in list(self._stage_ms.items()):
+            if other_stage == stage:
+                return ms * (imgsz / other_size) ** 2
+        return None
+
+    def estimate_ms(self, quality: str, tiles: int = 1) -> Optional[float]:
+        """
+        Expected forward pass time of one detection at a quality level
+
+        Args:
+            quality: One of QUALITY_LEVELS
+            tiles: Tiles of a tiled detection (full and reduced_size run every tile)
+
+        Returns:
+            Milliseconds, or None before anything was measured
+        """
+        reduced = quality != "full"
+        tree_size = self.reduced_size(self.tree_imgsz) if reduced else self.tree_imgsz
+        defect_size = (
+            self.reduced_size(self.defect_imgsz) if reduced else self.defect_imgsz
+        )
+        passes = tiles if quality in ("full", "reduced_size") else 1
+        if passes > 1 and ("tile", tree_size) in self._stage_ms:
+            # Measured tiled runs include the tile workers' and merging overheads
+            return self._stage_ms[("tile", tree_size)] * passes
+
+        tree_ms = self._stage_estimate("tree", tree_size)
+        if tree_ms is None:
+            return None
+        if quality == "trees_only" or self.unified:
+            return tree_ms * passes
+        defect_ms = self._stage_estimate("defect", defect_size)
+        if defect_ms is None:
+            return None
+        if self.cascade and quality == "full":
+            defect_ms *= CASCADE_MAX_CROPS  # Up to one crop per tree
+        stage_ms = max(tree_ms, defect_ms) if self.concurrent else tree_ms + defect_ms
+        return stage_ms * passes
+
+    def choose_quality(
+        self, budget_ms: Optional[float], tiles: Optional[int] = None
+    ) -> str:
+        """
+        Best quality level expected to finish within a latency budget
+
+        Args:
+            budget_ms: Latency budget in ms (None: always full quality)
+            tiles: Tile count of a tiled detection (None: untiled, so the
+                no_tiles level doesn't apply)
+
+        Returns:
+            One of QUALITY_LEVELS; trees_only when nothing else fits
+        """
+        if budget_ms is None:
+            return "full"
+        planned = budget_ms * BUDGET_HEADROOM
+        for quality in QUALITY_LEVELS[:-1]:
+            if quality == "reduced_size" and self.reduced_scale >= 1:
+                continue
+            if quality == "no_tiles" and tiles is None:
+                continue
+            estimate = self.estimate_ms(quality, tiles or 1)
+            # Nothing measured yet: run it and learn
+            if estimate is None or estimate <= planned:
+                return quality
+        return QUALITY_LEVELS[-1]
+
+    def _detect_degraded(
+        self, img: np.ndarray, tree_conf: float, defect_conf: float, quality: str
+    ) -> Tuple[Tuple[np.ndarray, ...], Tuple[np.ndarray, ...]]:
+        """
+        Whole-frame detection at the reduced input size, without the caches
+
+        Degraded detections are never cached, or they would later be served
+        as full-quality results.
+
+        Returns:
+            (tree prediction, defect prediction); the defect prediction is
+            empty for trees_only
+        """
+        if quality != "trees_only":
+            tree_preds, defect_preds = self._run_stages(
+                [img], tree_conf, defect_conf, reduced=True
+            )
+            return tree_preds[0], defect_preds[0]
+        inputs = letterbox_tensor(img, self.reduced_size(self.tree_imgsz), self.stride)
+        tree_pred = self._predict(self.tree_model, inputs, tree_conf, [img.shape])[0]
+        empty = np.zeros(0, dtype=np.float32)
+        return self._tree_detections(tree_pred), (empty.reshape(0, 4), empty, empty)
+
+    def _cached(self, img: np.ndarray, tree_conf: float, defect_conf: float) -> bool:
+        """Whether detect() can answer at full quality from the raw or persistent cache"""
+        use_raw = self.raw_cache is not None and not self.cascade
+        if not use_raw and self.result_cache is None:
+            return False
+        image_key = image_digest(img)
+        cascade = self.cascade
+        if use_raw:
+            # The same lookups detect_raw() makes
+            tree_conf = defect_conf = min(self.raw_conf, tree_conf, defect_conf)
+            if self.raw_cache.get(image_key, tree_conf) is not None:
+                return True
+            cascade = False
+        return self.result_cache is not None and self.result_cache.contains(
+            self._cache_key(image_key, tree_conf, defect_conf, cascade)
+        )
+
     def calculate_iou(self, box1: List[float], box2: List[float]) -> float:
         """Calculate Intersection over Union between two boxes"""
         x1_1, y1_1, x2_1, y2_1 = box1
@@ -103,34 +958,878 @@ class TwoStageDetector:
 
         return iou > threshold or inside
 
+    def preprocess(
+        self, images: List[np.ndarray], reduced: bool = False
+    ) -> Dict[int, torch.Tensor]:
+        """
+        Letterbox a batch of images once per distinct model input size
+
+        When both models run at the same size they share a single tensor.
+        Images of one shape are padded only up to a multiple of the stride;
+        a batch of different shapes is padded to the square model input so
+        it can be stacked (see letterbox_batch). The detection paths split
+        such batches by shape first (see _by_shape).
+
+        Args:
+            images: Decoded BGR images
+            reduced: Letterbox to the degraded input size (see reduced_size)
+                instead; the keys stay the models' own sizes
+
+        Returns:
+            Mapping of model input size to an Nx3xHxW model input tensor
+        """
+        size = self.reduced_size if reduced else (lambda imgsz: imgsz)
+        return {
+            imgsz: letterbox_batch(images, size(imgsz), self.stride)
+            for imgsz in {self.tree_imgsz, self.defect_imgsz}
+        }
+
+    def _predict(
+        self,
+        model: YOLO,
+        inputs: torch.Tensor,
+        conf: float,
+        image_shapes: List[Tuple[int, ...]],
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Run a YOLO model on a preprocessed batch in a single forward pass
+
+        Returns:
+            Per image: (boxes in original image pixels, confidences, class ids)
+        """
+        start = time.perf_counter()
+        predictions = predict_arrays(model, inputs, conf, image_shapes)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        imgsz = max(inputs.shape[-2:])  # The long side; rect batches pad the short one
+        self._record_stage_time(model, imgsz, elapsed_ms / len(inputs))
+        return predictions
+
+    def _split_unified(
+        self,
+        prediction: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        tree_conf: float,
+        defect_conf: float,
+    ) -> Tuple[Tuple[np.ndarray, ...], Tuple[np.ndarray, ...]]:
+        """
+        Split a unified model's prediction into stage 1 and stage 2 predictions
+
+        Returns:
+            (tree-class detections above tree_conf, all other classes above
+            defect_conf) as returned by _predict()
+        """
+        boxes, scores, classes = prediction
+        is_tree = np.isin(classes, self.tree_class_ids)
+        tree_pred = filter_prediction(
+            (boxes[is_tree], scores[is_tree], classes[is_tree]), tree_conf
+        )
+        defect_pred = filter_prediction(
+            (boxes[~is_tree], scores[~is_tree], classes[~is_tree]), defect_conf
+        )
+        return tree_pred, defect_pred
+
+    def _predict_stages(
+        self,
+        models: Tuple[YOLO, YOLO],
+        inputs: Dict[int, torch.Tensor],
+        shapes: List[Tuple[int, ...]],
+        tree_conf: float,
+        defect_conf: float,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """
+        Both stages on a preprocessed batch, one after the other
+
+        A unified model answers both stages from a single forward pass.
+
+        Returns:
+            (tree predictions, defect predictions) as returned by _predict()
+        """
+        tree_model, defect_model = models
+        if self.unified:
+            predictions = self._predict(
+                tree_model, inputs[self.tree_imgsz], min(tree_conf, defect_conf), shapes
+            )
+            split = [self._split_unified(p, tree_conf, defect_conf) for p in predictions]
+            return [pair[0] for pair in split], [pair[1] for pair in split]
+        return (
+            self._predict(tree_model, inputs[self.tree_imgsz], tree_conf, shapes),
+            self._predict(defect_model, inputs[self.defect_imgsz], defect_conf, shapes),
+        )
+
+    def _tree_detections(
+        self, prediction: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Stage 1 part of a tree model prediction (all of it unless unified)"""
+        if not self.unified:
+            return prediction
+        keep = np.isin(prediction[2], self.tree_class_ids)
+        return tuple(array[keep] for array in prediction)
+
+    def _predict_with_threads(self, num_threads: int, *args):
+        """_predict() on a stage worker thread with its own intra-op thread count"""
+        torch.get_num_threads()  # Initialize this thread's pool before resizing it
+        torch.set_num_threads(num_threads)
+        return self._predict(*args)
+
+    def _run_stages(
+        self,
+        images: List[np.ndarray],
+        tree_conf: float,
+        defect_conf: float,
+        reduced: bool = False,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """
+        Run the tree (stage 1) and defect (stage 2) forward passes on a batch
+
+        The two stages are independent, so in concurrent mode they run in
+        parallel. A unified model runs once for both.
+
+        Args:
+            reduced: Run at the degraded input size (see reduced_size)
+
+        Returns:
+            (tree predictions, defect predictions) as returned by _predict()
+        """
+        if len({img.shape for img in images}) > 1:
+            return _by_shape(self._run_stages, images, tree_conf, defect_conf, reduced)
+        inputs = self.preprocess(images, reduced)
+        shapes = [img.shape for img in images]
+        if self._stage_executor is None:
+            return self._predict_stages(
+                (self.tree_model, self.defect_model), inputs, shapes, tree_conf, defect_conf
+            )
+
+        tree_args = (self.tree_model, inputs[self.tree_imgsz], tree_conf, shapes)
+        defect_args = (self.defect_model, inputs[self.defect_imgsz], defect_conf, shapes)
+
+        tree_future = self._stage_executor.submit(
+            self._predict_with_threads, self.stage_threads[0], *tree_args
+        )
+        defect_future = self._stage_executor.submit(
+            self._predict_with_threads, self.stage_threads[1], *defect_args
+        )
+        return tree_future.result(), defect_future.result()
+
+    def _run_cascade(
+        self,
+        images: List[np.ndarray],
+        tree_conf: float,
+        defect_conf: float,
+        batch_size: int = 8,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """
+        Stage 1 on the full frames, stage 2 on padded crops of the found trees
+
+        Each crop is letterboxed to the defect model's own input size, so small
+        trees are seen at a higher resolution than in the full frame. Images
+        without trees skip stage 2; images with more than CASCADE_MAX_CROPS
+        trees get a single full-frame defect pass instead.
+
+        Returns:
+            (tree predictions, defect predictions) as returned by _predict(),
+            with defect boxes in full-frame pixels
+        """
+        shapes = [img.shape for img in images]
+        tree_inputs = letterbox_batch(images, self.tree_imgsz, self.stride)
+        tree_preds = self._predict(self.tree_model, tree_inputs, tree_conf, shapes)
+
+        # (image index, crop window) for every region the defect model sees
+        regions = []
+        for idx, (img, (boxes, _, _)) in enumerate(zip(images, tree_preds)):
+            height, width = img.shape[:2]
+            if len(boxes) > CASCADE_MAX_CROPS:
+                regions.append((idx, (0, 0, width, height)))
+                continue
+            pad = (boxes[:, 2:] - boxes[:, :2]) * CASCADE_PADDING
+            lows = np.floor(np.maximum(boxes[:, :2] - pad, 0)).astype(int)
+            highs = np.ceil(np.minimum(boxes[:, 2:] + pad, [width, height])).astype(int)
+            for (x0, y0), (x1, y1) in zip(lows, highs):
+                if x1 > x0 and y1 > y0:
+                    regions.append((idx, (x0, y0, x1, y1)))
+
+        parts = [[] for _ in images]
+        for start in range(0, len(regions), batch_size):
+            batch = regions[start : start + batch_size]
+            crops = [
+                images[idx][y0:y1, x0:x1] for idx, (x0, y0, x1, y1) in batch
+            ]
+            inputs = letterbox_batch(crops, self.defect_imgsz, self.stride)
+            predictions = self._predict(
+                self.defect_model, inputs, defect_conf, [crop.shape for crop in crops]
+            )
+            for (idx, window), pred in zip(batch, predictions):
+                parts[idx].append(_offset_prediction(pred, window))
+
+        # Defects seen by two overlapping crops are merged like tile seams
+        defect_preds = [
+            merge_tile_detections(*_concat_predictions(image_parts))
+            for image_parts in parts
+        ]
+        return tree_preds, defect_preds
+
     def detect(
-        self, image_path: str, tree_conf: float = 0.25, defect_conf: float = 0.05
+        self,
+        image: ImageSource,
+        tree_conf: float = DEFAULT_TREE_CONF,
+        defect_conf: float = DEFAULT_DEFECT_CONF,
+        image_name: Optional[str] = None,
+        budget_ms: Optional[float] = None,
     ) -> Dict:
         """
         Run two-stage detection on an image
 
         Args:
-            image_path: Path to input image
+            image: Path, BGR numpy array, PIL image or encoded image bytes
             tree_conf: Confidence threshold for tree detection
             defect_conf: Confidence threshold for defect detection (default 0.05 due to low model mAP)
+            image_name: Name to report for in-memory images (optional)
+            budget_ms: Latency budget. When full quality is not expected to fit,
+                detection steps down QUALITY_LEVELS: the reduced input size,
+                then the tree stage alone (default: always full quality)
 
         Returns:
-            Dictionary containing trees and their associated defects
+            Dictionary containing trees and their associated defects; "quality"
+            records the level used
         """
+        name = _image_name(image, image_name)
+
+        # Decode once, shared by both models
+        img = load_image(image)
+
         print(f"\n{'='*60}")
-        print(f"Processing: {Path(image_path).name}")
+        print(f"Processing: {Path(name).name}")
         print(f"{'='*60}")
 
-        # Stage 1: Detect trees using simple tree model
-        print(f"\nStage 1: Detecting trees...")
-        tree_results = self.tree_model(image_path, conf=tree_conf, verbose=False)
+        quality = self.choose_quality(budget_ms)
+        if quality != "full" and not self._cached(img, tree_conf, defect_conf):
+            print(f"  Latency budget {budget_ms:.0f} ms: {quality} quality")
+            tree_pred, defect_pred = self._detect_degraded(
+                img, tree_conf, defect_conf, quality
+            )
+            return self._build_results(name, tree_pred, defect_pred, quality=quality)
+
+        # Cascade crops depend on the tree threshold, so cascade mode has no raw cache
+        if self.raw_cache is not None and not self.cascade:
+            raw_conf = min(self.raw_conf, tree_conf, defect_conf)
+            tree_pred, defect_pred = self.detect_raw(img, raw_conf)
+            return self._build_results(
+                name,
+                filter_prediction(tree_pred, tree_conf),
+                filter_prediction(defect_pred, defect_conf),
+            )
 
-        trees = []
-        tree_boxes = tree_results[0].boxes
+        # Stages 1 and 2: forward passes of both models
+        image_key = image_digest(img)
+        (tree_preds, defect_preds), joined = self.in_flight.do(
+            ("stages", image_key, tree_conf, defect_conf),
+            lambda: self._cached_stages(
+                [img], tree_conf, defect_conf, image_keys=[image_key]
+            ),
+        )
+        if joined:
+            print("  Shared the result of an identical request in progress")
+
+        return self._build_results(name, tree_preds[0], defect_preds[0])
 
-        for idx, (box, conf) in enumerate(
-            zip(tree_boxes.xyxy.cpu().numpy(), tree_boxes.conf.cpu().numpy())
+    def detect_raw(
+        self, image: np.ndarray, conf: float
+    ) -> Tuple[Tuple[np.ndarray, ...], Tuple[np.ndarray, ...]]:
+        """
+        Raw tree and defect detections at a low threshold, cached per image
+
+        Args:
+            image: Decoded BGR image
+            conf: Confidence threshold for both models
+
+        Returns:
+            (tree prediction, defect prediction) as returned by _predict()
+        """
+        key = image_digest(image)
+        if self.raw_cache is not None:
+            raw = self.raw_cache.get(key, conf)
+            if raw is not None:
+                print("  Reusing cached detections")
+                return raw
+
+        (tree_preds, defect_preds), joined = self.in_flight.do(
+            ("raw", key, conf),
+            lambda: self._cached_stages([image], conf, conf, raw=True, image_keys=[key]),
+        )
+        if joined:
+            print("  Shared the result of an identical request in progress")
+        raw = (tree_preds[0], defect_preds[0])
+        if self.raw_cache is not None:
+            self.raw_cache.put(key, conf, raw)
+        return raw
+
+    def _cache_key(
+        self, image_key: str, tree_conf: float, defect_conf: float, cascade: bool
+    ) -> str:
+        """Persistent cache key of one image's predictions at these settings"""
+        params = {
+            "tree_conf": tree_conf,
+            "defect_conf": defect_conf,
+            "cascade": cascade,
+            "backend": [self.tree_backend, self.defect_backend],
+            "precision": [self.tree_precision, self.defect_precision],
+            # Entries from before the rect letterbox were padded to the square
+            "letterbox": "rect",
+        }
+        return cache_key(image_key, self.model_digest, params)
+
+    def _cached_stages(
+        self,
+        images: List[np.ndarray],
+        tree_conf: float,
+        defect_conf: float,
+        raw: bool = False,
+        image_keys: Optional[List[str]] = None,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """
+        Forward passes of both stages, served from the persistent cache if possible
+
+        Only images missing from the cache go through the models (as one
+        batch), and their predictions are stored for next time.
+
+        Args:
+            images: Decoded BGR images
+            tree_conf: Confidence threshold for tree detection
+            defect_conf: Confidence threshold for defect detection
+            raw: Thresholds are a raw-cache level rather than user thresholds
+                (never run through the cascade)
+            image_keys: Precomputed image_digest() of the images (optional)
+
+        Returns:
+            (tree predictions, defect predictions) as returned by _predict()
+        """
+        cascade = self.cascade and not raw
+        run_stages = self._run_cascade if cascade else self._run_stages
+        if self.result_cache is None:
+            return run_stages(images, tree_conf, defect_conf)
+
+        image_keys = image_keys or [image_digest(img) for img in images]
+        keys = [
+            self._cache_key(k, tree_conf, defect_conf, cascade) for k in image_keys
+        ]
+        cached = [self.result_cache.get(key) for key in keys]
+
+        missing = [idx for idx, hit in enumerate(cached) if hit is None]
+        if len(missing) < len(images):
+            print(f"  {len(images) - len(missing)} image(s) from the result cache")
+        if missing:
+            tree_preds, defect_preds = run_stages(
+                [images[idx] for idx in missing], tree_conf, defect_conf
+            )
+            for idx, tree_pred, defect_pred in zip(missing, tree_preds, defect_preds):
+                cached[idx] = (tree_pred, defect_pred)
+                self.result_cache.put(keys[idx], cached[idx])
+
+        return [hit[0] for hit in cached], [hit[1] for hit in cached]
+
+    def detect_batch(
+        self,
+        images: List[ImageSource],
+        batch_size: int = 8,
+        tree_conf: float = DEFAULT_TREE_CONF,
+        defect_conf: float = DEFAULT_DEFECT_CONF,
+        image_names: Optional[List[str]] = None,
+    ) -> List[Dict]:
+        """
+        Run two-stage detection on many images with batched forward passes
+
+        Each chunk of ``batch_size`` images goes through each model as one
+        tensor batch. Images may have different sizes.
+
+        Args:
+            images: Paths, BGR numpy arrays, PIL images or encoded image bytes
+            batch_size: Images per forward pass
+            tree_conf: Confidence threshold for tree detection
+            defect_conf: Confidence threshold for defect detection
+            image_names: Names to report for the images (optional)
+
+        Returns:
+            One result dictionary per image (same schema as detect()), in input order
+        """
+        if image_names is None:
+            image_names = [None] * len(images)
+
+        all_results = []
+        for start in range(0, len(images), batch_size):
+            chunk = images[start : start + batch_size]
+            names = [
+                _image_name(image, name)
+                for image, name in zip(chunk, image_names[start : start + batch_size])
+            ]
+            print(
+                f"Processing images {start + 1}-{start + len(chunk)} of {len(images)}..."
+            )
+
+            imgs = [load_image(image) for image in chunk]
+            tree_preds, defect_preds = self._cached_stages(imgs, tree_conf, defect_conf)
+
+            for name, tree_pred, defect_pred in zip(names, tree_preds, defect_preds):
+                all_results.append(
+                    self._build_results(name, tree_pred, defect_pred, verbose=False)
+                )
+
+        return all_results
+
+    def detect_mixed_batch(
+        self,
+        images: List[ImageSource],
+        thresholds: List[Tuple[float, float]],
+        image_names: Optional[List[str]] = None,
+        budgets_ms: Optional[List[Optional[float]]] = None,
+    ) -> List[Dict]:
+        """
+        Run two-stage detection on images that each have their own thresholds
+
+        Used to batch independent requests. The batch runs once at its lowest
+        thresholds and each image's detections are filtered up to its own,
+        which gives the same results as separate runs. Cascade crops depend
+        on the tree threshold, so in cascade mode images are batched per
+        threshold pair instead.
+
+        Args:
+            images: Paths, BGR numpy arrays, PIL images or encoded image bytes
+            thresholds: (tree_conf, defect_conf) of each image
+            image_names: Names to report for the images (optional)
+            budgets_ms: Latency budget of each image, or None (see detect()).
+                The whole batch finishes together, so an image's budget is
+                shared by all images of the batch. Images that won't fit at
+                full quality leave the batch and run degraded on their own.
+
+        Returns:
+            One result dictionary per image (same schema as detect()), in input order
+        """
+        if image_names is None:
+            image_names = [None] * len(images)
+        if budgets_ms is None:
+            budgets_ms = [None] * len(images)
+        names = [_image_name(image, name) for image, name in zip(images, image_names)]
+        imgs = [load_image(image) for image in images]
+
+        results = [None] * len(imgs)
+        full = []
+        for idx, budget_ms in enumerate(budgets_ms):
+            quality = "full"
+            if budget_ms is not None:
+                quality = self.choose_quality(budget_ms / len(imgs))
+            if quality == "full" or self._cached(imgs[idx], *thresholds[idx]):
+                full.append(idx)
+                continue
+            tree_pred, defect_pred = self._detect_degraded(
+                imgs[idx], *thresholds[idx], quality
+            )
+            results[idx] = self._build_results(
+                names[idx], tree_pred, defect_pred, verbose=False, quality=quality
+            )
+
+        if not full:
+            groups = {}
+        elif self.cascade:
+            groups = {}
+            for idx in full:
+                groups.setdefault(thresholds[idx], []).append(idx)
+        else:
+            groups = {
+                (
+                    min(thresholds[idx][0] for idx in full),
+                    min(thresholds[idx][1] for idx in full),
+                ): full
+            }
+
+        for (tree_conf, defect_conf), indices in groups.items():
+            tree_preds, defect_preds = self._cached_stages(
+                [imgs[idx] for idx in indices], tree_conf, defect_conf
+            )
+            for idx, tree_pred, defect_pred in zip(indices, tree_preds, defect_preds):
+                image_tree_conf, image_defect_conf = thresholds[idx]
+                results[idx] = self._build_results(
+                    names[idx],
+                    filter_prediction(tree_pred, image_tree_conf),
+                    filter_prediction(defect_pred, image_defect_conf),
+                    verbose=False,
+                )
+        return results
+
+    def _load_replicas(self) -> Tuple[YOLO, YOLO]:
+        """Load and warm up one copy of the tree and defect models for tile workers"""
+        tree_model = load_model(
+            self.tree_model_path, self.tree_backend, verify=False, snapshot=self.snapshot
+        )[0]
+        set_precision(tree_model, self.tree_backend, self.tree_precision, self.channels_last)
+        if self.unified:
+            models = (tree_model, tree_model)
+        else:
+            defect_model = load_model(
+                self.defect_model_path,
+                self.defect_backend,
+                verify=False,
+                snapshot=self.snapshot,
+            )[0]
+            set_precision(
+                defect_model, self.defect_backend, self.defect_precision, self.channels_last
+            )
+            models = (tree_model, defect_model)
+
+        # Build the predictors and CPU kernels now rather than in a timed tile batch
+        blank = np.full((self.tree_imgsz, self.tree_imgsz, 3), 114, dtype=np.uint8)
+        self._predict_stages(models, self.preprocess([blank]), [blank.shape], 0.25, 0.25)
+        return models
+
+    @contextlib.contextmanager
+    def _borrow_replicas(self) -> Iterator[Tuple[YOLO, YOLO]]:
+        """Model replicas for one tile batch, loaded only when all are in use"""
+        with self._replica_lock:
+            models = self._replicas.pop() if self._replicas else None
+        if models is None:
+            models = self._load_replicas()
+        try:
+            yield models
+        finally:
+            with self._replica_lock:
+                self._replicas.append(models)
+
+    def _tile_executor(self, workers: int) -> ThreadPoolExecutor:
+        """Tile worker threads, kept between detect_tiled() calls"""
+        with self._replica_lock:
+            executor = self._tile_executors.get(workers)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="detector-tile"
+                )
+                self._tile_executors[workers] = executor
+        return executor
+
+    def close(self):
+        """Stop the stage and tile worker threads and drop the tile model replicas"""
+        if self._stage_executor is not None:
+            self._stage_executor.shutdown(wait=True)
+        with self._replica_lock:
+            executors = list(self._tile_executors.values())
+            self._tile_executors.clear()
+            self._replicas.clear()
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+    def _run_tile_batch(
+        self,
+        num_threads: int,
+        tiles: List[np.ndarray],
+        tree_conf: float,
+        defect_conf: float,
+        reduced: bool = False,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """Both stages for one batch of tiles, on a tile worker thread"""
+        torch.get_num_threads()  # Initialize this thread's pool before resizing it
+        torch.set_num_threads(num_threads)
+        with self._borrow_replicas() as models:
+            return _by_shape(
+                self._predict_tiles, tiles, models, tree_conf, defect_conf, reduced
+            )
+
+    def _predict_tiles(
+        self,
+        tiles: List[np.ndarray],
+        models: Tuple[YOLO, YOLO],
+        tree_conf: float,
+        defect_conf: float,
+        reduced: bool,
+    ) -> Tuple[List[Tuple[np.ndarray, ...]], List[Tuple[np.ndarray, ...]]]:
+        """Both stages for tiles of one shape with a borrowed pair of model replicas"""
+        inputs = self.preprocess(tiles, reduced)
+        shapes = [tile.shape for tile in tiles]
+        return self._predict_stages(models, inputs, shapes, tree_conf, defect_conf)
+
+    def find_tree_regions(
+        self,
+        overview: np.ndarray,
+        scale: float,
+        conf: float = 0.1,
+        batch_size: int = 8,
+    ) -> np.ndarray:
+        """
+        Coarse pass: locate trees on a downscaled overview of a large scene
+
+        The overview is tiled at the tree model's input size and run through
+        the tree model only. Used to skip full-resolution tiles with no trees
+        (roads, roofs, open grass).
+
+        Args:
+            overview: Downscaled BGR image
+            scale: Overview size divided by full-resolution size
+            conf: Tree confidence threshold (keep it low: misses here are
+                never looked at again)
+            batch_size: Overview tiles per forward pass
+
+        Returns:
+            Nx4 xyxy tree boxes in full-resolution pixels
+        """
+        height, width = overview.shape[:2]
+        windows = tile_windows(width, height, self.tree_imgsz, overlap=0.2)
+
+        parts = []
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start : start + batch_size]
+            tiles = [overview[y0:y1, x0:x1] for x0, y0, x1, y1 in batch]
+            inputs = letterbox_batch(tiles, self.tree_imgsz, self.stride)
+            predictions = self._predict(
+                self.tree_model, inputs, conf, [t.shape for t in tiles]
+            )
+            parts.extend(
+                _offset_prediction(self._tree_detections(pred), window)
+                for pred, window in zip(predictions, batch)
+            )
+
+        boxes = np.concatenate([part[0].reshape(-1, 4) for part in parts])
+        return boxes.astype(np.float64) / scale
+
+    def iter_tile_predictions(
+        self,
+        read_tile: Callable[[Tuple[int, int, int, int]], np.ndarray],
+        windows: List[Tuple[int, int, int, int]],
+        tree_conf: float,
+        defect_conf: float,
+        batch_size: int = 8,
+        workers: Optional[int] = None,
+        reduced: bool = False,
+    ) -> Iterator[Tuple[List[Tuple[int, int, int, int]], List[np.ndarray], List, List]]:
+        """
+        Run both stages over tile windows on a pool of worker threads
+
+        Tiles are read lazily through ``read_tile`` and at most two batches per
+        worker are in flight, so memory stays bounded however large the image is.
+
+        Args:
+            read_tile: Returns the BGR pixels of an (x0, y0, x1, y1) window
+            windows: Tile windows to process
+            tree_conf: Confidence threshold for tree detection
+            defect_conf: Confidence threshold for defect detection
+            batch_size: Tiles per forward pass
+            workers: Tile worker threads (default: up to 4, limited by CPU threads)
+            reduced: Run the tiles at the degraded input size (see reduced_size)
+
+        Yields:
+            (windows, tiles, tree predictions, defect predictions) per batch, in
+            window order, with boxes already shifted to image coordinates
+        """
+        batches = [
+            windows[start : start + batch_size]
+            for start in range(0, len(windows), batch_size)
+        ]
+        if workers is None:
+            workers = min(4, self.num_threads)
+        workers = max(1, min(workers, len(batches)))
+        threads_per_worker = max(1, self.num_threads // workers)
+
+        def submit(pool, batch):
+            tiles = [read_tile(window) for window in batch]
+            future = pool.submit(
+                self._run_tile_batch,
+                threads_per_worker,
+                tiles,
+                tree_conf,
+                defect_conf,
+                reduced,
+            )
+            return batch, tiles, future
+
+        pool = self._tile_executor(workers)
+        pending = deque()
+        for batch in batches:
+            pending.append(submit(pool, batch))
+            if len(pending) < 2 * workers:
+                continue
+            yield self._collect_tile_batch(*pending.popleft())
+        while pending:
+            yield self._collect_tile_batch(*pending.popleft())
+
+    @staticmethod
+    def _collect_tile_batch(batch, tiles, future):
+        """Wait for a tile batch and shift its boxes to image coordinates"""
+        tree_preds, defect_preds = future.result()
+        return (
+            batch,
+            tiles,
+            [_offset_prediction(pred, window) for pred, window in zip(tree_preds, batch)],
+            [
+                _offset_prediction(pred, window)
+                for pred, window in zip(defect_preds, batch)
+            ],
+        )
+
+    def detect_tiled(
+        self,
+        image: ImageSource,
+        tree_conf: float = DEFAULT_TREE_CONF,
+        defect_conf: float = DEFAULT_DEFECT_CONF,
+        image_name: Optional[str] = None,
+        tile_size: int = 640,
+        overlap: float = 0.2,
+        batch_size: int = 8,
+        workers: Optional[int] = None,
+        coarse_scale: Optional[float] = None,
+        coarse_conf: float = 0.1,
+        budget_ms: Optional[float] = None,
+    ) -> Dict:
+        """
+        Run two-stage detection on overlapping tiles of a large image
+
+        Large aerial frames are otherwise squashed to the model input size and
+        small defects disappear. Tiles are batched through both models on a
+        pool of worker threads, boxes are mapped back to image coordinates and
+        duplicates across tile seams are merged before stage 3/4 matching.
+
+        Args:
+            image: Path, BGR numpy array, PIL image or encoded image bytes
+            tree_conf: Confidence threshold for tree detection
+            defect_conf: Confidence threshold for defect detection
+            image_name: Name to report for in-memory images (optional)
+            tile_size: Tile side in pixels
+            overlap: Fraction of each tile shared with its neighbour
+            batch_size: Tiles per forward pass
+            workers: Tile worker threads (default: up to 4, limited by CPU threads)
+            coarse_scale: Run the tree model on an overview downscaled by this
+                factor first and only process tiles that contain trees
+                (default: process every tile)
+            coarse_conf: Tree confidence threshold for the coarse pass
+            budget_ms: Latency budget. When full quality is not expected to fit,
+                detection steps down QUALITY_LEVELS: tiles at the reduced input
+                size, one whole-frame pass, then the tree stage alone
+
+        Returns:
+            Dictionary containing trees and their associated defects (same schema
+            as detect()), plus the number of tiles in the scene and processed
+        """
+        name = _image_name(image, image_name)
+        img = load_image(image)
+        height, width = img.shape[:2]
+        windows = tile_windows(width, height, tile_size, overlap)
+        total_tiles = len(windows)
+
+        print(f"\n{'='*60}")
+        print(f"Processing: {Path(name).name} ({width}x{height})")
+        print(f"  {total_tiles} tiles of {tile_size}px")
+        print(f"{'='*60}")
+
+        if coarse_scale:
+            overview = cv2.resize(
+                img,
+                (max(1, round(width * coarse_scale)), max(1, round(height * coarse_scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+            regions = self.find_tree_regions(overview, coarse_scale, coarse_conf)
+            windows = [windows[i] for i in select_windows(windows, regions)]
+            print(
+                f"  Coarse pass: {len(regions)} tree regions, skipping "
+                f"{total_tiles - len(windows)}/{total_tiles} tiles "
+                f"({1 - len(windows) / total_tiles:.0%})"
+            )
+
+        quality = self.choose_quality(budget_ms, tiles=len(windows))
+        if quality in ("no_tiles", "trees_only"):
+            print(f"  Latency budget {budget_ms:.0f} ms: {quality} quality")
+            tree_pred, defect_pred = self._detect_degraded(
+                img, tree_conf, defect_conf, quality
+            )
+            results = self._build_results(name, tree_pred, defect_pred, quality=quality)
+            results["tiles_total"] = total_tiles
+            results["tiles_processed"] = 0
+            return results
+        if quality != "full":
+            print(f"  Latency budget {budget_ms:.0f} ms: {quality} quality")
+
+        start = time.perf_counter()
+        tree_parts, defect_parts = [], []
+        for _, _, tree_preds, defect_preds in self.iter_tile_predictions(
+            lambda window: img[window[1] : window[3], window[0] : window[2]],
+            windows,
+            tree_conf,
+            defect_conf,
+            batch_size=batch_size,
+            workers=workers,
+            reduced=quality == "reduced_size",
         ):
+            tree_parts.extend(tree_preds)
+            defect_parts.extend(defect_preds)
+
+        results = self.merge_tile_results(
+            name, tree_parts, defect_parts, quality=quality
+        )
+        if windows:
+            # Per tile, including the seam merging and matching
+            tile_size_used = (
+                self.reduced_size(self.tree_imgsz)
+                if quality == "reduced_size"
+                else self.tree_imgsz
+            )
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._record_time("tile", tile_size_used, elapsed_ms / len(windows))
+        results["tiles_total"] = total_tiles
+        results["tiles_processed"] = len(windows)
+        return results
+
+    def merge_tile_results(
+        self,
+        name: str,
+        tree_parts: List[Tuple[np.ndarray, ...]],
+        defect_parts: List[Tuple[np.ndarray, ...]],
+        verbose: bool = True,
+        quality: str = "full",
+    ) -> Dict:
+        """
+        Merge per-tile predictions (in image coordinates) into one result
+
+        Duplicates across tile seams are merged before stage 3/4 matching.
+
+        Args:
+            name: Image name for the result
+            tree_parts: Tree model (boxes, confidences, class ids) per tile
+            defect_parts: Defect model (boxes, confidences, class ids) per tile
+            verbose: Print per-stage progress
+            quality: Quality level the tiles ran at (one of QUALITY_LEVELS)
+
+        Returns:
+            Dictionary containing trees and their associated defects
+        """
+        tree_pred = merge_tile_detections(*_concat_predictions(tree_parts))
+        defect_pred = merge_tile_detections(*_concat_predictions(defect_parts))
+        return self._build_results(
+            name, tree_pred, defect_pred, verbose=verbose, quality=quality
+        )
+
+    def _build_results(
+        self,
+        name: str,
+        tree_pred: Tuple[np.ndarray, ...],
+        defect_pred: Tuple[np.ndarray, ...],
+        verbose: bool = True,
+        quality: str = "full",
+    ) -> Dict:
+        """
+        Turn raw model predictions into the structured result dictionary
+
+        Args:
+            name: Image name for the result
+            tree_pred: Tree model (boxes, confidences, class ids)
+            defect_pred: Defect model (boxes, confidences, class ids)
+            verbose: Print per-stage progress
+            quality: Quality level the predictions were made at (one of
+                QUALITY_LEVELS); trees_only results mark their defects as
+                not evaluated
+
+        Returns:
+            Dictionary containing trees and their associated defects
+        """
+        log = print if verbose else (lambda *args, **kwargs: None)
+        tree_xyxy, tree_scores, _ = tree_pred
+        defect_xyxy, defect_scores, defect_cls = defect_pred
+
+        # Stage 1: Trees from the simple tree model
+        log(f"\nStage 1: Detecting trees...")
+        trees = []
+
+        for idx, (box, conf) in enumerate(zip(tree_xyxy, tree_scores)):
             tree_id = f"Tree_{idx + 1}"
             trees.append(
                 {
@@ -142,23 +1841,20 @@ class TwoStageDetector:
                 }
             )
 
-        print(f"  Found {len(trees)} trees")
+        log(f"  Found {len(trees)} trees")
 
-        # Stage 2: Detect defects and tree types using defect model
-        print(f"\nStage 2: Detecting defects and tree types...")
-        defect_results = self.defect_model(image_path, conf=defect_conf, verbose=False)
-
-        defect_boxes = defect_results[0].boxes
+        # Stage 2: Defects and tree types from the defect model
+        log(f"\nStage 2: Detecting defects and tree types...")
         class_names = self.defect_model.names
 
         # Separate detections into tree types and defects
         tree_type_detections = []
         defect_detections = []
+        tree_type_rows = []
+        defect_rows = []
 
-        for box, conf, cls in zip(
-            defect_boxes.xyxy.cpu().numpy(),
-            defect_boxes.conf.cpu().numpy(),
-            defect_boxes.cls.cpu().numpy(),
+        for row, (box, conf, cls) in enumerate(
+            zip(defect_xyxy, defect_scores, defect_cls)
         ):
             class_name = class_names[int(cls)]
 
@@ -170,60 +1866,65 @@ class TwoStageDetector:
 
             if class_name in self.tree_classes:
                 tree_type_detections.append(detection)
+                tree_type_rows.append(row)
             elif class_name in self.defect_classes:
                 defect_detections.append(detection)
+                defect_rows.append(row)
+
+        log(f"  Found {len(tree_type_detections)} tree type identifications")
+        log(f"  Found {len(defect_detections)} defects")
 
-        print(f"  Found {len(tree_type_detections)} tree type identifications")
-        print(f"  Found {len(defect_detections)} defects")
+        # Matching works on whole box arrays (float64, like the .tolist() values)
+        tree_boxes = np.asarray(tree_xyxy, dtype=np.float64).reshape(-1, 4)
+        defect_model_boxes = np.asarray(defect_xyxy, dtype=np.float64).reshape(-1, 4)
+        tree_type_boxes = defect_model_boxes[tree_type_rows]
+        defect_boxes = defect_model_boxes[defect_rows]
 
         # Stage 3: Map tree types to trees
-        print(f"\nStage 3: Mapping tree types to trees...")
-        for tree in trees:
-            tree_bbox = tree["bbox"]
-            best_match = None
-            best_iou = 0.0
-
-            for tree_type_det in tree_type_detections:
-                iou = self.calculate_iou(tree_bbox, tree_type_det["bbox"])
-                if iou > best_iou and iou > 0.3:
-                    best_iou = iou
-                    best_match = tree_type_det
-
-            if best_match:
+        log(f"\nStage 3: Mapping tree types to trees...")
+        best_types = match_tree_types(
+            tree_boxes, tree_type_boxes, iou_threshold=0.3, backend=self.assignment
+        )
+        for tree, best in zip(trees, best_types):
+            if best >= 0:
+                best_match = tree_type_detections[best]
                 tree["type"] = best_match["class"]
                 tree["type_confidence"] = best_match["confidence"]
 
         # Stage 4: Map defects to trees
-        print(f"\nStage 4: Mapping defects to trees...")
-        unmatched_defects = []
-
-        for defect in defect_detections:
-            defect_bbox = defect["bbox"]
-            matched = False
-
-            # Find which tree(s) contain this defect
-            for tree in trees:
-                if self.box_contains(tree["bbox"], defect_bbox):
-                    tree["defects"].append(
-                        {
-                            "type": defect["class"],
-                            "confidence": defect["confidence"],
-                            "bbox": defect["bbox"],
-                        }
-                    )
-                    matched = True
+        log(f"\nStage 4: Mapping defects to trees...")
+        tree_idx, defect_idx = match_defects(
+            tree_boxes, defect_boxes, backend=self.assignment
+        )
 
-            if not matched:
-                unmatched_defects.append(defect)
+        # A defect can belong to several trees
+        for t, d in zip(tree_idx, defect_idx):
+            defect = defect_detections[d]
+            trees[t]["defects"].append(
+                {
+                    "type": defect["class"],
+                    "confidence": defect["confidence"],
+                    "bbox": defect["bbox"],
+                }
+            )
+
+        matched = np.zeros(len(defect_detections), dtype=bool)
+        matched[defect_idx] = True
+        unmatched_defects = [
+            defect for defect, hit in zip(defect_detections, matched) if not hit
+        ]
 
         # Summary
         results = {
-            "image": str(image_path),
+            "image": name,
             "total_trees": len(trees),
             "total_defects": len(defect_detections),
             "trees": trees,
             "unmatched_defects": unmatched_defects,
+            "quality": quality,
         }
+        if quality == "trees_only":
+            results["defects"] = DEFECTS_NOT_EVALUATED
 
         return results
 
@@ -234,7 +1935,12 @@ class TwoStageDetector:
         print(f"{'='*60}")
         print(f"Image: {Path(results['image']).name}")
         print(f"Total Trees: {results['total_trees']}")
-        print(f"Total Defects: {results['total_defects']}")
+        if results.get("defects") == DEFECTS_NOT_EVALUATED:
+            print(f"Total Defects: {DEFECTS_NOT_EVALUATED}")
+        else:
+            print(f"Total Defects: {results['total_defects']}")
+        if results.get("quality", "full") != "full":
+            print(f"Quality: {results['quality']} (latency budget)")
         print(f"{'='*60}\n")
 
         if not results["trees"]:
@@ -251,7 +1957,9 @@ class TwoStageDetector:
             x1, y1, x2, y2 = tree["bbox"]
             print(f"│  BBox: [{x1:.0f}, {y1:.0f}, {x2:.0f}, {y2:.0f}]")
 
-            if tree["defects"]:
+            if results.get("defects") == DEFECTS_NOT_EVALUATED:
+                print(f"│  Defects: {DEFECTS_NOT_EVALUATED}")
+            elif tree["defects"]:
                 print(f"│  Defects ({len(tree['defects'])}):")
                 for i, defect in enumerate(tree["defects"], 1):
                     print(
@@ -268,95 +1976,101 @@ class TwoStageDetector:
                 print(f"  - {defect['class']} (conf: {defect['confidence']:.3f})")
             print()
 
-    def visualize(self, image_path: str, results: Dict, output_path: str = None):
+    def visualize(self, image: ImageSource, results: Dict, output_path: str = None):
         """
         Create visualization of detection results
 
         Args:
-            image_path: Path to original image
+            image: Original image (path, BGR numpy array, PIL image or encoded bytes)
             results: Detection results dictionary
-            output_path: Path to save visualization (optional)
-        """
-        img = cv2.imread(str(image_path))
-
-        # Color scheme
-        tree_color = (0, 255, 0)  # Green for trees
-        defect_color = (0, 0, 255)  # Red for defects
-
-        # Draw trees
-        for tree in results["trees"]:
-            x1, y1, x2, y2 = [int(v) for v in tree["bbox"]]
-
-            # Draw tree bounding box
-            cv2.rectangle(img, (x1, y1), (x2, y2), tree_color, 3)
-
-            # Label
-            label = f"{tree['id']}: {tree['type']}"
-            cv2.putText(
-                img, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, tree_color, 2
-            )
-
-            # Draw defects within this tree
-            for defect in tree["defects"]:
-                dx1, dy1, dx2, dy2 = [int(v) for v in defect["bbox"]]
-                cv2.rectangle(img, (dx1, dy1), (dx2, dy2), defect_color, 2)
-
-                defect_label = f"{defect['type'][:10]}"
-                cv2.putText(
-                    img,
-                    defect_label,
-                    (dx1, dy1 - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX,
-                    0.4,
-                    defect_color,
-                    1,
-                )
-
-        if output_path is None:
-            output_path = Path(image_path).stem + "_detected.jpg"
-
-        cv2.imwrite(str(output_path), img)
-        print(f"\nVisualization saved to: {output_path}")
+            output_path: Path to save visualization (optional). In-memory images
+                are only written to disk when an output path is given.
 
-        return img
+        Returns:
+            Annotated BGR image
+        """
+        return draw_results(image, results, output_path)
 
 
 def main():
     """Example usage"""
+    import argparse
     import sys
 
-    if len(sys.argv) < 2:
-        print(
-            "Usage: python two_stage_detection.py <image_path> [tree_model] [defect_model]"
-        )
-        print("\nExample:")
-        print("  python two_stage_detection.py image.jpg")
-        print(
-            "  python two_stage_detection.py image.jpg runs/detect/tree_detection_cpu/weights/best.pt runs/defects/tree_defects_detection/weights/best.pt"
-        )
-        sys.exit(1)
-
-    image_path = sys.argv[1]
-
-    # Default model paths
-    tree_model = (
-        sys.argv[2]
-        if len(sys.argv) > 2
-        else "runs/detect/tree_detection_cpu/weights/best.pt"
+    parser = argparse.ArgumentParser(
+        description="Two-stage tree and defect detection",
+        epilog="Examples:\n"
+        "  python two_stage_detection.py image.jpg\n"
+        "  python two_stage_detection.py images_folder/  # batched\n"
+        "  python two_stage_detection.py drone_frame.jpg --tile-size 640  # tiled\n"
+        "  python two_stage_detection.py image.jpg --unified-model runs/unified/unified_detection/weights/best.pt\n"
+        "  python two_stage_detection.py image.jpg runs/detect/tree_detection_cpu/weights/best.pt runs/defects/tree_defects_detection/weights/best.pt",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("image_path", help="Image file or folder of images")
+    parser.add_argument(
+        "tree_model",
+        nargs="?",
+        default="runs/detect/tree_detection_cpu/weights/best.pt",
+        help="Tree detection model",
+    )
+    parser.add_argument(
+        "defect_model",
+        nargs="?",
+        default="runs/defects/tree_defects_detection2/weights/best.pt",
+        help="Defect detection model",
+    )
+    parser.add_argument(
+        "--tile-size",
+        type=int,
+        default=0,
+        help="Sliced inference with tiles of this size, for large aerial images (0 = off)",
+    )
+    parser.add_argument(
+        "--overlap", type=float, default=0.2, help="Tile overlap fraction (default 0.2)"
+    )
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Run the defect model on crops of the detected trees only",
+    )
+    parser.add_argument(
+        "--unified-model",
+        help="Single model for trees, tree types and defects "
+        "(train_defects.py --unified); replaces both models",
     )
-    defect_model = (
-        sys.argv[3]
-        if len(sys.argv) > 3
-        else "runs/defects/tree_defects_detection2/weights/best.pt"
+    parser.add_argument(
+        "--coarse-scale",
+        type=float,
+        default=0,
+        help="With --tile-size: find trees on an overview downscaled by this "
+        "factor first and skip tiles without trees (0 = process every tile)",
     )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=0,
+        help="Latency budget: step down to a smaller input size, no tiles or "
+        "trees only when full quality won't fit (0 = always full quality)",
+    )
+    args = parser.parse_args()
+
+    image_path = args.image_path
+    tree_model = args.tree_model
+    defect_model = args.defect_model
 
     # Check if models exist
-    if not Path(tree_model).exists():
+    if args.unified_model:
+        if not Path(args.unified_model).exists():
+            print(f"Error: Unified model not found at {args.unified_model}")
+            print("Please train it first: python train_defects.py --unified")
+            sys.exit(1)
+    elif not Path(tree_model).exists():
         print(f"Error: Tree model not found at {tree_model}")
         print("Please train the tree model first: python train_cpu.py")
         sys.exit(1)
 
-    if not Path(defect_model).exists():
+    elif not Path(defect_model).exists():
         print(f"Error: Defect model not found at {defect_model}")
         print("Please train the defect model first: python train_defects.py")
         sys.exit(1)
@@ -366,18 +2080,71 @@ def main():
         print(f"Error: Image not found at {image_path}")
         sys.exit(1)
 
-    # Create detector
-    detector = TwoStageDetector(tree_model, defect_model)
+    # Create detector (performance and cache options from config.ini)
+    from config_loader import load_config
+
+    options = load_config().get_detector_options()
+    # The first image is the warm-up of a one-shot run, unless a latency
+    # budget needs the warm-up's timings
+    options["warmup"] = bool(args.budget_ms)
+    if args.cascade:
+        options["cascade"] = True
+    if args.unified_model:
+        options["unified_model_path"] = args.unified_model
+    detector = TwoStageDetector(tree_model, defect_model, **options)
+
+    # A folder of images is processed with batched forward passes
+    if Path(image_path).is_dir():
+        image_paths = sorted(
+            str(p)
+            for p in Path(image_path).iterdir()
+            if p.suffix.lower() in {".jpg", ".jpeg", ".png", ".bmp"}
+        )
+        all_results = detector.detect_batch(
+            image_paths, batch_size=8, tree_conf=0.25, defect_conf=0.05
+        )
+        for results in all_results:
+            print(
+                f"{Path(results['image']).name}: {results['total_trees']} trees, "
+                f"{results['total_defects']} defects"
+            )
+
+        json_path = f"results_{Path(image_path).name}.json"
+        with open(json_path, "w") as f:
+            json.dump(all_results, f, indent=2)
+        print(f"JSON results saved to: {json_path}")
+        return
+
+    # Decode once for detection and visualization
+    image = load_image(image_path)
 
     # Run detection
-    results = detector.detect(image_path, tree_conf=0.25, defect_conf=0.05)
+    if args.tile_size:
+        results = detector.detect_tiled(
+            image,
+            tree_conf=0.25,
+            defect_conf=0.05,
+            image_name=image_path,
+            tile_size=args.tile_size,
+            overlap=args.overlap,
+            coarse_scale=args.coarse_scale or None,
+            budget_ms=args.budget_ms or None,
+        )
+    else:
+        results = detector.detect(
+            image,
+            tree_conf=0.25,
+            defect_conf=0.05,
+            image_name=image_path,
+            budget_ms=args.budget_ms or None,
+        )
 
     # Print results
     detector.print_results(results)
 
     # Save visualization
     output_path = f"detected_{Path(image_path).name}"
-    detector.visualize(image_path, results, output_path)
+    detector.visualize(image, results, output_path)
 
     # Save JSON results
     json_path = f"results_{Path(image_path).stem}.json"
@@ -5,11 +5,9 @@ Streamlit interface for detecting trees and their defects
 """
 
 import streamlit as st
-from PIL import Image
 import cv2
 import numpy as np
 from pathlib import Path
-import tempfile
 import json
 import torch
 
@@ -21,7 +19,10 @@ try:
 except Exception:
     pass  # Older PyTorch versions don't have this
 
-from two_stage_detection import TwoStageDetector
+from two_stage_detection import load_image
+from admission import Overloaded
+from worker_pool import DetectorPool
+from config_loader import load_config
 
 # Page configuration
 st.set_page_config(page_title="Tree & Defect Detection", page_icon="🌲", layout="wide")
@@ -29,9 +30,11 @@ st.set_page_config(page_title="Tree & Defect Detection", page_icon="🌲", layou
 
 @st.cache_resource
 def load_detector(tree_model_path, defect_model_path):
-    """Load detector with caching"""
+    """Start the detector worker pool shared by all sessions"""
     try:
-        detector = TwoStageDetector(tree_model_path, defect_model_path)
+        detector = DetectorPool.from_config(
+            tree_model_path, defect_model_path, load_config()
+        )
         return detector, None
     except Exception as e:
         return None, str(e)
@@ -110,12 +113,14 @@ def main():
         tree_model, defect_model = find_models()
 
         if tree_model and defect_model:
-            st.success("✅ Tree Model")
-            st.success("✅ Defect Model")
-            detector, error = load_detector(tree_model, defect_model)
+            with st.spinner("Loading and warming up models..."):
+                detector, error = load_detector(tree_model, defect_model)
             if error:
                 st.error(f"Error loading models: {error}")
                 detector = None
+            else:
+                st.success("✅ Tree Model")
+                st.success("✅ Defect Model")
         else:
             if not tree_model:
                 st.error("❌ Tree Model Not Found")
@@ -178,32 +183,41 @@ def main():
     )
 
     if uploaded_file is not None:
-        # Load image
-        image = Image.open(uploaded_file)
-
-        # Save temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            image.save(tmp_file.name)
-            tmp_path = tmp_file.name
+        # Decode once, in memory
+        image_bytes = uploaded_file.getvalue()
+        # The pool workers get the encoded bytes (cheaper to send than
+        # pixels); the decoded image is only for drawing
+        image = load_image(image_bytes)
 
         # Display original image
         col1, col2 = st.columns([1, 1])
 
         with col1:
             st.subheader("📷 Original Image")
-            st.image(image, width=600)
+            st.image(image, width=600, channels="BGR")
 
         with col2:
             st.subheader("🎯 Detection Results")
 
+            # After the first run, slider changes re-render immediately: the
+            # detector answers them from its cache of raw detections
+            upload_key = (uploaded_file.name, uploaded_file.size)
             if st.button("🚀 Run Detection", type="primary", use_container_width=True):
+                st.session_state["detected_upload"] = upload_key
+
+            if st.session_state.get("detected_upload") == upload_key:
                 with st.spinner("Running two-stage detection..."):
                     try:
                         # Run detection
-                        results = detector.detect(tmp_path, tree_conf, defect_conf)
+                        results = detector.detect(
+                            image_bytes,
+                            tree_conf,
+                            defect_conf,
+                            image_name=uploaded_file.name,
+                        )
 
                         # Create visualization
-                        vis_img = detector.visualize(tmp_path, results)
+                        vis_img = detector.visualize(image, results)
                         vis_img_rgb = cv2.cvtColor(vis_img, cv2.COLOR_BGR2RGB)
 
                         # Display
@@ -213,6 +227,12 @@ def main():
                         st.session_state["results"] = results
                         st.session_state["vis_img"] = vis_img
 
+                    except Overloaded as e:
+                        st.warning(
+                            f"The server is busy, please retry in {e.retry_after}s"
+                        )
+                    except TimeoutError:
+                        st.warning("Detection took too long, please retry")
                     except Exception as e:
                         st.error(f"Error during detection: {str(e)}")
 
@@ -279,12 +299,6 @@ def main():
                     use_container_width=True,
                 )
 
-        # Cleanup
-        try:
-            Path(tmp_path).unlink()
-        except:
-            pass
-
     else:
         st.info("👆 Please upload an image to get started")
 
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Shared pool of detection worker processes
+Every Streamlit session dispatches to the same pool instead of calling one
+TwoStageDetector from many script threads. Each worker process loads its own
+detector and runs one request at a time, so the ultralytics predictors are
+never shared and sessions don't serialize on one interpreter's GIL. The pool
+admits requests through an AdmissionController (admission.py): excess
+requests wait in a bounded queue or are turned away with a retry-after hint,
+and each admitted request has a timeout.
+
+Workers don't share memory, so identical requests in flight are coalesced here
+before dispatch, and raw detections are shared through the persistent result
+cache, which multi-process pools require.
+
+Usage:
+    pool = DetectorPool.from_config(tree_model, defect_model, load_config())
+    results = pool.detect(image, 0.25, 0.25, image_name="photo.jpg")
+    vis_img = pool.visualize(image, results)
+"""
+
+import concurrent.futures
+import copy
+import hashlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from concurrent.futures import BrokenExecutor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+import torch
+
+from admission import AdmissionController, Ticket
+from result_cache import image_digest
+from singleflight import SingleFlight
+from two_stage_detection import (
+    DEFAULT_DEFECT_CONF,
+    DEFAULT_TREE_CONF,
+    ImageSource,
+    TwoStageDetector,
+    draw_results,
+)
+
+# Seconds a worker waits at startup for the others to finish loading
+STARTUP_TIMEOUT = 600
+
+# The detector of this worker process, built by _init_worker
+_detector: Optional[TwoStageDetector] = None
+_startup_barrier = None
+
+
+def _shutdown(executor, wait: bool):
+    """Stop an executor, cancelling the requests it hasn't started (Python 3.9+)"""
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=wait, cancel_futures=True)
+    else:
+        executor.shutdown(wait=wait)
+
+
+def _init_worker(detector_args: Dict, num_threads: int, barrier):
+    """Load this worker's detector (runs once per worker process)"""
+    global _detector, _startup_barrier
+    torch.set_num_threads(num_threads)
+    _detector = TwoStageDetector(**dict(detector_args, num_threads=num_threads))
+    _startup_barrier = barrier
+
+
+def _wait_ready() -> int:
+    """
+    Return once every worker has loaded its models
+
+    Each call blocks its worker at the barrier, so one call per worker can't be
+    picked up twice by the same process.
+    """
+    if _startup_barrier is not None:
+        _startup_barrier.wait(STARTUP_TIMEOUT)
+    return os.getpid()
+
+
+def _source_key(image: ImageSource) -> Optional[Hashable]:
+    """Content identity of an image source, or None if it can't be hashed cheaply"""
+    if isinstance(image, bytes):
+        return hashlib.blake2b(image, digest_size=20).hexdigest()
+    if isinstance(image, np.ndarray):
+        return image_digest(image)
+    if isinstance(image, (str, Path)):
+        path = Path(image)
+        try:
+            return (str(path.resolve()), path.stat().st_mtime_ns)
+        except OSError:
+            return None  # Let the worker report the missing file
+    return None
+
+
+def _detect(
+    image: ImageSource,
+    tree_conf: float,
+    defect_conf: float,
+    image_name: Optional[str],
+    budget_deadline: Optional[float],
+) -> Dict:
+    # The wait for admission and for a free worker used up part of the budget
+    budget_ms = None
+    if budget_deadline is not None:
+        budget_ms = max(0.0, (budget_deadline - time.time()) * 1000)
+    return _detector.detect(
+        image, tree_conf, defect_conf, image_name=image_name, budget_ms=budget_ms
+    )
+
+
+class DetectorPool:
+    """
+    Worker processes with one TwoStageDetector each, safe to share between threads
+
+    ``detect`` and ``visualize`` take the same arguments as the detector's, so
+    the pool is a drop-in replacement for a shared detector.
+    """
+
+    def __init__(
+        self,
+        detector_args: Dict,
+        workers: int = 2,
+        timeout: float = 120.0,
+        admission: Optional[AdmissionController] = None,
+    ):
+        """
+        Start the workers and wait until every one has loaded its models
+
+        Args:
+            detector_args: TwoStageDetector keyword arguments (model paths and
+                options). With worker processes, ``cache_path`` is required:
+                the persistent cache is how workers share raw detections.
+            workers: Worker processes. 0 runs a single detector in this process
+                behind the same queue (no extra memory, one request at a time).
+            timeout: Default seconds a request may take, including the wait
+                for admission
+            admission: Admission control in front of the workers (default:
+                AdmissionController defaults, at least one request per worker)
+
+        Raises:
+            ValueError: Worker processes without a persistent cache
+        """
+        self.detector_args = dict(detector_args)
+        self.workers = max(0, workers)
+        if self.workers and not self.detector_args.get("cache_path"):
+            raise ValueError(
+                "A pool of worker processes needs the persistent result cache "
+                "(cache_path): without it a threshold change on another worker "
+                "runs the models again"
+            )
+        self.timeout = timeout
+        self.admission = admission or AdmissionController(
+            min_limit=max(1, self.workers), initial_limit=max(1, self.workers)
+        )
+        # Torch threads are split between the workers so the cores aren't oversubscribed
+        total_threads = self.detector_args.get("num_threads") or torch.get_num_threads()
+        self.threads_per_worker = max(1, total_threads // max(1, self.workers))
+
+        # Identical requests from different sessions would otherwise land on
+        # different workers and both run the models
+        self.in_flight = SingleFlight()
+
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.timed_out = 0
+        self.restarts = 0
+        self.ready = threading.Event()
+
+        start = time.time()
+        self._executor = self._start()
+        print(
+            f"Detector pool ready in {time.time() - start:.1f}s: "
+            f"{max(1, self.workers)} worker(s) x {self.threads_per_worker} threads, "
+            f"admitting {self.admission.min_limit}-{self.admission.max_limit} "
+            f"requests at once, {self.admission.max_queue} queued"
+        )
+
+    @classmethod
+    def from_config(
+        cls, tree_model_path: str, defect_model_path: str, config
+    ) -> "DetectorPool":
+        """
+        Pool with the detector options, [pool] and [admission] settings of a Config
+
+        With the persistent cache disabled, the pool runs a single in-process
+        detector instead of worker processes (see __init__).
+        """
+        pool = config.get_pool_settings()
+        options = config.get_detector_options()
+        if pool["workers"] and not options["cache_path"]:
+            print(
+                "Warning: the detector pool needs the persistent cache "
+                "([cache] enabled = true), using one in-process detector"
+            )
+            pool["workers"] = 0
+        # Admitting fewer requests than there are workers would leave some idle
+        admission = config.get_admission_settings()
+        min_limit = max(admission["min_limit"], pool["workers"], 1)
+        admission = AdmissionController.from_settings(
+            admission,
+            min_limit=min_limit,
+            initial_limit=max(admission["initial_limit"], min_limit),
+            max_limit=max(admission["max_limit"], min_limit),
+        )
+        return cls(
+            dict(
+                tree_model_path=str(tree_model_path),
+                defect_model_path=str(defect_model_path),
+                **options,
+            ),
+            workers=pool["workers"],
+            timeout=pool["timeout"],
+            admission=admission,
+        )
+
+    def _start(self):
+        """Create the executor and block until all workers are loaded"""
+        self.ready.clear()
+        if self.workers == 0:
+            executor = ThreadPoolExecutor(
+                max_workers=1,
+                initializer=_init_worker,
+                initargs=(self.detector_args, self.threads_per_worker, None),
+            )
+            probes = 1
+        else:
+            # Spawned, not forked: a forked copy of a process with running torch
+            # thread pools (and Streamlit's threads) can deadlock
+            context = multiprocessing.get_context("spawn")
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(
+                    self.detector_args,
+                    self.threads_per_worker,
+                    context.Barrier(self.workers),
+                ),
+            )
+            probes = self.workers
+
+        try:
+            for future in [executor.submit(_wait_ready) for _ in range(probes)]:
+                future.result()
+        except BrokenExecutor:
+            _shutdown(executor, wait=False)
+            raise RuntimeError(
+                "Detection workers failed to load the models; see the log above"
+            ) from None
+        self.ready.set()
+        return executor
+
+    def _restart(self, broken) -> None:
+        """Replace a broken executor (a worker died) unless another caller already did"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self.restarts += 1
+        print("A detection worker died, restarting the pool...")
+        _shutdown(broken, wait=False)
+        executor = self._start()
+        with self._lock:
+            self._executor = executor
+
+    def _finish(self, ticket: Ticket, future: Future):
+        """Release an admitted request once its worker is done with it"""
+        failed = not future.cancelled() and future.exception() is not None
+        if not future.cancelled():
+            with self._lock:
+                self.completed += 1
+        # A detection error (e.g. an undecodable image) says nothing about load
+        self.admission.release(ticket, measure=ticket.dropped or not failed)
+
+    def detect(
+        self,
+        image: ImageSource,
+        tree_conf_threshold: float = DEFAULT_TREE_CONF,
+        defect_conf_threshold: float = DEFAULT_DEFECT_CONF,
+        image_name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        budget_ms: Optional[float] = None,
+    ) -> Dict:
+        """
+        Run TwoStageDetector.detect on a free worker
+
+        Args:
+            image: Image (path, BGR numpy array, PIL image or encoded bytes).
+                Arrays are copied to the worker; encoded bytes are cheaper to send.
+            tree_conf_threshold: Confidence threshold for tree detection
+            defect_conf_threshold: Confidence threshold for defect detection
+            image_name: Name recorded in the results
+            timeout: Seconds to wait for the result (default: the pool's timeout)
+            budget_ms: Latency budget, counted from this call: time spent
+                waiting for admission and a worker leaves less for detection,
+                which steps down to a faster quality level (see
+                TwoStageDetector.detect)
+
+        Returns:
+            Detection results dictionary, as from TwoStageDetector.detect
+
+        Raises:
+            Overloaded: The admission queue is full, or admission took longer
+                than the queue timeout; ``retry_after`` suggests when to retry
+            TimeoutError: The detection didn't finish within the timeout
+        """
+        request = (
+            image,
+            tree_conf_threshold,
+            defect_conf_threshold,
+            image_name,
+            timeout,
+            budget_ms,
+        )
+        source_key = _source_key(image)
+        if source_key is None:
+            return self._dispatch(*request)
+
+        # Concurrent identical requests (same image content, thresholds, name
+        # and budget) share one dispatch and one admission slot
+        results, joined = self.in_flight.do(
+            (source_key, *request[1:4], budget_ms), lambda: self._dispatch(*request)
+        )
+        # Each caller gets its own copy to keep in its session
+        return copy.deepcopy(results) if joined else results
+
+    def _dispatch(
+        self,
+        image: ImageSource,
+        tree_conf_threshold: float,
+        defect_conf_threshold: float,
+        image_name: Optional[str],
+        timeout: Optional[float],
+        budget_ms: Optional[float],
+    ) -> Dict:
+        """Admit one request and run it on a worker (see detect)"""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        # Wall clock: the worker processes compare against it
+        budget_deadline = None if budget_ms is None else time.time() + budget_ms / 1000
+        args = (
+            image,
+            tree_conf_threshold,
+            defect_conf_threshold,
+            image_name,
+            budget_deadline,
+        )
+        ticket = self.admission.acquire(min(timeout, self.admission.queue_timeout))
+
+        try:
+            try:
+                executor = self._executor
+                future = executor.submit(_detect, *args)
+            except BrokenExecutor:
+                # A worker died while idle; nothing of this request ran yet
+                self._restart(executor)
+                executor = self._executor
+                future = executor.submit(_detect, *args)
+        except BaseException:
+            self.admission.release(ticket, measure=False)
+            raise
+        # The request stays admitted until the worker is done, even if the caller gave up
+        future.add_done_callback(lambda done: self._finish(ticket, done))
+
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except concurrent.futures.TimeoutError:  # Not the builtin before Python 3.11
+            ticket.dropped = True  # Counts as overload when the worker finishes
+            future.cancel()  # Only drops it if no worker has started it yet
+            with self._lock:
+                self.timed_out += 1
+            raise TimeoutError(f"Detection did not finish within {timeout:g}s") from None
+        except BrokenExecutor:
+            self._restart(executor)
+            raise RuntimeError("The detection worker crashed; please retry") from None
+
+    def visualize(
+        self, image: ImageSource, results: Dict, output_path: Optional[str] = None
+    ) -> np.ndarray:
+        """Draw detection results locally (no worker needed), see draw_results"""
+        return draw_results(image, results, output_path)
+
+    def stats(self) -> Dict:
+        """Counters for monitoring"""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "completed": self.completed,
+                "timed_out": self.timed_out,
+                "restarts": self.restarts,
+                "coalesced": self.in_flight.coalesced,
+                "admission": self.admission.stats(),
+            }
+
+    def close(self):
+        """Stop the workers; queued requests are cancelled (Python 3.9+) or finished first"""
+        _shutdown(self._executor, wait=True)